@@ -645,6 +645,7 @@
     calendarMonthMeta.textContent = `Mes ${pad(monthStart.getMonth() + 1)} / Anio ${monthStart.getFullYear()}`;
     setMonthHero(monthStart);
 
+    const countBadges = {};
     for (let i = 0; i < 42; i++) {
       const day = new Date(start);
       day.setDate(start.getDate() + i);
@@ -659,6 +660,10 @@
       dayNumber.className = "calendar-day";
       dayNumber.textContent = day.getDate();
       header.appendChild(dayNumber);
+      const countBadge = document.createElement("span");
+      countBadge.className = "badge bg-light text-dark d-none";
+      header.appendChild(countBadge);
+      countBadges[formatDateYMD(day)] = countBadge;
       cell.appendChild(header);
       dayEvents.slice(0, 3).forEach((ev) => {
         const pill = document.createElement("span");
@@ -674,6 +679,41 @@
       });
       calendarGrid.appendChild(cell);
     }
+    const gridEnd = new Date(start);
+    gridEnd.setDate(start.getDate() + 42);
+    loadMonthSummary(start, gridEnd, countBadges);
+  }
+
+  // Conteos por dia/estado calculados en el servidor (no requiere descargar las citas del mes).
+  let monthSummaryRequest = 0;
+  async function loadMonthSummary(rangeStart, rangeEnd, countBadges) {
+    const slug = getWorkspaceSlug();
+    if (!slug) return;
+    const requestId = ++monthSummaryRequest;
+    const params = new URLSearchParams({
+      from: formatLocalPayload(rangeStart),
+      to: formatLocalPayload(rangeEnd),
+      tz: clientTimeZone,
+    });
+    try {
+      const res = await fetch(`${getApiBase()}/summary?${params.toString()}`, {
+        headers: { Accept: "application/json", "X-Timezone": clientTimeZone },
+      });
+      const data = await res.json().catch(() => ({}));
+      if (!res.ok) throw new Error(data.error || `Error ${res.status}`);
+      if (requestId !== monthSummaryRequest) return;
+      (data.buckets || []).forEach((bucket) => {
+        const badge = countBadges[bucket.date];
+        if (!badge || !bucket.total) return;
+        badge.textContent = String(bucket.total);
+        badge.title = Object.entries(bucket.by_status || {})
+          .map(([status, total]) => `${STATUS_LABELS[status] || status}: ${total}`)
+          .join("\n");
+        badge.classList.remove("d-none");
+      });
+    } catch (err) {
+      console.warn("No se pudo cargar el resumen del mes:", err?.message || err);
+    }
   }
 
   function renderTimeline(view) {
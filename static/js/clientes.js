@@ -11,6 +11,8 @@
   const hintEl = $('clientesListHint')
   const searchInput = $('clientesSearchInput')
   const refreshBtn = $('clientesRefreshBtn')
+  const loadMoreBtn = $('clientesLoadMoreBtn')
+  const sortSelect = $('clientesSortSelect')
   const createForm = $('clientesCreateForm')
   const createStatus = $('clientesCreateStatus')
 
@@ -108,11 +110,17 @@
     const blacklistChip = client.blacklisted
       ? '<span class="badge text-bg-danger mt-1">Lista negra</span>'
       : ''
+    const activityLine = client.next_appointment_at
+      ? `<div class="small text-primary text-truncate">Próxima: ${escapeHtml(fmtDate(client.next_appointment_at))}</div>`
+      : client.last_appointment_at
+        ? `<div class="small text-muted text-truncate">Última: ${escapeHtml(fmtDate(client.last_appointment_at))}</div>`
+        : ''
     btn.innerHTML = `
           <div class="d-flex justify-content-between align-items-start gap-2">
         <div style="min-width:0;">
           <div class="fw-semibold text-truncate">${escapeHtml(client.full_name || '')}</div>
           <div class="small text-muted text-truncate">${escapeHtml(client.phone || client.email || client.id_number || '')}</div>
+          ${activityLine}
           ${blacklistChip}
         </div>
         <span class="badge text-bg-light">${client.id}</span>
@@ -130,26 +138,45 @@
       .replaceAll('"', '&quot;')
       .replaceAll("'", '&#39;')
 
-  const loadClients = async () => {
+  // La lista solo muestra estas columnas; el detalle se pide aparte.
+  const LIST_FIELDS = 'id,full_name,phone,email,id_number,blacklisted,next_appointment_at,last_appointment_at'
+  let nextCursor = null
+  let loadedCount = 0
+
+  const loadClients = async (append = false) => {
     if (!listEl) return
-    listEl.innerHTML = ''
+    if (!append) {
+      listEl.innerHTML = ''
+      nextCursor = null
+      loadedCount = 0
+    }
+    loadMoreBtn && (loadMoreBtn.disabled = true)
     setText(hintEl, 'Cargando...', '')
     const q = (searchInput?.value || '').trim()
     const url = new URL(api('/clientes'), window.location.origin)
+    url.searchParams.set('fields', LIST_FIELDS)
     if (q) url.searchParams.set('q', q)
+    else if (sortSelect?.value) url.searchParams.set('sort', sortSelect.value)
+    if (append && nextCursor) url.searchParams.set('cursor', nextCursor)
     try {
       const res = await fetch(url.toString(), { headers: { Accept: 'application/json' } })
       const data = await res.json().catch(() => ({}))
       if (!res.ok) throw new Error(data.error || `Error ${res.status}`)
       const items = Array.isArray(data.clients) ? data.clients : []
-      if (!items.length) {
+      nextCursor = data.next_cursor || null
+      loadedCount += items.length
+      if (!loadedCount) {
         setText(hintEl, q ? 'Sin resultados.' : 'Sin clientes aún.', '')
-        return
+      } else {
+        const total = data.total_estimate && data.total_estimate > loadedCount ? ` de ~${data.total_estimate}` : ''
+        setText(hintEl, `${loadedCount}${total} cliente(s)`, '')
       }
-      setText(hintEl, `${items.length} cliente(s)`, '')
       items.forEach((c) => listEl.appendChild(renderClientItem(c)))
     } catch (err) {
       setText(hintEl, err?.message || 'No se pudo cargar', '')
+    } finally {
+      loadMoreBtn && loadMoreBtn.classList.toggle('d-none', !nextCursor)
+      loadMoreBtn && (loadMoreBtn.disabled = false)
     }
   }
 
@@ -159,37 +186,20 @@
     })
   }
 
-  const renderNotes = (notes) => {
-    if (!notesListEl) return
-    notesListEl.innerHTML = ''
-    const items = Array.isArray(notes) ? notes : []
-    if (!items.length) {
-      notesListEl.innerHTML = '<div class="small text-muted">Sin notas.</div>'
-      return
-    }
-    items.forEach((n) => {
-      const div = document.createElement('div')
-      div.className = 'border rounded-3 p-2 mb-2'
-      div.innerHTML = `
+  const noteItem = (n) => {
+    const div = document.createElement('div')
+    div.className = 'border rounded-3 p-2 mb-2'
+    div.innerHTML = `
         <div class="small text-muted mb-1">${escapeHtml(fmtDate(n.created_at))}</div>
         <div>${escapeHtml(n.body)}</div>
       `
-      notesListEl.appendChild(div)
-    })
+    return div
   }
 
-  const renderAppts = (appts) => {
-    if (!apptsListEl) return
-    apptsListEl.innerHTML = ''
-    const items = Array.isArray(appts) ? appts : []
-    if (!items.length) {
-      apptsListEl.innerHTML = '<div class="small text-muted">Sin citas asociadas.</div>'
-      return
-    }
-    items.forEach((a) => {
-      const div = document.createElement('div')
-      div.className = 'border rounded-3 p-2 mb-2'
-      div.innerHTML = `
+  const apptItem = (a) => {
+    const div = document.createElement('div')
+    div.className = 'border rounded-3 p-2 mb-2'
+    div.innerHTML = `
         <div class="d-flex justify-content-between gap-2">
           <div class="fw-semibold">${escapeHtml(a.title || '')}</div>
           <span class="badge text-bg-light">${escapeHtml(a.status || '')}</span>
@@ -197,10 +207,62 @@
         <div class="small text-muted">${escapeHtml(fmtDate(a.start_time))} → ${escapeHtml(fmtDate(a.end_time))}</div>
         ${a.description ? `<div class="small mt-1">${escapeHtml(a.description)}</div>` : ''}
       `
-      apptsListEl.appendChild(div)
+    return div
+  }
+
+  // Lista paginada del detalle: pinta una pagina y, si hay cursor, un boton "Ver más" que pide la siguiente.
+  const renderPaged = (container, items, nextCursor, { renderItem, emptyText, path, key }, append = false) => {
+    if (!container) return
+    container.querySelector('[data-load-more]')?.remove()
+    if (!append) container.innerHTML = ''
+    const list = Array.isArray(items) ? items : []
+    if (!append && !list.length) {
+      container.innerHTML = `<div class="small text-muted">${emptyText}</div>`
+      return
+    }
+    list.forEach((item) => container.appendChild(renderItem(item)))
+    if (!nextCursor) return
+    const more = document.createElement('button')
+    more.type = 'button'
+    more.className = 'btn btn-link btn-sm px-0'
+    more.dataset.loadMore = '1'
+    more.textContent = 'Ver más'
+    more.addEventListener('click', async () => {
+      if (!selectedClient?.id) return
+      more.disabled = true
+      const clientId = selectedClient.id
+      try {
+        const res = await fetch(api(`/clientes/${clientId}/${path}?cursor=${encodeURIComponent(nextCursor)}`), {
+          headers: { Accept: 'application/json' },
+        })
+        const data = await res.json().catch(() => ({}))
+        if (!res.ok) throw new Error(data.error || `Error ${res.status}`)
+        if (selectedClient?.id !== clientId) return
+        renderPaged(container, data[key], data.next_cursor, { renderItem, emptyText, path, key }, true)
+      } catch (err) {
+        more.disabled = false
+        more.textContent = err?.message || 'No se pudo cargar'
+      }
     })
+    container.appendChild(more)
   }
 
+  const renderNotes = (notes, nextCursor) =>
+    renderPaged(notesListEl, notes, nextCursor, {
+      renderItem: noteItem,
+      emptyText: 'Sin notas.',
+      path: 'notas',
+      key: 'notes',
+    })
+
+  const renderAppts = (appts, nextCursor) =>
+    renderPaged(apptsListEl, appts, nextCursor, {
+      renderItem: apptItem,
+      emptyText: 'Sin citas asociadas.',
+      path: 'citas',
+      key: 'appointments',
+    })
+
   const showDetail = (data) => {
     selectedClient = data?.client || null
     const client = selectedClient
@@ -230,8 +292,8 @@
     setText(addressEl, client.address)
     notesEl && (notesEl.textContent = client.notes || '—')
 
-    renderNotes(data.notes)
-    renderAppts(data.appointments)
+    renderNotes(data.notes, data.notes_next_cursor)
+    renderAppts(data.appointments, data.appointments_next_cursor)
   }
 
   const selectClient = async (clientId) => {
@@ -281,6 +343,8 @@
   })
 
   refreshBtn?.addEventListener('click', () => void loadClients())
+  loadMoreBtn?.addEventListener('click', () => void loadClients(true))
+  sortSelect?.addEventListener('change', () => void loadClients())
   searchInput?.addEventListener('keydown', (e) => {
     if (e.key === 'Enter') {
       e.preventDefault()
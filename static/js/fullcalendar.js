@@ -206,12 +206,18 @@
 
   const fetchEvents = async (info, success, failure) => {
     try {
-      const res = await fetch(apiBase(), { headers: { Accept: 'application/json', 'X-Timezone': clientTimeZone } })
+      const params = new URLSearchParams()
+      if (info?.startStr) params.set('from', info.startStr)
+      if (info?.endStr) params.set('to', info.endStr)
+      const query = params.toString()
+      const url = query ? `${apiBase()}?${query}` : apiBase()
+      const res = await fetch(url, { headers: { Accept: 'application/json', 'X-Timezone': clientTimeZone } })
       const data = await res.json().catch(() => [])
       if (!res.ok) throw new Error(data?.error || `Error ${res.status}`)
 
       const events = (Array.isArray(data) ? data : []).map((a) => ({
-        id: String(a.id),
+        // Ocurrencias virtuales de series recurrentes no tienen id hasta que se editan
+        id: a.virtual ? `series-${a.series_id}-${a.occurrence_start}` : String(a.id),
         title: a.title || '(Sin título)',
         start: a.start_time,
         end: a.end_time,
@@ -221,6 +227,9 @@
           status: a.status,
           description: a.description || '',
           client_id: a.client_id ?? null,
+          series_id: a.series_id ?? null,
+          occurrence_start: a.occurrence_start ?? null,
+          virtual: Boolean(a.virtual),
         },
       }))
       success(events)
@@ -239,6 +248,23 @@
     alert('No se encontró el formulario de creación (calendar.js)')
   }
 
+  const occurrenceUrl = (event) => {
+    const props = event?.extendedProps || {}
+    return `${apiBase()}/series/${encodeURIComponent(props.series_id)}/occurrences/${encodeURIComponent(props.occurrence_start)}`
+  }
+
+  // Materializa una ocurrencia virtual (la convierte en cita real) y devuelve la cita creada
+  const materializeOccurrence = async (event, payload = {}) => {
+    const res = await fetch(occurrenceUrl(event), {
+      method: 'PUT',
+      headers: { 'Content-Type': 'application/json', Accept: 'application/json', 'X-Timezone': clientTimeZone },
+      body: JSON.stringify(payload),
+    })
+    const data = await res.json().catch(() => ({}))
+    if (!res.ok) throw new Error(data.error || `Error ${res.status}`)
+    return data
+  }
+
   const updateEvent = async (event) => {
     const id = event?.id
     if (!id) return
@@ -250,6 +276,11 @@
       start_time: toIsoWithLocalOffset(event.start),
       end_time: toIsoWithLocalOffset(event.end || event.start),
     }
+    if (event.extendedProps?.virtual) {
+      await materializeOccurrence(event, payload)
+      calendar?.refetchEvents()
+      return
+    }
     const base = apiBase()
     const url = `${base}/${encodeURIComponent(id)}`
     const res = await fetch(url, {
@@ -266,7 +297,7 @@
     if (!id) return
     if (!confirm('¿Eliminar esta cita?')) return
     const base = apiBase()
-    const url = `${base}/${encodeURIComponent(id)}`
+    const url = event.extendedProps?.virtual ? occurrenceUrl(event) : `${base}/${encodeURIComponent(id)}`
     const res = await fetch(url, { method: 'DELETE', headers: { Accept: 'application/json', 'X-Timezone': clientTimeZone } })
     const data = await res.json().catch(() => ({}))
     if (!res.ok) throw new Error(data.error || `Error ${res.status}`)
@@ -341,8 +372,9 @@
           // Reutilizar el mismo formulario/estilo del panel (cartillas + modal)
           if (typeof window.openEdit === 'function') {
             const ev = info.event
+            const appointmentId = ev.extendedProps?.virtual ? (await materializeOccurrence(ev)).id : ev.id
             window.openEdit(
-              Number(ev.id),
+              Number(appointmentId),
               String(ev.title || ''),
               String(ev.extendedProps?.description || ''),
               toIso(ev.start),
@@ -1,7 +1,7 @@
 import logging
 from pathlib import Path
 
-from flask import Flask, g, session, request
+from flask import Flask, g, jsonify, session, request
 
 from .config import config
 from .routes.calendar import calendar_bp
@@ -10,6 +10,11 @@ from .routes.health import health_bp
 from .routes.ui import ui_bp
 from .routes.whatsapp import whatsapp_bp
 from .routes.clientes import clientes_bp
+from .routes.knowledge import knowledge_bp
+from .services import duplicates as duplicates_service
+from .services import maintenance as maintenance_service
+from .services import reminders as reminders_service
+from .services.workspaces import WorkspaceProvisioningError
 
 
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -37,6 +42,14 @@ def create_app() -> Flask:
     app.register_blueprint(health_bp)
     app.register_blueprint(whatsapp_bp)
     app.register_blueprint(clientes_bp)
+    app.register_blueprint(knowledge_bp)
+
+    if config.REMINDER_SCHEDULER_ENABLED:
+        reminders_service.start_scheduler()
+    if config.DUPLICATE_SCAN_INTERVAL_HOURS > 0:
+        duplicates_service.start_scheduler()
+    if config.MAINTENANCE_INTERVAL_MINUTES > 0:
+        maintenance_service.start_scheduler()
 
     @app.context_processor
     def inject_globals():
@@ -57,6 +70,10 @@ def create_app() -> Flask:
             response.headers["Access-Control-Allow-Methods"] = "GET,POST,PUT,DELETE,OPTIONS"
         return response
 
+    @app.errorhandler(WorkspaceProvisioningError)
+    def _workspace_not_provisioned(ex):
+        return jsonify({"error": "workspace_no_provisionado", "schema": str(ex)}), 503
+
     @app.before_request
     def _load_workspace_context():
         workspace_schema = session.get("workspace_schema")
@@ -12,8 +12,214 @@ def _core_sql_statements():
     schema = config.CORE_SCHEMA
     return [
         'CREATE EXTENSION IF NOT EXISTS "pgcrypto";',
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS "unaccent" SCHEMA public;
+        EXCEPTION
+            WHEN OTHERS THEN
+                RAISE NOTICE 'unaccent no disponible; las busquedas no ignoraran acentos';
+        END$$;
+        """,
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS "vector" SCHEMA public;
+        EXCEPTION
+            WHEN OTHERS THEN
+                RAISE NOTICE 'pgvector no disponible; file_chunks usara indice en memoria';
+        END$$;
+        """,
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS "btree_gist" SCHEMA public;
+        EXCEPTION
+            WHEN OTHERS THEN
+                RAISE NOTICE 'btree_gist no disponible; la prevencion de solapes por recurso no estara disponible';
+        END$$;
+        """,
+        """
+        DO $$
+        BEGIN
+            CREATE EXTENSION IF NOT EXISTS "pg_trgm" SCHEMA public;
+        EXCEPTION
+            WHEN OTHERS THEN
+                RAISE NOTICE 'pg_trgm no disponible; la busqueda de clientes no usara indice de trigramas';
+        END$$;
+        """,
         f"CREATE SCHEMA IF NOT EXISTS {schema};",
         f"SET search_path TO {schema};",
+        f"""
+        DO $$
+        BEGIN
+            IF to_regprocedure('public.unaccent(regdictionary, text)') IS NOT NULL THEN
+                CREATE OR REPLACE FUNCTION {schema}.immutable_unaccent(value TEXT)
+                RETURNS TEXT AS $f$
+                    SELECT public.unaccent('public.unaccent'::regdictionary, coalesce(value, ''))
+                $f$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+            ELSE
+                CREATE OR REPLACE FUNCTION {schema}.immutable_unaccent(value TEXT)
+                RETURNS TEXT AS $f$
+                    SELECT coalesce(value, '')
+                $f$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+            END IF;
+        END$$;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.files_search_document(p_filename TEXT, p_tags TEXT[], p_notes TEXT)
+        RETURNS tsvector AS $$
+            SELECT
+                setweight(to_tsvector('spanish', {schema}.immutable_unaccent(p_filename)), 'A')
+                || setweight(to_tsvector('spanish', {schema}.immutable_unaccent(array_to_string(p_tags, ' '))), 'B')
+                || setweight(to_tsvector('spanish', {schema}.immutable_unaccent(p_notes)), 'C')
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.clients_search_text(p_full_name TEXT, p_id_number TEXT, p_phone TEXT, p_email TEXT)
+        RETURNS TEXT AS $$
+            SELECT lower({schema}.immutable_unaccent(
+                coalesce(p_full_name, '') || ' ' || coalesce(p_id_number, '') || ' ' || coalesce(p_phone, '') || ' ' || coalesce(p_email, '')
+            ))
+        $$ LANGUAGE sql IMMUTABLE PARALLEL SAFE;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.touch_updated_at()
+        RETURNS trigger AS $$
+        BEGIN
+            NEW.updated_at := NOW();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.stamp_change_xid()
+        RETURNS trigger AS $$
+        BEGIN
+            NEW.change_xid := pg_current_xact_id();
+            RETURN NEW;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.log_appointment_deletion()
+        RETURNS trigger AS $$
+        BEGIN
+            EXECUTE format('INSERT INTO %I.appointment_deletions (appointment_id) VALUES ($1)', TG_TABLE_SCHEMA)
+            USING OLD.id;
+            RETURN OLD;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.bump_collection_version()
+        RETURNS trigger AS $$
+        BEGIN
+            EXECUTE format(
+                'INSERT INTO %I.collection_versions AS cv (collection, version, updated_at) VALUES ($1, 1, NOW()) ON CONFLICT (collection) DO UPDATE SET version = cv.version + 1, updated_at = NOW()',
+                TG_TABLE_SCHEMA
+            ) USING TG_ARGV[0];
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.sync_appointment_reminders()
+        RETURNS trigger AS $$
+        DECLARE
+            offsets INTEGER[];
+        BEGIN
+            IF TG_OP = 'UPDATE' AND NEW.start_time IS NOT DISTINCT FROM OLD.start_time AND NEW.status IS NOT DISTINCT FROM OLD.status THEN
+                RETURN NULL;
+            END IF;
+            -- Si cambia la hora se reprograman todos (incluidos los enviados); si solo cambia el estado, solo los pendientes
+            IF TG_OP = 'UPDATE' AND NEW.start_time IS DISTINCT FROM OLD.start_time THEN
+                EXECUTE format('DELETE FROM %I.appointment_reminders WHERE appointment_id = $1', TG_TABLE_SCHEMA) USING NEW.id;
+            ELSE
+                EXECUTE format('DELETE FROM %I.appointment_reminders WHERE appointment_id = $1 AND sent_at IS NULL', TG_TABLE_SCHEMA) USING NEW.id;
+            END IF;
+            IF NEW.status::text = 'cancelada' THEN
+                RETURN NULL;
+            END IF;
+            EXECUTE format(
+                'SELECT ARRAY(SELECT (jsonb_array_elements_text(value->''offsets_minutes''))::int) FROM %I.calendar_settings WHERE key = ''reminders''',
+                TG_TABLE_SCHEMA
+            ) INTO offsets;
+            offsets := COALESCE(NULLIF(offsets, '{{}}'), ARRAY[1440, 120]);
+            EXECUTE format(
+                'INSERT INTO %I.appointment_reminders (appointment_id, offset_minutes, due_at) SELECT $1, o, $2 - make_interval(mins => o) FROM unnest($3::int[]) AS o WHERE $2 - make_interval(mins => o) > NOW() ON CONFLICT (appointment_id, offset_minutes) DO NOTHING',
+                TG_TABLE_SCHEMA
+            ) USING NEW.id, NEW.start_time, offsets;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.refresh_client_activity(p_schema TEXT, p_client_ids INTEGER[])
+        RETURNS void AS $$
+        BEGIN
+            IF p_client_ids IS NULL OR cardinality(p_client_ids) = 0 THEN
+                RETURN;
+            END IF;
+            EXECUTE format(
+                'INSERT INTO %1$I.client_activity (client_id, last_appointment_at, next_appointment_at, appointment_count, no_show_count, note_count, refreshed_at)
+                 SELECT c.id, a.last_at, a.next_at, a.total, a.no_shows, n.total, NOW()
+                 FROM %1$I.clients c
+                 CROSS JOIN LATERAL (
+                     SELECT max(start_time) FILTER (WHERE start_time <= NOW() AND status::text NOT IN (''cancelada'', ''no_show'')) AS last_at,
+                            min(start_time) FILTER (WHERE start_time > NOW() AND status::text NOT IN (''cancelada'', ''no_show'')) AS next_at,
+                            count(*) FILTER (WHERE status::text <> ''cancelada'') AS total,
+                            count(*) FILTER (WHERE status::text = ''no_show'') AS no_shows
+                     FROM %1$I.appointments WHERE client_id = c.id
+                 ) a
+                 CROSS JOIN LATERAL (SELECT count(*) AS total FROM %1$I.client_notes WHERE client_id = c.id) n
+                 WHERE c.id = ANY($1)
+                 ON CONFLICT (client_id) DO UPDATE SET
+                     last_appointment_at = EXCLUDED.last_appointment_at,
+                     next_appointment_at = EXCLUDED.next_appointment_at,
+                     appointment_count = EXCLUDED.appointment_count,
+                     no_show_count = EXCLUDED.no_show_count,
+                     note_count = EXCLUDED.note_count,
+                     refreshed_at = EXCLUDED.refreshed_at',
+                p_schema
+            ) USING p_client_ids;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
+        f"""
+        CREATE OR REPLACE FUNCTION {schema}.sync_client_activity()
+        RETURNS trigger AS $$
+        DECLARE
+            ids INTEGER[];
+        BEGIN
+            IF TG_OP = 'INSERT' THEN
+                SELECT array_agg(DISTINCT client_id) INTO ids FROM new_rows WHERE client_id IS NOT NULL;
+            ELSIF TG_OP = 'DELETE' THEN
+                SELECT array_agg(DISTINCT client_id) INTO ids FROM old_rows WHERE client_id IS NOT NULL;
+            ELSIF TG_TABLE_NAME = 'appointments' THEN
+                SELECT array_agg(DISTINCT cid) INTO ids
+                FROM (
+                    SELECT unnest(ARRAY[n.client_id, o.client_id]) AS cid
+                    FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE n.client_id IS DISTINCT FROM o.client_id
+                       OR n.start_time IS DISTINCT FROM o.start_time
+                       OR n.status IS DISTINCT FROM o.status
+                ) changed
+                WHERE cid IS NOT NULL;
+            ELSE
+                SELECT array_agg(DISTINCT cid) INTO ids
+                FROM (
+                    SELECT unnest(ARRAY[n.client_id, o.client_id]) AS cid
+                    FROM new_rows n JOIN old_rows o ON o.id = n.id
+                    WHERE n.client_id IS DISTINCT FROM o.client_id
+                ) changed
+                WHERE cid IS NOT NULL;
+            END IF;
+            PERFORM {schema}.refresh_client_activity(TG_TABLE_SCHEMA, ids);
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+        """,
         """
         CREATE TABLE IF NOT EXISTS app_users (
             id UUID PRIMARY KEY DEFAULT gen_random_uuid(),
@@ -88,6 +294,8 @@ def _core_sql_statements():
         RETURNS VOID AS $$
         DECLARE
             clean_schema TEXT := regexp_replace(btrim(p_schema), '\\s+', '_', 'g');
+            versioned_table TEXT;
+            embedding_type TEXT;
         BEGIN
             IF clean_schema IS NULL OR clean_schema = '' THEN
                 RAISE EXCEPTION 'Nombre de schema invalido';
@@ -174,6 +382,223 @@ def _core_sql_statements():
                 WHEN undefined_table THEN NULL;
                 WHEN undefined_column THEN NULL;
             END;
+
+            -- Busqueda full-text de archivos (nombre + tags + notas)
+            EXECUTE 'ALTER TABLE IF EXISTS files ADD COLUMN IF NOT EXISTS search_tsv tsvector GENERATED ALWAYS AS ({schema}.files_search_document(filename, tags, notes)) STORED';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS files_search_tsv_idx ON files USING GIN (search_tsv)';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS files_tags_idx ON files USING GIN (tags)';
+
+            -- Huella del contenido/metadatos ya indexados por n8n (re-ingesta incremental)
+            EXECUTE 'ALTER TABLE IF EXISTS files ADD COLUMN IF NOT EXISTS ingest_fingerprint TEXT';
+            EXECUTE 'ALTER TABLE IF EXISTS files ADD COLUMN IF NOT EXISTS ingest_pending_fingerprint TEXT';
+            EXECUTE 'ALTER TABLE IF EXISTS files ADD COLUMN IF NOT EXISTS ingest_pending_at TIMESTAMPTZ';
+            EXECUTE 'ALTER TABLE IF EXISTS files ADD COLUMN IF NOT EXISTS ingested_at TIMESTAMPTZ';
+
+            -- Consultas por rango de fechas (solapamiento) y por cliente
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointments_start_end_idx ON appointments (start_time, end_time)';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointments_period_idx ON appointments USING GIST (tstzrange(start_time, greatest(start_time, end_time), ''[)''))';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointments_client_start_idx ON appointments (client_id, start_time)';
+
+            -- Sincronizacion incremental: updated_at siempre al dia + registro de borrados (tombstones)
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointments_updated_at_idx ON appointments (updated_at, id)';
+            EXECUTE 'CREATE TABLE IF NOT EXISTS appointment_deletions (id BIGSERIAL PRIMARY KEY, appointment_id INTEGER NOT NULL, deleted_at TIMESTAMPTZ NOT NULL DEFAULT NOW())';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointment_deletions_deleted_at_idx ON appointment_deletions (deleted_at, id)';
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointments_touch_updated_at'
+                  AND tgrelid = format('%I.appointments', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointments_touch_updated_at BEFORE UPDATE ON appointments FOR EACH ROW EXECUTE FUNCTION {schema}.touch_updated_at()';
+            END IF;
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointments_log_deletion'
+                  AND tgrelid = format('%I.appointments', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointments_log_deletion AFTER DELETE ON appointments FOR EACH ROW EXECUTE FUNCTION {schema}.log_appointment_deletion()';
+            END IF;
+
+            -- Recurso (veterinario, sala...) y configuracion opcional de prevencion de solapes por workspace
+            EXECUTE 'ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS resource TEXT';
+            EXECUTE 'CREATE TABLE IF NOT EXISTS calendar_settings (key TEXT PRIMARY KEY, value JSONB NOT NULL, updated_at TIMESTAMPTZ DEFAULT NOW())';
+
+            -- Horario de atencion (plantilla semanal, weekday 0=lunes) y excepciones por fecha (open_time NULL = cerrado)
+            EXECUTE 'CREATE TABLE IF NOT EXISTS business_hours (id SERIAL PRIMARY KEY, weekday SMALLINT NOT NULL CHECK (weekday BETWEEN 0 AND 6), open_time TIME NOT NULL, close_time TIME NOT NULL CHECK (close_time > open_time))';
+            EXECUTE 'CREATE TABLE IF NOT EXISTS business_hours_exceptions (id SERIAL PRIMARY KEY, day DATE NOT NULL, open_time TIME, close_time TIME, CHECK ((open_time IS NULL AND close_time IS NULL) OR close_time > open_time))';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS business_hours_exceptions_day_idx ON business_hours_exceptions (day)';
+
+            -- Series recurrentes (RRULE): una fila por serie; solo las ocurrencias editadas se materializan en appointments
+            EXECUTE 'CREATE TABLE IF NOT EXISTS appointment_series (id SERIAL PRIMARY KEY, title TEXT NOT NULL, description TEXT, start_time TIMESTAMPTZ NOT NULL, duration_minutes INTEGER NOT NULL CHECK (duration_minutes > 0), rrule TEXT NOT NULL, timezone TEXT NOT NULL, until TIMESTAMPTZ, status appointment_status NOT NULL DEFAULT ''programada'', client_id INTEGER REFERENCES clients(id) ON DELETE SET NULL, resource TEXT, created_at TIMESTAMPTZ DEFAULT NOW(), updated_at TIMESTAMPTZ DEFAULT NOW())';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointment_series_period_idx ON appointment_series USING GIST (tstzrange(start_time, until, ''[)''))';
+            EXECUTE 'CREATE TABLE IF NOT EXISTS appointment_series_exdates (series_id INTEGER NOT NULL REFERENCES appointment_series(id) ON DELETE CASCADE, occurrence_start TIMESTAMPTZ NOT NULL, PRIMARY KEY (series_id, occurrence_start))';
+            EXECUTE 'ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS series_id INTEGER';
+            EXECUTE 'ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS occurrence_start TIMESTAMPTZ';
+            BEGIN
+                EXECUTE 'ALTER TABLE appointments ADD CONSTRAINT appointments_series_id_fkey FOREIGN KEY (series_id) REFERENCES appointment_series(id) ON DELETE CASCADE';
+            EXCEPTION
+                WHEN duplicate_object THEN NULL;
+            END;
+            EXECUTE 'CREATE UNIQUE INDEX IF NOT EXISTS appointments_series_occurrence_idx ON appointments (series_id, occurrence_start) WHERE series_id IS NOT NULL';
+
+            -- Version por coleccion (ETag/Last-Modified de los listados), incrementada por triggers de sentencia
+            EXECUTE 'CREATE TABLE IF NOT EXISTS collection_versions (collection TEXT PRIMARY KEY, version BIGINT NOT NULL DEFAULT 0, updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW())';
+            FOREACH versioned_table IN ARRAY ARRAY['appointments', 'clients', 'files', 'appointment_series'] LOOP
+                IF NOT EXISTS (
+                    SELECT 1 FROM pg_trigger
+                    WHERE tgname = versioned_table || '_bump_version'
+                      AND tgrelid = format('%I.%I', clean_schema, versioned_table)::regclass
+                ) THEN
+                    EXECUTE format(
+                        'CREATE TRIGGER %I AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON %I FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_collection_version(%L)',
+                        versioned_table || '_bump_version', versioned_table, versioned_table
+                    );
+                END IF;
+            END LOOP;
+            -- Cancelar una ocurrencia (EXDATE) cambia el feed de series aunque la fila de la serie no cambie
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointment_series_exdates_bump_version'
+                  AND tgrelid = format('%I.appointment_series_exdates', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointment_series_exdates_bump_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON appointment_series_exdates FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_collection_version(''appointment_series'')';
+            END IF;
+
+            -- Recordatorios (uno por offset antes de start_time); el trigger los reprograma al crear/mover/cancelar la cita
+            EXECUTE 'CREATE TABLE IF NOT EXISTS appointment_reminders (id BIGSERIAL PRIMARY KEY, appointment_id INTEGER NOT NULL REFERENCES appointments(id) ON DELETE CASCADE, offset_minutes INTEGER NOT NULL, due_at TIMESTAMPTZ NOT NULL, sent_at TIMESTAMPTZ, attempts INTEGER NOT NULL DEFAULT 0, last_error TEXT, created_at TIMESTAMPTZ DEFAULT NOW(), UNIQUE (appointment_id, offset_minutes))';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointment_reminders_due_idx ON appointment_reminders (due_at) WHERE sent_at IS NULL';
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointments_sync_reminders'
+                  AND tgrelid = format('%I.appointments', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointments_sync_reminders AFTER INSERT OR UPDATE OF start_time, status ON appointments FOR EACH ROW EXECUTE FUNCTION {schema}.sync_appointment_reminders()';
+                -- Citas futuras existentes al activar los recordatorios (offsets por defecto)
+                EXECUTE 'INSERT INTO appointment_reminders (appointment_id, offset_minutes, due_at) SELECT a.id, o, a.start_time - make_interval(mins => o) FROM appointments a CROSS JOIN unnest(ARRAY[1440, 120]) AS o WHERE a.status::text <> ''cancelada'' AND a.start_time - make_interval(mins => o) > NOW() ON CONFLICT DO NOTHING';
+            END IF;
+
+            -- Busqueda de clientes: texto normalizado (sin acentos, minusculas) con indice de trigramas si hay pg_trgm
+            EXECUTE 'ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS search_text TEXT GENERATED ALWAYS AS ({schema}.clients_search_text(full_name, id_number, phone, email)) STORED';
+            IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm') THEN
+                EXECUTE 'CREATE INDEX IF NOT EXISTS clients_search_trgm_idx ON clients USING GIN (search_text public.gin_trgm_ops)';
+            END IF;
+
+            -- Identificacion unica (tipo + documento sin mayusculas); con duplicados previos el indice queda pendiente
+            BEGIN
+                EXECUTE 'CREATE UNIQUE INDEX IF NOT EXISTS clients_identification_key ON clients (id_type, lower(id_number))';
+            EXCEPTION
+                WHEN unique_violation THEN
+                    RAISE NOTICE 'clients con identificacion duplicada en %; ver /api/clientes/duplicates', clean_schema;
+            END;
+
+            -- Telefono normalizado a E.164 (lo completa la app al escribir) para buscar por remitente de WhatsApp
+            EXECUTE 'ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS phone_e164 TEXT';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS clients_phone_e164_idx ON clients (phone_e164) WHERE phone_e164 IS NOT NULL';
+
+            -- Paginacion por keyset de clientes: (updated_at, id) sin NULLs y con indice en el mismo orden
+            IF EXISTS (SELECT 1 FROM clients WHERE updated_at IS NULL) THEN
+                EXECUTE 'UPDATE clients SET updated_at = coalesce(created_at, NOW()) WHERE updated_at IS NULL';
+            END IF;
+            EXECUTE 'ALTER TABLE IF EXISTS clients ALTER COLUMN updated_at SET DEFAULT NOW()';
+            -- SET NOT NULL recorre la tabla con ACCESS EXCLUSIVE: solo si la columna aun admite NULL
+            IF EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = to_regclass(format('%I.clients', clean_schema))
+                  AND attname = 'updated_at' AND NOT attnotnull
+            ) THEN
+                EXECUTE 'ALTER TABLE clients ALTER COLUMN updated_at SET NOT NULL';
+            END IF;
+            EXECUTE 'CREATE INDEX IF NOT EXISTS clients_updated_id_idx ON clients (updated_at DESC, id DESC)';
+
+            -- Notas por cliente (detalle y exportacion), mas recientes primero
+            EXECUTE 'CREATE INDEX IF NOT EXISTS client_notes_client_created_idx ON client_notes (client_id, created_at DESC, id DESC)';
+
+            -- Resumen de actividad por cliente (ultima/proxima cita, conteos) para listar y ordenar sin N+1
+            EXECUTE 'CREATE TABLE IF NOT EXISTS client_activity (client_id INTEGER PRIMARY KEY REFERENCES clients(id) ON DELETE CASCADE, last_appointment_at TIMESTAMPTZ, next_appointment_at TIMESTAMPTZ, appointment_count INTEGER NOT NULL DEFAULT 0, no_show_count INTEGER NOT NULL DEFAULT 0, note_count INTEGER NOT NULL DEFAULT 0, refreshed_at TIMESTAMPTZ NOT NULL DEFAULT NOW())';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS client_activity_next_idx ON client_activity (next_appointment_at, client_id) WHERE next_appointment_at IS NOT NULL';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS client_activity_last_idx ON client_activity (last_appointment_at DESC, client_id DESC) WHERE last_appointment_at IS NOT NULL';
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointments_activity_insert'
+                  AND tgrelid = format('%I.appointments', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointments_activity_insert AFTER INSERT ON appointments REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                EXECUTE 'CREATE TRIGGER appointments_activity_update AFTER UPDATE ON appointments REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                EXECUTE 'CREATE TRIGGER appointments_activity_delete AFTER DELETE ON appointments REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                EXECUTE 'CREATE TRIGGER client_notes_activity_insert AFTER INSERT ON client_notes REFERENCING NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                EXECUTE 'CREATE TRIGGER client_notes_activity_update AFTER UPDATE ON client_notes REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                EXECUTE 'CREATE TRIGGER client_notes_activity_delete AFTER DELETE ON client_notes REFERENCING OLD TABLE AS old_rows FOR EACH STATEMENT EXECUTE FUNCTION {schema}.sync_client_activity()';
+                -- Clientes con historial previo a la tabla
+                PERFORM {schema}.refresh_client_activity(
+                    clean_schema,
+                    ARRAY(SELECT client_id FROM appointments WHERE client_id IS NOT NULL UNION SELECT client_id FROM client_notes)
+                );
+            END IF;
+
+            -- Cola de revision de posibles clientes duplicados (la llena el escaneo por bloques; ON DELETE CASCADE al fusionar)
+            EXECUTE 'CREATE TABLE IF NOT EXISTS client_duplicate_candidates (id BIGSERIAL PRIMARY KEY, client_a INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE, client_b INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE, score REAL NOT NULL, reasons TEXT[] NOT NULL DEFAULT ''{{}}'', status TEXT NOT NULL DEFAULT ''pendiente'' CHECK (status IN (''pendiente'', ''descartado'')), detected_at TIMESTAMPTZ NOT NULL DEFAULT NOW(), reviewed_at TIMESTAMPTZ, UNIQUE (client_a, client_b), CHECK (client_a < client_b))';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS client_duplicate_candidates_review_idx ON client_duplicate_candidates (status, score DESC, id)';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS client_duplicate_candidates_client_b_idx ON client_duplicate_candidates (client_b)';
+
+            -- Chunks de archivos (RAG): vector(dims) con indice HNSW si hay pgvector; si no, REAL[] y busqueda por fuerza bruta en la app.
+            -- Las dimensiones llegan en `vetflow.embedding_dimensions` (set_config de la app); 1536 por defecto.
+            IF to_regclass(format('%I.file_chunks', clean_schema)) IS NULL THEN
+                IF EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'vector') THEN
+                    embedding_type := format('public.vector(%s)', coalesce(nullif(current_setting('vetflow.embedding_dimensions', true), ''), '1536')::int);
+                ELSE
+                    embedding_type := 'REAL[]';
+                END IF;
+                EXECUTE format('CREATE TABLE file_chunks (id BIGSERIAL PRIMARY KEY, file_id INTEGER NOT NULL REFERENCES files(id) ON DELETE CASCADE, chunk_index INTEGER NOT NULL DEFAULT 0, content TEXT NOT NULL, start_offset INTEGER, end_offset INTEGER, embedding %s NOT NULL, metadata JSONB, created_at TIMESTAMPTZ DEFAULT NOW())', embedding_type);
+            END IF;
+            EXECUTE 'CREATE INDEX IF NOT EXISTS file_chunks_file_id_idx ON file_chunks (file_id, chunk_index)';
+            EXECUTE 'ALTER TABLE file_chunks ADD COLUMN IF NOT EXISTS content_tsv tsvector GENERATED ALWAYS AS (to_tsvector(''spanish'', {schema}.immutable_unaccent(content))) STORED';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS file_chunks_content_tsv_idx ON file_chunks USING GIN (content_tsv)';
+            IF EXISTS (
+                SELECT 1 FROM pg_attribute
+                WHERE attrelid = format('%I.file_chunks', clean_schema)::regclass
+                  AND attname = 'embedding'
+                  AND atttypid = to_regtype('public.vector')
+            ) THEN
+                EXECUTE 'CREATE INDEX IF NOT EXISTS file_chunks_embedding_hnsw_idx ON file_chunks USING hnsw (embedding public.vector_cosine_ops)';
+            END IF;
+            -- La version de `file_chunks` invalida el indice en memoria de los procesos (backend sin pgvector)
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'file_chunks_bump_version'
+                  AND tgrelid = format('%I.file_chunks', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER file_chunks_bump_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON file_chunks FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_collection_version(''file_chunks'')';
+            END IF;
+
+            -- Cursor de /changes por orden de commit: xid (xid8) de la ultima transaccion que escribio la fila.
+            -- Lo que esta por debajo de pg_snapshot_xmin ya termino, asi que un cursor nunca salta filas de transacciones largas.
+            EXECUTE 'ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id()';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointments_change_xid_idx ON appointments (change_xid, id)';
+            EXECUTE 'ALTER TABLE IF EXISTS appointment_deletions ADD COLUMN IF NOT EXISTS change_xid xid8 NOT NULL DEFAULT pg_current_xact_id()';
+            EXECUTE 'CREATE INDEX IF NOT EXISTS appointment_deletions_change_xid_idx ON appointment_deletions (change_xid, id)';
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'appointments_stamp_change_xid'
+                  AND tgrelid = format('%I.appointments', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER appointments_stamp_change_xid BEFORE UPDATE ON appointments FOR EACH ROW EXECUTE FUNCTION {schema}.stamp_change_xid()';
+            END IF;
+
+            -- Lease de entrega de recordatorios: se reclaman (commit) antes de llamar al webhook, sin retener locks durante el envio
+            EXECUTE 'ALTER TABLE IF EXISTS appointment_reminders ADD COLUMN IF NOT EXISTS claimed_until TIMESTAMPTZ';
+
+            -- UID iCalendar de citas importadas: reimportar el mismo .ics no duplica (ON CONFLICT sobre este indice)
+            EXECUTE 'ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS ical_uid TEXT';
+            EXECUTE 'CREATE UNIQUE INDEX IF NOT EXISTS appointments_ical_uid_idx ON appointments (ical_uid) WHERE ical_uid IS NOT NULL';
+
+            -- client_activity cambia tambien sin escrituras de citas (el job de mantenimiento pasa la proxima cita vencida a ultima):
+            -- su propia version entra en el ETag del listado de clientes
+            IF NOT EXISTS (
+                SELECT 1 FROM pg_trigger
+                WHERE tgname = 'client_activity_bump_version'
+                  AND tgrelid = format('%I.client_activity', clean_schema)::regclass
+            ) THEN
+                EXECUTE 'CREATE TRIGGER client_activity_bump_version AFTER INSERT OR UPDATE OR DELETE OR TRUNCATE ON client_activity FOR EACH STATEMENT EXECUTE FUNCTION {schema}.bump_collection_version(''client_activity'')';
+            END IF;
         END;
         $$ LANGUAGE plpgsql;
         """,
@@ -22,6 +22,7 @@ class Config:
         self.EVOLUTION_RABBITMQ_ENABLED = rabbitmq_enabled in ("1", "true", "yes", "on")
         rabbitmq_events_raw = os.getenv("EVOLUTION_RABBITMQ_EVENTS", "").strip()
         self.EVOLUTION_RABBITMQ_EVENTS = [e.strip() for e in rabbitmq_events_raw.split(",") if e.strip()] if rabbitmq_events_raw else []
+        self.EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", 1536))
         self.DB_SCHEMA = os.getenv("DB_SCHEMA", "vetbot")
         self.CORE_SCHEMA = os.getenv("CORE_SCHEMA", "vetflow_core")
         self.WORKSPACE_SCHEMA_PREFIX = os.getenv("WORKSPACE_SCHEMA_PREFIX", "ws")
@@ -44,6 +45,17 @@ class Config:
         self.API_PORT = int(os.getenv("API_PORT", 5000))
         self.SECRET_KEY = os.getenv("FLASK_SECRET_KEY", "dev-secret")
         self.APP_TIMEZONE = os.getenv("APP_TIMEZONE", "UTC")
+        # Codigo de pais para normalizar telefonos nacionales a E.164 (ej. "57"); vacio = solo numeros internacionales
+        self.DEFAULT_PHONE_COUNTRY_CODE = os.getenv("DEFAULT_PHONE_COUNTRY_CODE", "")
+        # Recordatorios de citas: URL que recibe cada recordatorio (vacia = solo se registran en el log)
+        self.REMINDER_WEBHOOK_URL = os.getenv("REMINDER_WEBHOOK_URL", "")
+        reminder_scheduler = os.getenv("REMINDER_SCHEDULER_ENABLED", "0").lower().strip()
+        self.REMINDER_SCHEDULER_ENABLED = reminder_scheduler in ("1", "true", "yes", "on")
+        self.REMINDER_POLL_SECONDS = int(os.getenv("REMINDER_POLL_SECONDS", 60))
+        # Escaneo periodico de clientes duplicados (horas entre pasadas; 0 = solo bajo demanda)
+        self.DUPLICATE_SCAN_INTERVAL_HOURS = int(os.getenv("DUPLICATE_SCAN_INTERVAL_HOURS", 0))
+        # Mantenimiento periodico por workspace (poda de tombstones de /changes, actividad de clientes vencida); 0 = desactivado
+        self.MAINTENANCE_INTERVAL_MINUTES = int(os.getenv("MAINTENANCE_INTERVAL_MINUTES", 60))
         auto_workspace = os.getenv("AUTO_CREATE_DEFAULT_WORKSPACE", "0").lower()
         self.AUTO_CREATE_DEFAULT_WORKSPACE = auto_workspace in ("1", "true", "yes", "on")
 
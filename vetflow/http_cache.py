@@ -0,0 +1,76 @@
+import hashlib
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+from flask import Response, jsonify, request
+
+from .db import _resolve_schema, get_db
+
+logger = logging.getLogger(__name__)
+
+
+def collection_versions(collections: Sequence[str]) -> Optional[Dict[str, Tuple[int, Optional[datetime]]]]:
+    """
+    Lee la version de cada coleccion desde `collection_versions` (mantenida por triggers de sentencia).
+    Devuelve None si la tabla no existe aun (schema sin provisionar): el llamador sirve sin cache.
+    """
+    try:
+        with get_db() as conn:
+            rows = conn.execute(
+                "SELECT collection, version, updated_at FROM collection_versions WHERE collection = ANY(%s)",
+                (list(collections),),
+            ).fetchall()
+    except Exception as ex:
+        logger.debug("collection_versions no disponible: %s", ex)
+        return None
+    found = {r["collection"]: (int(r["version"]), r["updated_at"]) for r in rows}
+    return {name: found.get(name, (0, None)) for name in collections}
+
+
+def _etag_for(versions: Dict[str, Tuple[int, Optional[datetime]]], extra: str = "") -> str:
+    # La respuesta depende tambien de los filtros y de la zona horaria (X-Timezone cambia los offsets ISO).
+    parts = [_resolve_schema(), request.query_string.decode("latin-1"), request.headers.get("X-Timezone") or "", extra]
+    parts.extend(f"{name}={version}" for name, (version, _) in sorted(versions.items()))
+    return hashlib.sha1("|".join(parts).encode("utf-8")).hexdigest()
+
+
+def conditional_response(collections: Sequence[str], build: Callable[[Optional[str]], Response], extra: str = "") -> Response:
+    """
+    GET condicional generico: compara If-None-Match / If-Modified-Since con la version de las colecciones
+    y responde 304 sin ejecutar `build` si no hubo cambios. `build` recibe el ETag (None si no hay
+    versiones disponibles) para poder usarlo como clave de cache. `extra` entra en el ETag para respuestas
+    que dependen de algo mas que las colecciones (p. ej. una ventana relativa a la fecha actual); en ese
+    caso If-Modified-Since no alcanza y solo se valida por ETag.
+    """
+    versions = collection_versions(collections)
+    if versions is None:
+        return build(None)
+
+    etag = _etag_for(versions, extra)
+    stamps = [updated_at for _, updated_at in versions.values() if updated_at]
+    last_modified = max(stamps).astimezone(timezone.utc).replace(microsecond=0) if stamps else None
+
+    not_modified = False
+    if request.if_none_match:
+        not_modified = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified and not extra:
+        # Last-Modified tiene resolucion de segundos: solo se confia en el si ese segundo ya termino.
+        settled = last_modified + timedelta(seconds=1) <= datetime.now(timezone.utc)
+        not_modified = settled and last_modified <= request.if_modified_since
+
+    response = Response(status=304) if not_modified else build(etag)
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = last_modified
+    response.headers["Cache-Control"] = "private, no-cache"
+    response.vary.add("X-Timezone")
+    return response
+
+
+def conditional_json(collections: Sequence[str], build: Callable[[], Any]) -> Response:
+    """
+    GET condicional para listados: responde 304 sin ejecutar `build` (ni la consulta ni el JSON)
+    si las colecciones no cambiaron.
+    """
+    return conditional_response(collections, lambda _etag: jsonify(build()))
@@ -0,0 +1,257 @@
+"""
+Utilidades minimas de iCalendar (RFC 5545) para el feed `.ics` y el importador: escape y plegado de
+lineas al generar, y lectura en streaming de VEVENTs al importar.
+"""
+import re
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+CRLF = "\r\n"
+_DURATION_RE = re.compile(r"^([+-])?P(?:(\d+)W)?(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+)S)?)?$")
+
+
+def escape_text(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace(";", "\\;")
+        .replace(",", "\\,")
+        .replace("\r\n", "\\n")
+        .replace("\n", "\\n")
+    )
+
+
+def unescape_text(value: str) -> str:
+    out = []
+    chars = iter(value)
+    for char in chars:
+        if char != "\\":
+            out.append(char)
+            continue
+        nxt = next(chars, "")
+        out.append("\n" if nxt in ("n", "N") else nxt)
+    return "".join(out)
+
+
+def fold_line(line: str) -> str:
+    """Pliega una linea de contenido a 75 octetos (continuaciones con un espacio inicial)."""
+    encoded = line.encode("utf-8")
+    if len(encoded) <= 75:
+        return line + CRLF
+    parts = []
+    current = ""
+    size = 0
+    limit = 75
+    for char in line:
+        char_size = len(char.encode("utf-8"))
+        if size + char_size > limit:
+            parts.append(current)
+            current, size, limit = " ", 1, 75
+        current += char
+        size += char_size
+    parts.append(current)
+    return CRLF.join(parts) + CRLF
+
+
+def format_utc(value: datetime) -> str:
+    return value.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+
+
+def format_local(value: datetime, tz: ZoneInfo) -> str:
+    return value.astimezone(tz).strftime("%Y%m%dT%H%M%S")
+
+
+def vevent(properties: List[Tuple[str, str]]) -> str:
+    """Serializa un VEVENT a partir de (nombre[;params], valor ya escapado)."""
+    lines = ["BEGIN:VEVENT"] + [f"{name}:{value}" for name, value in properties if value != ""] + ["END:VEVENT"]
+    return "".join(fold_line(line) for line in lines)
+
+
+def _format_offset(offset: timedelta) -> str:
+    seconds = int(offset.total_seconds())
+    sign = "-" if seconds < 0 else "+"
+    hours, rest = divmod(abs(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{sign}{hours:02d}{minutes:02d}" + (f"{seconds:02d}" if seconds else "")
+
+
+def _offset_transitions(tz: ZoneInfo, start: datetime, end: datetime) -> Iterator[datetime]:
+    """Instantes (UTC, al minuto) en que cambia el offset de `tz` dentro de [start, end)."""
+    step = timedelta(days=1)
+    current = start.astimezone(timezone.utc).replace(second=0, microsecond=0)
+    end = end.astimezone(timezone.utc)
+    while current < end:
+        following = min(current + step, end)
+        if current.astimezone(tz).utcoffset() != following.astimezone(tz).utcoffset():
+            # Busqueda binaria del minuto exacto del cambio dentro del dia.
+            low, high = current, following
+            while high - low > timedelta(minutes=1):
+                middle = low + (high - low) / 2
+                middle = middle.replace(second=0, microsecond=0)
+                if middle.astimezone(tz).utcoffset() == low.astimezone(tz).utcoffset():
+                    low = middle
+                else:
+                    high = middle
+            yield high
+        current = following
+
+
+def vtimezone(tz_name: str, start: datetime, end: datetime) -> str:
+    """
+    VTIMEZONE (RFC 5545 3.6.5) para un TZID usado en el feed, derivado de zoneinfo: una observancia con el
+    offset vigente en `start` y una por cada cambio de offset hasta `end`. Cubre solo ese rango; fuera de el
+    los clientes aplican la ultima observancia.
+    """
+    tz = ZoneInfo(tz_name)
+    first = start.astimezone(tz)
+    observances = [(first.replace(tzinfo=None, microsecond=0), first.utcoffset(), first.utcoffset(), first)]
+    for moment in _offset_transitions(tz, start, end):
+        before = (moment - timedelta(minutes=1)).astimezone(tz).utcoffset()
+        local = moment.astimezone(tz)
+        # DTSTART de la observancia va en la hora local previa al cambio.
+        observances.append(((moment + before).replace(tzinfo=None), before, local.utcoffset(), local))
+    lines = ["BEGIN:VTIMEZONE", f"TZID:{tz_name}"]
+    for onset, offset_from, offset_to, local in observances:
+        kind = "DAYLIGHT" if local.dst() else "STANDARD"
+        lines += [
+            f"BEGIN:{kind}",
+            f"DTSTART:{onset.strftime('%Y%m%dT%H%M%S')}",
+            f"TZOFFSETFROM:{_format_offset(offset_from)}",
+            f"TZOFFSETTO:{_format_offset(offset_to)}",
+        ]
+        if local.tzname():
+            lines.append(f"TZNAME:{escape_text(local.tzname())}")
+        lines.append(f"END:{kind}")
+    lines.append("END:VTIMEZONE")
+    return "".join(fold_line(line) for line in lines)
+
+
+def calendar_header(name: str) -> str:
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Vetflow//Agenda//ES",
+        "CALSCALE:GREGORIAN",
+        "METHOD:PUBLISH",
+        f"X-WR-CALNAME:{escape_text(name)}",
+    ]
+    return "".join(fold_line(line) for line in lines)
+
+
+def calendar_footer() -> str:
+    return "END:VCALENDAR" + CRLF
+
+
+def _unfolded_lines(chunks: Iterable[bytes]) -> Iterator[str]:
+    pending: Optional[str] = None
+    for raw in chunks:
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+        if line.startswith((" ", "\t")) and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending
+        pending = line
+    if pending is not None:
+        yield pending
+
+
+def _split_property(line: str) -> Tuple[str, Dict[str, str], str]:
+    head, _, value = line.partition(":")
+    name, *params = head.split(";")
+    parsed = {}
+    for param in params:
+        key, _, param_value = param.partition("=")
+        parsed[key.upper()] = param_value.strip('"')
+    return name.upper(), parsed, value
+
+
+def parse_datetime_value(value: str, params: Dict[str, str], default_tz: ZoneInfo) -> Tuple[datetime, bool]:
+    """Devuelve (datetime aware, es_fecha_sin_hora)."""
+    value = value.strip()
+    if params.get("VALUE", "").upper() == "DATE" or re.fullmatch(r"\d{8}", value):
+        day = datetime.strptime(value, "%Y%m%d")
+        return day.replace(tzinfo=default_tz), True
+    if value.endswith("Z"):
+        return datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc), False
+    tz = default_tz
+    if params.get("TZID"):
+        try:
+            tz = ZoneInfo(params["TZID"])
+        except (ZoneInfoNotFoundError, ValueError):
+            raise ValueError(f"tzid_desconocido: {params['TZID']}")
+    return datetime.strptime(value, "%Y%m%dT%H%M%S").replace(tzinfo=tz), False
+
+
+def parse_duration(value: str) -> timedelta:
+    match = _DURATION_RE.match(value.strip())
+    if not match:
+        raise ValueError(f"duration_invalida: {value}")
+    sign, weeks, days, hours, minutes, seconds = match.groups()
+    delta = timedelta(
+        weeks=int(weeks or 0), days=int(days or 0), hours=int(hours or 0), minutes=int(minutes or 0), seconds=int(seconds or 0)
+    )
+    return -delta if sign == "-" else delta
+
+
+def iter_vevents(chunks: Iterable[bytes]) -> Iterator[List[Tuple[str, Dict[str, str], str]]]:
+    """Recorre un .ics en streaming y entrega las propiedades de cada VEVENT (ignora VALARM, VTIMEZONE, etc.)."""
+    current: Optional[List[Tuple[str, Dict[str, str], str]]] = None
+    nested = 0
+    for line in _unfolded_lines(chunks):
+        if not line:
+            continue
+        name, params, value = _split_property(line)
+        if name == "BEGIN":
+            if value.upper() == "VEVENT" and current is None:
+                current = []
+            elif current is not None:
+                nested += 1
+            continue
+        if name == "END":
+            if value.upper() == "VEVENT" and current is not None and nested == 0:
+                yield current
+                current = None
+            elif nested:
+                nested -= 1
+            continue
+        if current is not None and nested == 0:
+            current.append((name, params, value))
+
+
+def vevent_to_appointment(properties: List[Tuple[str, Dict[str, str], str]], default_tz: ZoneInfo) -> Dict[str, Any]:
+    """Convierte un VEVENT a payload de cita (mismo formato que POST /api/calendar)."""
+    props = {}
+    for name, params, value in properties:
+        props.setdefault(name, (params, value))
+    if "RRULE" in props:
+        raise ValueError("recurrencia_no_soportada: importar como serie")
+    if "DTSTART" not in props:
+        raise ValueError("dtstart_requerido")
+    start, all_day = parse_datetime_value(props["DTSTART"][1], props["DTSTART"][0], default_tz)
+    if "DTEND" in props:
+        end, _ = parse_datetime_value(props["DTEND"][1], props["DTEND"][0], default_tz)
+    elif "DURATION" in props:
+        end = start + parse_duration(props["DURATION"][1])
+    else:
+        end = start + (timedelta(days=1) if all_day else timedelta(0))
+    status_raw = props.get("STATUS", ({}, ""))[1].strip().upper()
+    payload: Dict[str, Any] = {
+        "title": unescape_text(props.get("SUMMARY", ({}, ""))[1]).strip() or "(Sin titulo)",
+        "description": unescape_text(props.get("DESCRIPTION", ({}, ""))[1]) or None,
+        "start_time": start.isoformat(),
+        "end_time": end.isoformat(),
+        "status": "cancelada" if status_raw == "CANCELLED" else ("confirmada" if status_raw == "CONFIRMED" else None),
+    }
+    tzid = props["DTSTART"][0].get("TZID")
+    if tzid:
+        payload["timezone"] = tzid
+    uid = props.get("UID", ({}, ""))[1].strip()
+    if uid:
+        # Las excepciones de una serie comparten UID: RECURRENCE-ID distingue cada instancia.
+        recurrence_id = props.get("RECURRENCE-ID", ({}, ""))[1].strip()
+        payload["ical_uid"] = f"{uid}#{recurrence_id}" if recurrence_id else uid
+    return payload
@@ -0,0 +1,228 @@
+"""
+Subconjunto de RRULE (RFC 5545) para series de citas: FREQ=DAILY|WEEKLY|MONTHLY|YEARLY con
+INTERVAL, COUNT, UNTIL, BYDAY (solo WEEKLY, sin ordinales) y BYMONTHDAY (solo MONTHLY).
+Las ocurrencias se calculan en hora local de la serie (respeta cambios de horario) y solo para la
+ventana pedida.
+"""
+import calendar as _calendar
+from datetime import datetime, timedelta, timezone
+from typing import Iterator, List, Optional, Tuple
+from zoneinfo import ZoneInfo
+
+FREQUENCIES = ("DAILY", "WEEKLY", "MONTHLY", "YEARLY")
+WEEKDAYS = ("MO", "TU", "WE", "TH", "FR", "SA", "SU")
+MAX_COUNT = 1000
+# Tope de periodos recorridos por expansion (evita bucles con reglas que casi nunca generan fechas).
+_MAX_PERIODS = 100000
+
+
+class RecurrenceRule:
+    def __init__(
+        self,
+        freq: str,
+        interval: int = 1,
+        count: Optional[int] = None,
+        until: Optional[datetime] = None,
+        byday: Optional[List[int]] = None,
+        bymonthday: Optional[List[int]] = None,
+    ):
+        self.freq = freq
+        self.interval = interval
+        self.count = count
+        self.until = until
+        self.byday = byday or []
+        self.bymonthday = bymonthday or []
+
+    def to_string(self) -> str:
+        parts = [f"FREQ={self.freq}"]
+        if self.interval != 1:
+            parts.append(f"INTERVAL={self.interval}")
+        if self.count is not None:
+            parts.append(f"COUNT={self.count}")
+        if self.until is not None:
+            parts.append("UNTIL=" + self.until.astimezone(timezone.utc).strftime("%Y%m%dT%H%M%SZ"))
+        if self.byday:
+            parts.append("BYDAY=" + ",".join(WEEKDAYS[d] for d in self.byday))
+        if self.bymonthday:
+            parts.append("BYMONTHDAY=" + ",".join(str(d) for d in self.bymonthday))
+        return ";".join(parts)
+
+
+def _parse_until(raw: str, tz: ZoneInfo) -> datetime:
+    value = raw.strip()
+    for fmt in ("%Y%m%dT%H%M%SZ", "%Y%m%dT%H%M%S", "%Y%m%d"):
+        try:
+            parsed = datetime.strptime(value, fmt)
+        except ValueError:
+            continue
+        if fmt.endswith("Z"):
+            return parsed.replace(tzinfo=timezone.utc)
+        if fmt == "%Y%m%d":
+            # Fecha sin hora: incluye todo ese dia local.
+            parsed = parsed.replace(hour=23, minute=59, second=59)
+        return parsed.replace(tzinfo=tz)
+    try:
+        parsed = datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f"rrule_until_invalido: {raw}")
+    return parsed if parsed.tzinfo else parsed.replace(tzinfo=tz)
+
+
+def _int_list(raw: str, name: str) -> List[int]:
+    try:
+        return [int(v) for v in raw.split(",") if v.strip()]
+    except ValueError:
+        raise ValueError(f"rrule_{name}_invalido")
+
+
+def parse_rrule(text: str, tz: ZoneInfo) -> RecurrenceRule:
+    if not text or not str(text).strip():
+        raise ValueError("rrule_requerida")
+    body = str(text).strip()
+    if body.upper().startswith("RRULE:"):
+        body = body[6:]
+    fields = {}
+    for part in body.split(";"):
+        if not part.strip():
+            continue
+        if "=" not in part:
+            raise ValueError(f"rrule_invalida: {part}")
+        key, value = part.split("=", 1)
+        fields[key.strip().upper()] = value.strip()
+
+    freq = fields.pop("FREQ", "").upper()
+    if freq not in FREQUENCIES:
+        raise ValueError(f"rrule_freq_no_soportada: {freq or '-'}")
+    try:
+        interval = int(fields.pop("INTERVAL", "1"))
+        count = int(fields["COUNT"]) if "COUNT" in fields else None
+    except ValueError:
+        raise ValueError("rrule_invalida: INTERVAL/COUNT deben ser enteros")
+    fields.pop("COUNT", None)
+    if interval < 1:
+        raise ValueError("rrule_interval_invalido")
+    if count is not None and not 1 <= count <= MAX_COUNT:
+        raise ValueError(f"rrule_count_invalido: 1..{MAX_COUNT}")
+    until = _parse_until(fields.pop("UNTIL"), tz) if "UNTIL" in fields else None
+    if count is not None and until is not None:
+        raise ValueError("rrule_invalida: COUNT y UNTIL son excluyentes")
+
+    byday: List[int] = []
+    if "BYDAY" in fields:
+        if freq != "WEEKLY":
+            raise ValueError("rrule_byday_solo_weekly")
+        for token in fields.pop("BYDAY").upper().split(","):
+            token = token.strip()
+            if token not in WEEKDAYS:
+                raise ValueError(f"rrule_byday_invalido: {token}")
+            byday.append(WEEKDAYS.index(token))
+    bymonthday: List[int] = []
+    if "BYMONTHDAY" in fields:
+        if freq != "MONTHLY":
+            raise ValueError("rrule_bymonthday_solo_monthly")
+        bymonthday = _int_list(fields.pop("BYMONTHDAY"), "bymonthday")
+        if any(d == 0 or not -31 <= d <= 31 for d in bymonthday):
+            raise ValueError("rrule_bymonthday_invalido")
+    fields.pop("WKST", None)
+    if fields:
+        raise ValueError(f"rrule_parte_no_soportada: {', '.join(sorted(fields))}")
+    return RecurrenceRule(freq, interval, count, until, sorted(set(byday)), sorted(set(bymonthday)))
+
+
+def _add_months(year: int, month: int, months: int) -> Tuple[int, int]:
+    index = year * 12 + (month - 1) + months
+    return index // 12, index % 12 + 1
+
+
+def _period_candidates(rule: RecurrenceRule, start: datetime, k: int) -> List[datetime]:
+    """Fechas (hora local naive) del periodo k contado desde el inicio de la serie, en orden."""
+    step = rule.interval * k
+    if rule.freq == "DAILY":
+        return [start + timedelta(days=step)]
+    if rule.freq == "WEEKLY":
+        week_start = start - timedelta(days=start.weekday()) + timedelta(weeks=step)
+        days = rule.byday or [start.weekday()]
+        return [week_start + timedelta(days=d) for d in days]
+    if rule.freq == "MONTHLY":
+        year, month = _add_months(start.year, start.month, step)
+        last = _calendar.monthrange(year, month)[1]
+        out = []
+        for d in sorted({(d if d > 0 else last + 1 + d) for d in (rule.bymonthday or [start.day])}):
+            if 1 <= d <= last:
+                out.append(start.replace(year=year, month=month, day=d))
+        return out
+    year = start.year + step
+    if start.month == 2 and start.day == 29 and not _calendar.isleap(year):
+        return []
+    return [start.replace(year=year)]
+
+
+def _first_period(rule: RecurrenceRule, start: datetime, target: datetime) -> int:
+    """Primer periodo que puede contener `target` (solo valido sin COUNT, que obliga a contar desde el inicio)."""
+    if target <= start:
+        return 0
+    if rule.freq == "DAILY":
+        k = (target - start).days // rule.interval
+    elif rule.freq == "WEEKLY":
+        k = (target - start).days // (7 * rule.interval)
+    elif rule.freq == "MONTHLY":
+        k = ((target.year - start.year) * 12 + target.month - start.month) // rule.interval
+    else:
+        k = (target.year - start.year) // rule.interval
+    return max(0, k - 1)
+
+
+def iter_occurrences(
+    rule: RecurrenceRule,
+    dtstart: datetime,
+    tz: ZoneInfo,
+    window_start: Optional[datetime] = None,
+    window_end: Optional[datetime] = None,
+    duration: timedelta = timedelta(0),
+) -> Iterator[datetime]:
+    """
+    Inicios (aware, en `tz`) de las ocurrencias cuyo intervalo [inicio, inicio+duration) toca la ventana.
+    Sin ventana recorre la serie completa (requiere COUNT o UNTIL).
+    """
+    if window_end is None and rule.count is None and rule.until is None:
+        raise ValueError("serie_infinita_requiere_ventana")
+    local_start = dtstart.astimezone(tz).replace(tzinfo=None)
+    lower = (window_start - duration).astimezone(tz).replace(tzinfo=None) if window_start else None
+    upper = window_end.astimezone(tz).replace(tzinfo=None) if window_end else None
+    until = rule.until.astimezone(tz).replace(tzinfo=None) if rule.until else None
+
+    k = _first_period(rule, local_start, lower) if lower and rule.count is None else 0
+    emitted = 0
+    for _ in range(_MAX_PERIODS):
+        candidates = _period_candidates(rule, local_start, k)
+        k += 1
+        for candidate in candidates:
+            if candidate < local_start:
+                continue
+            if until is not None and candidate > until:
+                return
+            if upper is not None and candidate >= upper:
+                return
+            emitted += 1
+            if lower is None or candidate > lower:
+                yield candidate.replace(tzinfo=tz)
+            if rule.count is not None and emitted >= rule.count:
+                return
+
+
+def series_end(rule: RecurrenceRule, dtstart: datetime, tz: ZoneInfo, duration: timedelta) -> Optional[datetime]:
+    """Fin de la ultima ocurrencia (para indexar la serie por rango); None si la serie no termina."""
+    if rule.count is None and rule.until is None:
+        return None
+    last = None
+    for last in iter_occurrences(rule, dtstart, tz, duration=duration):
+        pass
+    return (last + duration) if last else dtstart + duration
+
+
+def is_occurrence(rule: RecurrenceRule, dtstart: datetime, tz: ZoneInfo, moment: datetime) -> bool:
+    tick = timedelta(seconds=1)
+    for candidate in iter_occurrences(rule, dtstart, tz, moment, moment + tick, duration=tick):
+        if candidate == moment:
+            return True
+    return False
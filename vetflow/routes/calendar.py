@@ -1,9 +1,16 @@
 import json
 import logging
-from flask import Blueprint, flash, jsonify, redirect, request, url_for
+from flask import Blueprint, Response, flash, g, jsonify, redirect, request, stream_with_context, url_for
 
 from ..auth import AuthError, require_authenticated_request
+from ..http_cache import conditional_json, conditional_response
+from ..services import availability as availability_service
 from ..services import calendar as calendar_service
+from ..services import ics as ics_service
+from ..services import reminders as reminders_service
+from ..services import series as series_service
+from ..services.workspaces import ensure_workspace_schema_ready, get_workspace_by_key
+from ..utils import parse_datetime
 from .ui import ensure_workspace_from_slug
 
 calendar_bp = Blueprint("calendar", __name__)
@@ -14,6 +21,9 @@ logger = logging.getLogger(__name__)
 def _auth_guard():
     if request.method == "OPTIONS":
         return ("", 204)
+    if request.endpoint == "calendar.calendar_feed_ics":
+        # Los clientes de calendario no envian sesion: el feed se autoriza con su token.
+        return None
     try:
         require_authenticated_request()
     except AuthError as ex:
@@ -128,13 +138,398 @@ def delete_calendar(appointment_id: int):
 
 @calendar_bp.route("/api/calendar", methods=["GET"])
 def api_calendar_list():
-    return jsonify(calendar_service.api_list())
+    try:
+        return conditional_json(
+            ["appointments", "appointment_series"], lambda: calendar_service.api_list(request.args.to_dict())
+        )
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
 
 @calendar_bp.route("/w/<slug>/api/calendar", methods=["GET"])
 def api_calendar_list_ws(slug: str):
     if not ensure_workspace_from_slug(slug):
         return jsonify({"error": "workspace_not_found"}), 404
-    return jsonify(calendar_service.api_list())
+    try:
+        return conditional_json(
+            ["appointments", "appointment_series"], lambda: calendar_service.api_list(request.args.to_dict())
+        )
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+
+def _conflict_response(ex):
+    body = {"error": str(ex), "conflicts": ex.conflict_ids}
+    if ex.conflict_series:
+        body["conflict_series"] = ex.conflict_series
+    return jsonify(body), 409
+
+
+def _changes_response():
+    try:
+        return jsonify(calendar_service.api_changes(request.args.get("since"), request.args.get("limit")))
+    except calendar_service.SyncCursorExpired as ex:
+        return jsonify({"error": str(ex), "message": "Cursor expirado: sincroniza de nuevo sin 'since'"}), 410
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error obteniendo cambios de calendario")
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/api/calendar/changes", methods=["GET"])
+def api_calendar_changes():
+    return _changes_response()
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/changes", methods=["GET"])
+def api_calendar_changes_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    return _changes_response()
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/summary", methods=["GET"])
+def api_calendar_summary_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        params = request.args.to_dict()
+        return conditional_json(
+            ["appointments", "appointment_series"], lambda: calendar_service.api_summary(params)
+        )
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error calculando resumen de calendario slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/conflicts", methods=["GET"])
+def api_calendar_conflicts_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        range_start = parse_datetime(request.args["from"]) if request.args.get("from") else None
+        range_end = parse_datetime(request.args["to"]) if request.args.get("to") else None
+        scope = (request.args.get("scope") or "").strip().lower() or None
+        conflicts = calendar_service.find_conflicts(range_start, range_end, scope, request.args.get("limit"))
+        return jsonify({"conflicts": conflicts, "total": len(conflicts)})
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error buscando solapes slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/availability", methods=["GET"])
+def api_calendar_availability_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(availability_service.find_availability(request.args.to_dict()))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error calculando disponibilidad slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/business-hours", methods=["GET"])
+def api_business_hours_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    return jsonify(availability_service.get_business_hours())
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/business-hours", methods=["PUT"])
+def api_business_hours_update_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload, _ = _parse_payload()
+    try:
+        return jsonify(availability_service.update_business_hours(payload))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error actualizando horario de atencion slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/business-hours/exceptions/<day>", methods=["DELETE"])
+def api_business_hours_exception_delete_ws(slug: str, day: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        availability_service.delete_business_hours_exception(day)
+        return jsonify({"deleted": day})
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+
+
+def _bulk_records():
+    """
+    Registros para el alta masiva: NDJSON (una cita por linea, leido en streaming) o JSON
+    (arreglo o {"appointments": [...], "mode": ...}). Devuelve (iterable de (indice, item), mode del body).
+    """
+    content_type = (request.content_type or "").lower()
+    if "ndjson" in content_type or "jsonlines" in content_type or "x-jsonl" in content_type:
+        def _lines():
+            index = 0
+            for raw in request.stream:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    yield index, json.loads(line)
+                except ValueError as ex:
+                    yield index, ValueError(f"json_invalido: {ex}")
+                index += 1
+
+        return _lines(), None
+    payload = request.get_json(silent=True)
+    mode = None
+    if isinstance(payload, dict):
+        mode = payload.get("mode")
+        payload = payload.get("appointments")
+    if not isinstance(payload, list):
+        raise ValueError("se esperaba un arreglo JSON de citas o NDJSON")
+    return enumerate(payload), mode
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/bulk", methods=["POST"])
+def api_calendar_bulk_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        records, body_mode = _bulk_records()
+        mode = (request.args.get("mode") or body_mode or "atomic").strip().lower()
+        result = calendar_service.api_bulk_create(records, mode)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error en alta masiva de citas slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    if result["created"] == 0 and result["failed"]:
+        return jsonify(result), 400
+    return jsonify(result), 201
+
+
+@calendar_bp.route("/w/<slug>/calendar.ics", methods=["GET"])
+def calendar_feed_ics(slug: str):
+    workspace = get_workspace_by_key(slug)
+    if not workspace:
+        return jsonify({"error": "workspace_not_found"}), 404
+    g.workspace_schema = workspace["schema_name"]
+    g.workspace_id = workspace["id"]
+    # Token invalido y workspace inexistente responden igual para no revelar slugs; por eso el token se
+    # verifica antes de provisionar (un request anonimo no dispara DDL ni ve un 503 distinto del 404).
+    if not ics_service.verify_feed_token(request.args.get("token")):
+        return jsonify({"error": "workspace_not_found"}), 404
+    ensure_workspace_schema_ready(workspace["schema_name"])
+    try:
+        window_start, window_end = ics_service.feed_window()
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    calendar_name = workspace.get("name") or slug
+
+    def _build(etag):
+        cached = ics_service.cached_feed(etag)
+        if cached is not None:
+            return Response(cached, mimetype="text/calendar")
+        return Response(
+            stream_with_context(ics_service.iter_feed(calendar_name, window_start, window_end, cache_key=etag)),
+            mimetype="text/calendar",
+        )
+
+    try:
+        return conditional_response(["appointments", "appointment_series"], _build, extra=window_start.isoformat())
+    except Exception as ex:
+        logger.exception("Error generando feed .ics slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+def _feed_info(slug: str, token: str):
+    return {"token": token, "url": url_for("calendar.calendar_feed_ics", slug=slug, token=token, _external=True)}
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/feed", methods=["GET"])
+def api_calendar_feed_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(_feed_info(slug, ics_service.get_feed_token()))
+    except Exception as ex:
+        logger.exception("Error obteniendo token de feed slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/feed/rotate", methods=["POST"])
+def api_calendar_feed_rotate_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(_feed_info(slug, ics_service.get_feed_token(rotate=True)))
+    except Exception as ex:
+        logger.exception("Error rotando token de feed slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/import", methods=["POST"])
+def api_calendar_import_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        mode = (request.args.get("mode") or "best_effort").strip().lower()
+        result = ics_service.import_ics(request.stream, mode)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error importando .ics slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    if result["created"] == 0 and result["failed"]:
+        return jsonify(result), 400
+    return jsonify(result), 201
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/series", methods=["POST"])
+def api_calendar_series_create_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload, source = _parse_payload()
+    logger.info("API calendar series create slug=%s source=%s payload=%s", slug, source, payload)
+    try:
+        return jsonify(series_service.create_series(payload)), 201
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error creando serie slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/series/<int:series_id>", methods=["GET"])
+def api_calendar_series_get_ws(slug: str, series_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(series_service.get_series(series_id))
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/series/<int:series_id>", methods=["DELETE"])
+def api_calendar_series_delete_ws(slug: str, series_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(series_service.delete_series(series_id))
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/series/<int:series_id>/occurrences/<occurrence>", methods=["PUT"])
+def api_calendar_occurrence_update_ws(slug: str, series_id: int, occurrence: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload, source = _parse_payload()
+    logger.info("API calendar occurrence update slug=%s series=%s occurrence=%s source=%s", slug, series_id, occurrence, source)
+    try:
+        return jsonify(series_service.materialize_occurrence(series_id, occurrence, payload))
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/series/<int:series_id>/occurrences/<occurrence>", methods=["DELETE"])
+def api_calendar_occurrence_delete_ws(slug: str, series_id: int, occurrence: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(series_service.cancel_occurrence(series_id, occurrence))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/settings", methods=["GET"])
+def api_calendar_settings_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    return jsonify(calendar_service.get_calendar_settings())
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/settings", methods=["PUT"])
+def api_calendar_settings_update_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload, _ = _parse_payload()
+    try:
+        return jsonify(calendar_service.update_calendar_settings(payload))
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error actualizando configuracion de calendario slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/reminders", methods=["GET"])
+def api_calendar_reminders_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        limit = int(request.args.get("limit") or 100)
+        return jsonify({"reminders": reminders_service.list_pending_reminders(limit)})
+    except ValueError:
+        return jsonify({"error": "limit_invalido"}), 400
+    except Exception as ex:
+        logger.exception("Error listando recordatorios slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/reminders/run", methods=["POST"])
+def api_calendar_reminders_run_ws(slug: str):
+    workspace = ensure_workspace_from_slug(slug)
+    if not workspace:
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(reminders_service.deliver_due_reminders(workspace["schema_name"]))
+    except Exception as ex:
+        logger.exception("Error entregando recordatorios slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/reminders/settings", methods=["GET"])
+def api_calendar_reminder_settings_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(reminders_service.get_reminder_settings())
+    except Exception as ex:
+        logger.exception("Error leyendo configuracion de recordatorios slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@calendar_bp.route("/w/<slug>/api/calendar/reminders/settings", methods=["PUT"])
+def api_calendar_reminder_settings_update_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload, _ = _parse_payload()
+    try:
+        return jsonify(reminders_service.update_reminder_settings(payload))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error actualizando recordatorios slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
 
 
 @calendar_bp.route("/api/calendar/<int:appointment_id>", methods=["GET"])
@@ -162,6 +557,8 @@ def api_calendar_create():
     try:
         row = calendar_service.api_create(payload)
         return jsonify(row), 201
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
     except ValueError as ex:
         return jsonify({"error": str(ex)}), 400
 
@@ -175,6 +572,8 @@ def api_calendar_create_ws(slug: str):
     try:
         row = calendar_service.api_create(payload)
         return jsonify(row), 201
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
     except ValueError as ex:
         return jsonify({"error": str(ex)}), 400
 
@@ -186,6 +585,8 @@ def api_calendar_update(appointment_id: int):
     try:
         row = calendar_service.api_update(appointment_id, payload)
         return jsonify(row)
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
     except ValueError as ex:
         return jsonify({"error": str(ex)}), 400
     except LookupError:
@@ -201,6 +602,8 @@ def api_calendar_update_ws(slug: str, appointment_id: int):
     try:
         row = calendar_service.api_update(appointment_id, payload)
         return jsonify(row)
+    except calendar_service.AppointmentConflictError as ex:
+        return _conflict_response(ex)
     except ValueError as ex:
         return jsonify({"error": str(ex)}), 400
     except LookupError:
@@ -1,9 +1,15 @@
+import codecs
+import csv
+import json
 import logging
 
-from flask import Blueprint, jsonify, request
+from flask import Blueprint, Response, jsonify, request, stream_with_context
 
 from ..auth import AuthError, require_authenticated_request
+from ..http_cache import conditional_json
 from ..services import clientes as clientes_service
+from ..services import duplicates as duplicates_service
+from ..services.calendar import AppointmentConflictError
 from .ui import ensure_workspace_from_slug
 
 logger = logging.getLogger(__name__)
@@ -35,8 +41,208 @@ def api_clientes_list(slug: str):
         limit_int = int(limit)
     except Exception:
         limit_int = 200
-    items = clientes_service.list_clients(q, limit=limit_int)
-    return jsonify({"clients": items})
+    cursor = request.args.get("cursor")
+    fields = request.args.get("fields")
+    sort = request.args.get("sort")
+    try:
+        # Las columnas de actividad cambian con las citas y con el paso del tiempo (job de mantenimiento):
+        # `client_activity` tiene su propia version en el ETag.
+        return conditional_json(
+            ["clients", "appointments", "client_activity"],
+            lambda: clientes_service.list_clients_page(q, limit=limit_int, cursor=cursor, fields=fields, sort=sort),
+        )
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/typeahead", methods=["GET"])
+def api_clientes_typeahead(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        items = clientes_service.typeahead_clients(request.args.get("q"), request.args.get("limit"))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error en typeahead de clientes slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    response = jsonify({"clients": items})
+    response.headers["Cache-Control"] = "private, max-age=10"
+    return response
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/duplicates/identification", methods=["GET"])
+def api_clientes_identification_duplicates(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(clientes_service.identification_duplicates(request.args.get("limit") or 200))
+    except ValueError:
+        return jsonify({"error": "limit_invalido"}), 400
+    except Exception as ex:
+        logger.exception("Error en reporte de duplicados slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/duplicates", methods=["GET"])
+def api_clientes_duplicates(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        items = duplicates_service.list_candidates(request.args.get("status"), request.args.get("limit"))
+        return jsonify({"candidates": items})
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error listando posibles duplicados slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/duplicates/scan", methods=["POST"])
+def api_clientes_duplicates_scan(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(duplicates_service.scan_duplicates())
+    except duplicates_service.DuplicateScanInProgress:
+        return jsonify({"error": "escaneo_en_curso"}), 409
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error escaneando duplicados slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/duplicates/<int:candidate_id>/dismiss", methods=["POST"])
+def api_clientes_duplicates_dismiss(slug: str, candidate_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify({"candidate": duplicates_service.dismiss_candidate(candidate_id)})
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except Exception as ex:
+        logger.exception("Error descartando duplicado slug=%s id=%s", slug, candidate_id)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/merge", methods=["POST"])
+def api_clientes_merge(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload = _json()
+    try:
+        return jsonify(duplicates_service.merge_clients(payload.get("target_id"), payload.get("source_id")))
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error fusionando clientes slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/identification-index", methods=["POST"])
+def api_clientes_identification_index(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        result = clientes_service.ensure_identification_index()
+    except Exception as ex:
+        logger.exception("Error creando indice de identificacion slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    if not result["unique_index"]:
+        return jsonify({"error": "clientes_duplicados", **result}), 409
+    return jsonify(result)
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/by-phone/<path:number>", methods=["GET"])
+def api_clientes_by_phone(slug: str, number: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify({"client": clientes_service.find_client_by_phone(number)})
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error buscando cliente por telefono slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+def _import_records():
+    """
+    Filas de la importacion leidas en streaming: CSV con encabezados (`text/csv`; `?delimiter=;` para
+    exportaciones de Excel en espanol) o NDJSON (un objeto por linea). Devuelve (indice, item).
+    """
+    content_type = (request.content_type or "").lower()
+    if "ndjson" in content_type or "jsonlines" in content_type or "x-jsonl" in content_type:
+        def _lines():
+            index = 0
+            for raw in request.stream:
+                line = raw.strip()
+                if not line:
+                    continue
+                try:
+                    yield index, json.loads(line)
+                except ValueError as ex:
+                    yield index, ValueError(f"json_invalido: {ex}")
+                index += 1
+
+        return _lines()
+    if "csv" not in content_type:
+        raise ValueError("content_type_invalido: usa text/csv o application/x-ndjson")
+    delimiter = request.args.get("delimiter") or ","
+    if len(delimiter) != 1:
+        raise ValueError("delimiter_invalido")
+
+    def _rows():
+        reader = csv.DictReader(codecs.iterdecode(request.stream, "utf-8-sig"), delimiter=delimiter)
+        reader.fieldnames = [(name or "").strip().lower() for name in (reader.fieldnames or [])]
+        for index, row in enumerate(reader):
+            yield index, row
+
+    return _rows()
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/import", methods=["POST"])
+def api_clientes_import(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        mode = (request.args.get("mode") or "best_effort").strip().lower()
+        on_conflict = (request.args.get("on_conflict") or "update").strip().lower()
+        result = clientes_service.import_clients(_import_records(), mode, on_conflict)
+    except UnicodeDecodeError:
+        return jsonify({"error": "csv_invalido: se esperaba UTF-8"}), 400
+    except csv.Error as ex:
+        return jsonify({"error": f"csv_invalido: {ex}"}), 400
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error importando clientes slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    if result["created"] == 0 and result["updated"] == 0 and result["failed"]:
+        return jsonify(result), 400
+    return jsonify(result)
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/export", methods=["GET"])
+def api_clientes_export(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        fmt, includes = clientes_service.export_options(request.args.get("format"), request.args.get("include"))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    response = Response(
+        stream_with_context(clientes_service.iter_clients_export(fmt, includes)),
+        mimetype="text/csv" if fmt == "csv" else "application/x-ndjson",
+    )
+    response.headers["Content-Disposition"] = f'attachment; filename="clientes-{slug}.{fmt}"'
+    response.headers["Cache-Control"] = "no-store"
+    return response
 
 
 @clientes_bp.route("/w/<slug>/api/clientes", methods=["POST"])
@@ -103,6 +309,40 @@ def api_clientes_delete(slug: str, client_id: int):
         return jsonify({"error": f"error_interno: {ex}"}), 500
 
 
+@clientes_bp.route("/w/<slug>/api/clientes/<int:client_id>/notas", methods=["GET"])
+def api_clientes_list_notes(slug: str, client_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(
+            clientes_service.list_client_notes(client_id, request.args.get("cursor"), request.args.get("limit"))
+        )
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error listando notas slug=%s id=%s", slug, client_id)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@clientes_bp.route("/w/<slug>/api/clientes/<int:client_id>/citas", methods=["GET"])
+def api_clientes_list_appts(slug: str, client_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(
+            clientes_service.list_client_appointments(client_id, request.args.get("cursor"), request.args.get("limit"))
+        )
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error listando citas de cliente slug=%s id=%s", slug, client_id)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
 @clientes_bp.route("/w/<slug>/api/clientes/<int:client_id>/notas", methods=["POST"])
 def api_clientes_add_note(slug: str, client_id: int):
     if not ensure_workspace_from_slug(slug):
@@ -128,6 +368,11 @@ def api_clientes_create_appt(slug: str, client_id: int):
     try:
         appt = clientes_service.create_appointment_for_client(client_id, payload)
         return jsonify({"appointment": appt}), 201
+    except AppointmentConflictError as ex:
+        body = {"error": str(ex), "conflicts": ex.conflict_ids}
+        if ex.conflict_series:
+            body["conflict_series"] = ex.conflict_series
+        return jsonify(body), 409
     except ValueError as ex:
         return jsonify({"error": str(ex)}), 400
     except LookupError:
@@ -1,12 +1,17 @@
 import logging
-from flask import Blueprint, jsonify, redirect, request, flash, url_for
+from flask import Blueprint, Response, jsonify, redirect, request, flash, stream_with_context, url_for
 
 from ..auth import AuthError, require_authenticated_request
+from ..http_cache import conditional_json
 from ..services.files import (
+    build_folder_archive,
     create_file,
     delete_file,
+    list_files,
     notify_ingest_webhook,
+    reindex_files,
     sas_for_file,
+    search_files,
     send_to_n8n,
     update_file_metadata,
 )
@@ -46,13 +51,13 @@ def upload_file():
     errors = []
     for item in uploaded_files:
         try:
-            file_info = create_file(
+            file_info, content_id = create_file(
                 item,
                 tags_list,
                 notes,
                 item.content_length or request.content_length,
             )
-            notify_ingest_webhook(file_info)
+            notify_ingest_webhook(file_info, content_id)
             successes += 1
         except Exception as ex:
             logger.exception("Error subiendo a Blob/DB para %s", getattr(item, "filename", "archivo"))
@@ -90,6 +95,103 @@ def file_sas_ws(slug: str, file_id: int):
         return jsonify({"error": f"No se pudo generar SAS: {ex}"}), 500
 
 
+def _int_arg(name: str, default: int) -> int:
+    raw = request.args.get(name)
+    if raw in (None, ""):
+        return default
+    try:
+        return int(raw)
+    except Exception:
+        raise ValueError(f"{name}_invalido")
+
+
+def _tags_arg():
+    tags = []
+    for raw in request.args.getlist("tag") + request.args.getlist("tags"):
+        tags.extend(t.strip() for t in raw.split(",") if t.strip())
+    return tags
+
+
+@files_bp.route("/w/<slug>/api/files", methods=["GET"])
+def api_list_files_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    include_expired = (request.args.get("include_expired") or "").lower() in ("1", "true", "yes", "on")
+    try:
+        return conditional_json(["files"], lambda: {"files": list_files(include_expired=include_expired)})
+    except Exception as ex:
+        logger.exception("Error listando archivos slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@files_bp.route("/w/<slug>/api/files/search", methods=["GET"])
+def api_search_files_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        limit = _int_arg("limit", 25)
+        offset = _int_arg("offset", 0)
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    include_expired = (request.args.get("include_expired") or "").lower() in ("1", "true", "yes", "on")
+    include_facets = (request.args.get("facets") or "1").lower() not in ("0", "false", "no", "off")
+    try:
+        result = search_files(
+            request.args.get("q"),
+            tags=_tags_arg(),
+            status=(request.args.get("status") or "").strip() or None,
+            include_expired=include_expired,
+            limit=limit,
+            offset=offset,
+            include_facets=include_facets,
+        )
+        return jsonify(result)
+    except Exception as ex:
+        logger.exception("Error buscando archivos slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@files_bp.route("/w/<slug>/api/files/archive", methods=["GET"])
+def api_files_archive_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        archive_name, stream = build_folder_archive(request.args.get("folder"))
+    except LookupError:
+        return jsonify({"error": "carpeta_vacia"}), 404
+    except Exception as ex:
+        logger.exception("Error preparando ZIP slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+    return Response(
+        stream_with_context(stream),
+        mimetype="application/zip",
+        headers={
+            "Content-Disposition": f'attachment; filename="{archive_name}"',
+            "Cache-Control": "no-store",
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+@files_bp.route("/w/<slug>/api/files/reindex", methods=["POST"])
+def api_reindex_files_ws(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload = request.get_json(force=True, silent=True) or {}
+    try:
+        result = reindex_files(
+            payload.get("folder"),
+            force=bool(payload.get("force")),
+            dry_run=bool(payload.get("dry_run")),
+        )
+        return jsonify(result)
+    except RuntimeError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error en reindex slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
 @files_bp.route("/files/<int:file_id>/delete", methods=["POST"])
 def delete_file_route(file_id: int):
     ok, err, _, webhook_msg = delete_file(file_id)
@@ -0,0 +1,68 @@
+import logging
+
+from flask import Blueprint, jsonify, request
+
+from ..auth import AuthError, require_authenticated_request
+from ..services import knowledge as knowledge_service
+from .ui import ensure_workspace_from_slug
+
+logger = logging.getLogger(__name__)
+
+knowledge_bp = Blueprint("knowledge", __name__)
+
+
+@knowledge_bp.before_request
+def _auth_guard():
+    if request.method == "OPTIONS":
+        return ("", 204)
+    try:
+        require_authenticated_request()
+    except AuthError as ex:
+        return jsonify({"error": ex.code, "message": str(ex)}), ex.status_code
+
+
+def _json():
+    return request.get_json(silent=True) or {}
+
+
+@knowledge_bp.route("/w/<slug>/api/knowledge/files/<int:file_id>/chunks", methods=["PUT", "POST"])
+def api_knowledge_load_chunks(slug: str, file_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    payload = _json()
+    # PUT reemplaza los chunks del archivo; POST agrega salvo que se envie replace=true.
+    replace = request.method == "PUT" or bool(payload.get("replace"))
+    try:
+        result = knowledge_service.replace_file_chunks(file_id, payload.get("chunks"), replace=replace)
+        return jsonify(result), 201
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except LookupError:
+        return jsonify({"error": "not_found"}), 404
+    except Exception as ex:
+        logger.exception("Error cargando chunks slug=%s file_id=%s", slug, file_id)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@knowledge_bp.route("/w/<slug>/api/knowledge/files/<int:file_id>/chunks", methods=["DELETE"])
+def api_knowledge_delete_chunks(slug: str, file_id: int):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(knowledge_service.delete_file_chunks(file_id))
+    except Exception as ex:
+        logger.exception("Error eliminando chunks slug=%s file_id=%s", slug, file_id)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
+
+
+@knowledge_bp.route("/w/<slug>/api/knowledge/search", methods=["POST"])
+def api_knowledge_search(slug: str):
+    if not ensure_workspace_from_slug(slug):
+        return jsonify({"error": "workspace_not_found"}), 404
+    try:
+        return jsonify(knowledge_service.search_knowledge(_json()))
+    except ValueError as ex:
+        return jsonify({"error": str(ex)}), 400
+    except Exception as ex:
+        logger.exception("Error buscando en knowledge slug=%s", slug)
+        return jsonify({"error": f"error_interno: {ex}"}), 500
@@ -38,6 +38,7 @@ from ..services.workspaces import (
     create_invite,
     accept_invite,
     remove_member,
+    ensure_workspace_schema_ready,
 )
 
 
@@ -92,6 +93,7 @@ def set_workspace_context(workspace):
     session["workspace_schema"] = workspace["schema_name"]
     g.workspace_schema = workspace["schema_name"]
     g.workspace_id = workspace["id"]
+    ensure_workspace_schema_ready(workspace["schema_name"])
 
 
 def ensure_workspace_from_slug(slug: str):
@@ -41,6 +41,9 @@ def row_to_appointment_api(row: dict):
         "status": row.get("status"),
         "timezone": row.get("timezone"),
         "client_id": row.get("client_id"),
+        "resource": row.get("resource"),
+        "series_id": row.get("series_id"),
+        "occurrence_start": _iso_datetime(row.get("occurrence_start")),
         "created_at": _iso_datetime(row.get("created_at")),
         "updated_at": _iso_datetime(row.get("updated_at")),
     }
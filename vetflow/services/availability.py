@@ -0,0 +1,297 @@
+import logging
+from datetime import date, datetime, time, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import request
+
+from ..config import config
+from ..db import get_db
+from ..utils import parse_datetime
+from .calendar import NON_BLOCKING_STATUSES, PERIOD_SQL
+from .series import expand_occurrences
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_DURATIONS = (15, 30, 60, 90, 120)
+MAX_RANGE = timedelta(days=31)
+MAX_SLOTS = 2000
+
+Interval = Tuple[datetime, datetime]
+
+
+def _parse_time(raw: Any, name: str) -> time:
+    try:
+        return time.fromisoformat(str(raw).strip())
+    except Exception:
+        raise ValueError(f"{name}_invalido")
+
+
+def _zone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        raise ValueError(f"timezone_invalida: {name}")
+
+
+def _resolve_timezone(conn, explicit: Optional[str]) -> str:
+    """
+    Zona para interpretar el horario de atencion: parametro > header X-Timezone > ultima zona
+    registrada en `appointments.timezone` > APP_TIMEZONE.
+    """
+    if explicit:
+        return explicit
+    try:
+        header_tz = (request.headers.get("X-Timezone") or "").strip()
+    except RuntimeError:
+        header_tz = ""
+    if header_tz:
+        return header_tz
+    row = conn.execute(
+        "SELECT timezone FROM appointments WHERE timezone IS NOT NULL AND timezone <> '' ORDER BY updated_at DESC LIMIT 1"
+    ).fetchone()
+    if row:
+        return row["timezone"]
+    return (config.APP_TIMEZONE or "UTC").strip() or "UTC"
+
+
+def get_business_hours() -> Dict[str, Any]:
+    with get_db() as conn:
+        hours = conn.execute(
+            "SELECT weekday, open_time, close_time FROM business_hours ORDER BY weekday, open_time"
+        ).fetchall()
+        exceptions = conn.execute(
+            """
+            SELECT day, open_time, close_time
+            FROM business_hours_exceptions
+            WHERE day >= CURRENT_DATE - 1
+            ORDER BY day, open_time NULLS FIRST
+            """
+        ).fetchall()
+    by_day: Dict[date, List[Dict[str, str]]] = {}
+    for row in exceptions:
+        slots = by_day.setdefault(row["day"], [])
+        if row["open_time"] is not None:
+            slots.append({"open": row["open_time"].strftime("%H:%M"), "close": row["close_time"].strftime("%H:%M")})
+    return {
+        "hours": [
+            {"weekday": r["weekday"], "open": r["open_time"].strftime("%H:%M"), "close": r["close_time"].strftime("%H:%M")}
+            for r in hours
+        ],
+        "exceptions": [{"date": day.isoformat(), "hours": slots} for day, slots in by_day.items()],
+    }
+
+
+def _object_items(items: Any, name: str) -> List[Dict[str, Any]]:
+    """Lista de objetos JSON del payload; cualquier otra forma es un 400 (no un AttributeError)."""
+    if items is None:
+        return []
+    if not isinstance(items, list) or not all(isinstance(item, dict) for item in items):
+        raise ValueError(f"{name}_invalido: se esperaba una lista de objetos")
+    return items
+
+
+def _parse_ranges(items: Any, name: str) -> List[Tuple[time, time]]:
+    ranges = []
+    for item in _object_items(items, name):
+        open_time = _parse_time(item.get("open"), f"{name}_open")
+        close_time = _parse_time(item.get("close"), f"{name}_close")
+        if close_time <= open_time:
+            raise ValueError(f"{name}_rango_invalido")
+        ranges.append((open_time, close_time))
+    return ranges
+
+
+def update_business_hours(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Reemplaza la plantilla semanal (`hours`, weekday 0=lunes) y/o las excepciones por fecha (`exceptions`;
+    una fecha con `hours` vacio queda cerrada). Las claves ausentes no se modifican.
+    """
+    if not isinstance(payload, dict):
+        raise ValueError("payload_invalido: se esperaba un objeto JSON")
+    with get_db() as conn:
+        if "hours" in payload:
+            rows = []
+            for item in _object_items(payload.get("hours"), "hours"):
+                try:
+                    weekday = int(item.get("weekday"))
+                except (TypeError, ValueError):
+                    raise ValueError("weekday_invalido")
+                if not 0 <= weekday <= 6:
+                    raise ValueError("weekday_invalido")
+                rows.extend((weekday, o, c) for o, c in _parse_ranges([item], "hours"))
+            conn.execute("DELETE FROM business_hours")
+            if rows:
+                with conn.cursor() as cur:
+                    cur.executemany(
+                        "INSERT INTO business_hours (weekday, open_time, close_time) VALUES (%s, %s, %s)", rows
+                    )
+        for item in _object_items(payload.get("exceptions"), "exceptions"):
+            try:
+                day = date.fromisoformat(str(item.get("date")))
+            except ValueError:
+                raise ValueError("exception_date_invalida")
+            ranges = _parse_ranges(item.get("hours"), "exception")
+            conn.execute("DELETE FROM business_hours_exceptions WHERE day = %s", (day,))
+            rows = [(day, o, c) for o, c in ranges] or [(day, None, None)]
+            with conn.cursor() as cur:
+                cur.executemany(
+                    "INSERT INTO business_hours_exceptions (day, open_time, close_time) VALUES (%s, %s, %s)", rows
+                )
+    return get_business_hours()
+
+
+def delete_business_hours_exception(day_raw: str) -> None:
+    try:
+        day = date.fromisoformat(day_raw)
+    except ValueError:
+        raise ValueError("exception_date_invalida")
+    with get_db() as conn:
+        deleted = conn.execute("DELETE FROM business_hours_exceptions WHERE day = %s", (day,)).rowcount
+    if not deleted:
+        raise LookupError("not_found")
+
+
+def _open_windows(conn, start: datetime, end: datetime, tz: ZoneInfo) -> List[Interval]:
+    """Ventanas de atencion (instantes absolutos) dentro de [start, end) segun plantilla + excepciones."""
+    first_day = start.astimezone(tz).date()
+    last_day = end.astimezone(tz).date()
+    templates: Dict[int, List[Tuple[time, time]]] = {}
+    for row in conn.execute("SELECT weekday, open_time, close_time FROM business_hours ORDER BY open_time").fetchall():
+        templates.setdefault(row["weekday"], []).append((row["open_time"], row["close_time"]))
+    exceptions: Dict[date, List[Tuple[time, time]]] = {}
+    for row in conn.execute(
+        "SELECT day, open_time, close_time FROM business_hours_exceptions WHERE day BETWEEN %s AND %s ORDER BY open_time",
+        (first_day, last_day),
+    ).fetchall():
+        ranges = exceptions.setdefault(row["day"], [])
+        if row["open_time"] is not None:
+            ranges.append((row["open_time"], row["close_time"]))
+
+    if not templates and not exceptions:
+        # Sin horario configurado: todo el rango es atendible.
+        return [(start, end)]
+
+    windows: List[Interval] = []
+    day = first_day
+    while day <= last_day:
+        ranges = exceptions[day] if day in exceptions else templates.get(day.weekday(), [])
+        for open_time, close_time in ranges:
+            w_start = max(datetime.combine(day, open_time, tzinfo=tz), start)
+            w_end = min(datetime.combine(day, close_time, tzinfo=tz), end)
+            if w_end > w_start:
+                windows.append((w_start, w_end))
+        day += timedelta(days=1)
+    return windows
+
+
+def _merge(intervals: List[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in intervals:
+        if merged and start <= merged[-1][1]:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _free_intervals(windows: List[Interval], busy: List[Interval]) -> List[Interval]:
+    """Resta los intervalos ocupados (ordenados y fusionados) de las ventanas en un solo barrido lineal."""
+    free: List[Interval] = []
+    idx = 0
+    for w_start, w_end in windows:
+        while idx < len(busy) and busy[idx][1] <= w_start:
+            idx += 1
+        cursor = w_start
+        probe = idx
+        while probe < len(busy) and busy[probe][0] < w_end:
+            if busy[probe][0] > cursor:
+                free.append((cursor, busy[probe][0]))
+            cursor = max(cursor, busy[probe][1])
+            probe += 1
+        if cursor < w_end:
+            free.append((cursor, w_end))
+    return free
+
+
+def find_availability(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Huecos libres de `duration` minutos en [from, to): una consulta por rango (indice GiST del periodo)
+    para las citas que ocupan agenda mas las ocurrencias virtuales de las series, fusion de intervalos
+    y barrido lineal contra el horario de atencion.
+    """
+    if not params.get("from") or not params.get("to"):
+        raise ValueError("from y to son requeridos")
+    range_start = parse_datetime(params["from"])
+    range_end = parse_datetime(params["to"])
+    if range_end <= range_start:
+        raise ValueError("rango_invalido: to debe ser posterior a from")
+    if range_end - range_start > MAX_RANGE:
+        raise ValueError("rango_demasiado_grande: maximo 31 dias")
+    try:
+        duration = int(params.get("duration") or 30)
+        step = int(params.get("step") or duration)
+    except (TypeError, ValueError):
+        raise ValueError("duration_invalida")
+    if duration not in ALLOWED_DURATIONS:
+        raise ValueError(f"duration_invalida: valores permitidos {list(ALLOWED_DURATIONS)}")
+    if not 5 <= step <= 240:
+        raise ValueError("step_invalido")
+    resource = (params.get("resource") or "").strip() or None
+
+    statuses = ", ".join(f"'{value}'" for value in NON_BLOCKING_STATUSES)
+    conditions = [f"{PERIOD_SQL} && tstzrange(%s, %s, '[)')", f"status::text NOT IN ({statuses})"]
+    query_params: List[Any] = [range_start, range_end]
+    if resource:
+        conditions.append("resource = %s")
+        query_params.append(resource)
+
+    with get_db() as conn:
+        tz_name = _resolve_timezone(conn, (params.get("timezone") or "").strip() or None)
+        tz = _zone(tz_name)
+        windows = _open_windows(conn, range_start, range_end, tz)
+        rows = conn.execute(
+            f"""
+            SELECT start_time, greatest(start_time, end_time) AS end_time
+            FROM appointments
+            WHERE {' AND '.join(conditions)}
+            ORDER BY start_time
+            """,
+            tuple(query_params),
+        ).fetchall()
+        occurrence_filters = {"resource": resource} if resource else {}
+        occurrences = [
+            (datetime.fromisoformat(o["start_time"]), datetime.fromisoformat(o["end_time"]))
+            for o in expand_occurrences(conn, range_start, range_end, limit=None, **occurrence_filters)
+            if o["status"] not in NON_BLOCKING_STATUSES
+        ]
+
+    busy = _merge(sorted([(r["start_time"], r["end_time"]) for r in rows] + occurrences))
+    length = timedelta(minutes=duration)
+    stride = timedelta(minutes=step)
+    slots: List[Dict[str, str]] = []
+    truncated = False
+    for free_start, free_end in _free_intervals(windows, busy):
+        # Los inicios se alinean a la grilla de `step` desde la medianoche local del dia.
+        local_start = free_start.astimezone(tz)
+        midnight = datetime.combine(local_start.date(), time(0), tzinfo=tz)
+        offset = -(-(local_start - midnight) // stride)
+        candidate = midnight + offset * stride
+        while candidate + length <= free_end:
+            if len(slots) >= MAX_SLOTS:
+                truncated = True
+                break
+            slots.append({"start": candidate.isoformat(), "end": (candidate + length).isoformat()})
+            candidate += stride
+        if truncated:
+            break
+
+    return {
+        "timezone": tz_name,
+        "duration": duration,
+        "step": step,
+        "resource": resource,
+        "slots": slots,
+        "truncated": truncated,
+    }
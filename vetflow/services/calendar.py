@@ -1,10 +1,16 @@
+import base64
+import json
 import logging
+from datetime import datetime, timedelta, timezone as dt_timezone
 from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 
+from flask import request
 from psycopg import errors
 
+from ..config import config
 from ..db import get_db
-from ..serializers import row_to_appointment_api
+from ..serializers import _iso_datetime, row_to_appointment_api
 from ..utils import parse_datetime
 
 logger = logging.getLogger(__name__)
@@ -18,6 +24,32 @@ STATUS_CHOICES: List[Dict[str, str]] = [
 ]
 STATUS_LABELS = {choice["value"]: choice["label"] for choice in STATUS_CHOICES}
 DEFAULT_STATUS = "programada"
+# Periodo de la cita tal como lo indexa `appointments_period_idx` (GiST); `greatest` tolera filas con end < start.
+PERIOD_SQL = "tstzrange(start_time, greatest(start_time, end_time), '[)')"
+LIST_MAX_LIMIT = 5000
+CHANGES_DEFAULT_LIMIT = 500
+# Tiempo que se conservan los tombstones; cursores mas antiguos deben resincronizar desde cero.
+DELETIONS_RETENTION = timedelta(days=30)
+# Estados que no ocupan agenda: no cuentan como solape ni para la restriccion de exclusion.
+NON_BLOCKING_STATUSES = ("cancelada", "no_show")
+OVERLAP_CONSTRAINT = "appointments_no_overlap"
+OVERLAP_SCOPES = ("workspace", "resource")
+CONFLICTS_MAX_LIMIT = 1000
+SUMMARY_GROUPS = ("day", "month")
+SUMMARY_MAX_RANGE = timedelta(days=366)
+_UNSET = object()
+
+
+class SyncCursorExpired(ValueError):
+    """El cursor es anterior a la retencion de tombstones: el cliente debe hacer una sincronizacion completa."""
+
+
+class AppointmentConflictError(ValueError):
+    def __init__(self, conflict_ids: List[int], conflict_series: Optional[List[int]] = None):
+        super().__init__("cita_solapada")
+        self.conflict_ids = conflict_ids
+        # Series recurrentes cuyas ocurrencias (virtuales) chocan con lo pedido
+        self.conflict_series = conflict_series or []
 
 
 def _ensure_timezone_column(conn) -> None:
@@ -40,6 +72,16 @@ def _ensure_client_id_column(conn) -> None:
         pass
 
 
+def _ensure_resource_column(conn) -> None:
+    """
+    Migracion idempotente: recurso opcional (veterinario, sala...) usado para acotar la prevencion de solapes.
+    """
+    try:
+        conn.execute("ALTER TABLE IF EXISTS appointments ADD COLUMN IF NOT EXISTS resource TEXT")
+    except Exception:
+        pass
+
+
 def get_status_choices() -> List[Dict[str, str]]:
     return STATUS_CHOICES
 
@@ -53,18 +95,296 @@ def normalize_status(raw: Optional[str]) -> str:
     return value
 
 
-def list_appointments() -> List[Dict[str, Any]]:
+def _overlap_settings(conn) -> Dict[str, Any]:
+    try:
+        row = conn.execute("SELECT value FROM calendar_settings WHERE key = 'overlap'").fetchone()
+    except errors.UndefinedTable:
+        conn.rollback()
+        row = None
+    value = (row or {}).get("value") or {}
+    scope = value.get("scope") if value.get("scope") in OVERLAP_SCOPES else "workspace"
+    return {"enabled": bool(value.get("enabled")), "scope": scope}
+
+
+def _blocking_filter(alias: str = "", cast: bool = True) -> str:
+    """
+    Citas que ocupan horario. Sin `cast` compara el enum contra sus etiquetas: el cast enum->text
+    (enum_out) es STABLE y no se admite en el predicado de un indice/EXCLUDE.
+    """
+    prefix = f"{alias}." if alias else ""
+    statuses = ", ".join(f"'{value}'" for value in NON_BLOCKING_STATUSES)
+    column = f"{prefix}status::text" if cast else f"{prefix}status"
+    return f"{column} NOT IN ({statuses})"
+
+
+def _conflicting_ids(conn, start_time, end_time, resource: Optional[str], scope: str, exclude_id: Optional[int]) -> List[int]:
+    conditions = [f"{PERIOD_SQL} && tstzrange(%s, greatest(%s, %s), '[)')", _blocking_filter()]
+    params: List[Any] = [start_time, start_time, end_time]
+    if scope == "resource":
+        conditions.append("coalesce(resource, '') = coalesce(%s, '')")
+        params.append(resource)
+    if exclude_id is not None:
+        conditions.append("id <> %s")
+        params.append(exclude_id)
+    rows = conn.execute(
+        f"SELECT id FROM appointments WHERE {' AND '.join(conditions)} ORDER BY start_time, id LIMIT 50",
+        tuple(params),
+    ).fetchall()
+    return [r["id"] for r in rows]
+
+
+def overlap_conflict(conn, start_time=None, end_time=None, resource: Any = _UNSET, appointment_id: Optional[int] = None):
+    """
+    Construye el AppointmentConflictError tras un ExclusionViolation: revierte la transaccion fallida y
+    busca (via indice GiST) las citas que chocan con el periodo pedido. En updates parciales completa los
+    valores faltantes con los actuales de la cita.
+    """
+    conn.rollback()
+    if appointment_id is not None:
+        current = conn.execute(
+            "SELECT start_time, end_time, resource FROM appointments WHERE id=%s", (appointment_id,)
+        ).fetchone()
+        if current:
+            start_time = start_time or current["start_time"]
+            end_time = end_time or current["end_time"]
+            if resource is _UNSET:
+                resource = current["resource"]
+    if resource is _UNSET:
+        resource = None
+    scope = _overlap_settings(conn)["scope"]
+    ids = _conflicting_ids(conn, start_time, end_time, resource, scope, appointment_id) if start_time and end_time else []
+    logger.info("Cita rechazada por solape id=%s conflictos=%s", appointment_id, ids)
+    return AppointmentConflictError(ids)
+
+
+def check_series_overlap(conn, start_time, end_time, status: Optional[str], resource: Optional[str]) -> None:
+    """
+    Contraparte de la validacion al crear series: la restriccion EXCLUDE solo ve filas de `appointments`,
+    asi que con la prevencion activa una cita puntual se valida contra las ocurrencias virtuales de las
+    series en [start_time, end_time). Lanza AppointmentConflictError con `conflict_series`.
+    """
+    if not start_time or not end_time or end_time <= start_time or str(status) in NON_BLOCKING_STATUSES:
+        return
+    settings = _overlap_settings(conn)
+    if not settings["enabled"]:
+        return
+    # Import local: series depende de este modulo.
+    from .series import _ANY_RESOURCE, expand_occurrences
+
+    occurrences = expand_occurrences(
+        conn, start_time, end_time, limit=None, resource=resource if settings["scope"] == "resource" else _ANY_RESOURCE
+    )
+    conflict_series = sorted(
+        {
+            o["series_id"]
+            for o in occurrences
+            if o["status"] not in NON_BLOCKING_STATUSES
+            and datetime.fromisoformat(o["start_time"]) < end_time
+            and datetime.fromisoformat(o["end_time"]) > start_time
+        }
+    )
+    if conflict_series:
+        logger.info("Cita rechazada por solape con series=%s", conflict_series)
+        raise AppointmentConflictError([], conflict_series)
+
+
+def get_calendar_settings() -> Dict[str, Any]:
+    with get_db() as conn:
+        _ensure_resource_column(conn)
+        settings = _overlap_settings(conn)
+        enforced = conn.execute(
+            "SELECT 1 FROM pg_constraint WHERE conname = %s AND conrelid = 'appointments'::regclass",
+            (OVERLAP_CONSTRAINT,),
+        ).fetchone()
+    return {"prevent_overlaps": bool(enforced), "overlap_scope": settings["scope"]}
+
+
+def update_calendar_settings(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Activa/desactiva la prevencion de solapes del workspace. Al activarla se crea una restriccion EXCLUDE
+    (GiST sobre el periodo, y `resource` si el alcance es por recurso); falla con conflicto si ya hay solapes.
+    La restriccion solo se reconstruye si cambia `enabled` o, activa, el alcance.
+    """
+    enabled = payload.get("prevent_overlaps")
+    if isinstance(enabled, str):
+        enabled = enabled.strip().lower() in ("1", "true", "yes", "on", "si")
+    scope = (payload.get("overlap_scope") or "workspace").strip().lower()
+    if scope not in OVERLAP_SCOPES:
+        raise ValueError("overlap_scope_invalido")
+
+    with get_db() as conn:
+        _ensure_resource_column(conn)
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS calendar_settings (key TEXT PRIMARY KEY, value JSONB NOT NULL, updated_at TIMESTAMPTZ DEFAULT NOW())"
+        )
+        current = _overlap_settings(conn)
+        enforced = conn.execute(
+            "SELECT 1 FROM pg_constraint WHERE conname = %s AND conrelid = 'appointments'::regclass",
+            (OVERLAP_CONSTRAINT,),
+        ).fetchone()
+        rebuild = bool(enabled) != bool(enforced) or (bool(enabled) and scope != current["scope"])
+        if rebuild and enforced:
+            conn.execute(f"ALTER TABLE appointments DROP CONSTRAINT {OVERLAP_CONSTRAINT}")
+        if rebuild and enabled:
+            existing = find_conflicts(scope=scope, limit=CONFLICTS_MAX_LIMIT, conn=conn)
+            if existing:
+                raise AppointmentConflictError(sorted({c["id"] for c in existing} | {c["conflicts_with"] for c in existing}))
+            key_columns = f"(coalesce(resource, '')) public.gist_text_ops WITH =, " if scope == "resource" else ""
+            try:
+                conn.execute(
+                    f"""
+                    ALTER TABLE appointments ADD CONSTRAINT {OVERLAP_CONSTRAINT}
+                    EXCLUDE USING gist ({key_columns}({PERIOD_SQL}) WITH &&)
+                    WHERE ({_blocking_filter(cast=False)})
+                    """
+                )
+            except errors.UndefinedObject:
+                raise ValueError("btree_gist_no_disponible")
+            except errors.ExclusionViolation:
+                # Un solape entro entre la verificacion y el ALTER: se vuelve a buscar para reportarlo.
+                conn.rollback()
+                existing = find_conflicts(scope=scope, limit=CONFLICTS_MAX_LIMIT, conn=conn)
+                raise AppointmentConflictError(sorted({c["id"] for c in existing} | {c["conflicts_with"] for c in existing}))
+        conn.execute(
+            """
+            INSERT INTO calendar_settings (key, value, updated_at)
+            VALUES ('overlap', %s::jsonb, NOW())
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+            """,
+            (json.dumps({"enabled": bool(enabled), "scope": scope}),),
+        )
+    logger.info("Prevencion de solapes enabled=%s scope=%s", bool(enabled), scope)
+    return {"prevent_overlaps": bool(enabled), "overlap_scope": scope}
+
+
+def find_conflicts(
+    range_start: Optional[datetime] = None,
+    range_end: Optional[datetime] = None,
+    scope: Optional[str] = None,
+    limit: Optional[int] = None,
+    conn=None,
+) -> List[Dict[str, Any]]:
+    """
+    Pares de citas solapadas (self-join; el lado interno usa el indice GiST del periodo).
+    Sin `scope` usa el alcance configurado del workspace.
+    """
+    if conn is None:
+        with get_db() as own_conn:
+            _ensure_resource_column(own_conn)
+            return find_conflicts(range_start, range_end, scope, limit, conn=own_conn)
+
+    scope = scope or _overlap_settings(conn)["scope"]
+    if scope not in OVERLAP_SCOPES:
+        raise ValueError("scope_invalido")
+    limit_value = max(1, min(int(limit or CONFLICTS_MAX_LIMIT), CONFLICTS_MAX_LIMIT))
+    join_conditions = [
+        "b.id <> a.id",
+        f"tstzrange(b.start_time, greatest(b.start_time, b.end_time), '[)') && tstzrange(a.start_time, greatest(a.start_time, a.end_time), '[)')",
+        _blocking_filter("b"),
+    ]
+    if scope == "resource":
+        join_conditions.append("coalesce(b.resource, '') = coalesce(a.resource, '')")
+    where = [_blocking_filter("a")]
+    params: List[Any] = []
+    if range_start or range_end:
+        where.append(f"tstzrange(a.start_time, greatest(a.start_time, a.end_time), '[)') && tstzrange(%s, %s, '[)')")
+        params.extend([range_start, range_end])
+    rows = conn.execute(
+        f"""
+        SELECT a.id, b.id AS conflicts_with, a.start_time, a.end_time, a.resource,
+               b.start_time AS other_start_time, b.end_time AS other_end_time
+        FROM appointments a
+        JOIN appointments b ON {' AND '.join(join_conditions)}
+        WHERE {' AND '.join(where)}
+          AND (a.id < b.id OR NOT (tstzrange(b.start_time, greatest(b.start_time, b.end_time), '[)') && tstzrange(%s, %s, '[)')))
+        ORDER BY a.start_time, a.id, b.id
+        LIMIT %s
+        """,
+        tuple(params + [range_start, range_end, limit_value]),
+    ).fetchall()
+    return [
+        {
+            "id": r["id"],
+            "conflicts_with": r["conflicts_with"],
+            "resource": r["resource"],
+            "start_time": _iso_datetime(r["start_time"]),
+            "end_time": _iso_datetime(r["end_time"]),
+            "other_start_time": _iso_datetime(r["other_start_time"]),
+            "other_end_time": _iso_datetime(r["other_end_time"]),
+        }
+        for r in rows
+    ]
+
+
+def list_appointments(limit: Optional[int] = None) -> List[Dict[str, Any]]:
+    query = "SELECT * FROM appointments ORDER BY start_time DESC"
+    params: List[Any] = []
+    if limit:
+        query += " LIMIT %s"
+        params.append(max(1, min(int(limit), LIST_MAX_LIMIT)))
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
-        rows = conn.execute("SELECT * FROM appointments ORDER BY start_time DESC").fetchall()
+        _ensure_resource_column(conn)
+        rows = conn.execute(query, tuple(params)).fetchall()
     return [row_to_appointment_api(r) for r in rows]
 
 
+def list_appointments_range(
+    range_start: Optional[datetime] = None,
+    range_end: Optional[datetime] = None,
+    statuses: Optional[List[str]] = None,
+    client_id: Optional[int] = None,
+    limit: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Citas que se solapan con [range_start, range_end) (cualquiera de los extremos puede omitirse),
+    usando el indice GiST del periodo; filtros opcionales por status y cliente. Con ambos extremos
+    incluye las ocurrencias virtuales de las series recurrentes.
+    """
+    conditions: List[str] = []
+    params: List[Any] = []
+    if range_start or range_end:
+        conditions.append(f"{PERIOD_SQL} && tstzrange(%s, %s, '[)')")
+        params.extend([range_start, range_end])
+    if statuses:
+        conditions.append("status::text = ANY(%s)")
+        params.append(list(statuses))
+    if client_id is not None:
+        conditions.append("client_id = %s")
+        params.append(client_id)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+    limit_value = max(1, min(int(limit or LIST_MAX_LIMIT), LIST_MAX_LIMIT))
+    with get_db() as conn:
+        _ensure_timezone_column(conn)
+        _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
+        rows = conn.execute(
+            f"""
+            SELECT *
+            FROM appointments
+            {where}
+            ORDER BY start_time ASC, id ASC
+            LIMIT %s
+            """,
+            tuple(params + [limit_value]),
+        ).fetchall()
+        items = [row_to_appointment_api(r) for r in rows]
+        if range_start and range_end:
+            # Import local: series depende de este modulo.
+            from .series import expand_occurrences
+
+            virtual = expand_occurrences(conn, range_start, range_end, statuses, client_id, limit_value)
+            if virtual:
+                items = sorted(items + virtual, key=lambda a: parse_datetime(a["start_time"]))[:limit_value]
+    return items
+
+
 def list_upcoming_appointments() -> List[Dict[str, Any]]:
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
         rows = conn.execute(
             "SELECT * FROM appointments WHERE GREATEST(start_time, end_time) >= NOW() ORDER BY start_time ASC"
         ).fetchall()
@@ -86,13 +406,17 @@ def create_appointment(
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
-        conn.execute(
-            """
-            INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            """,
-            (title, description, start_time, end_time, status, timezone, client_id),
-        )
+        _ensure_resource_column(conn)
+        try:
+            conn.execute(
+                """
+                INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                """,
+                (title, description, start_time, end_time, status, timezone, client_id),
+            )
+        except errors.ExclusionViolation:
+            raise overlap_conflict(conn, start_time, end_time, None)
 
 
 def update_appointment(
@@ -121,14 +445,18 @@ def update_appointment(
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
-        updated = conn.execute(
-            f"""
-            UPDATE appointments
-            SET {', '.join(fields)}
-            WHERE id=%s
-            """,
-            tuple(values),
-        ).rowcount
+        _ensure_resource_column(conn)
+        try:
+            updated = conn.execute(
+                f"""
+                UPDATE appointments
+                SET {', '.join(fields)}
+                WHERE id=%s
+                """,
+                tuple(values),
+            ).rowcount
+        except errors.ExclusionViolation:
+            raise overlap_conflict(conn, start_time, end_time, appointment_id=appointment_id)
     return bool(updated)
 
 
@@ -138,18 +466,238 @@ def delete_appointment(appointment_id: int) -> bool:
     return bool(deleted)
 
 
-def api_list():
-    return list_appointments()
+def _coerce_statuses(raw: Optional[str]) -> Optional[List[str]]:
+    if not raw:
+        return None
+    return [normalize_status(value) for value in str(raw).split(",") if value.strip()] or None
+
+
+def api_list(params: Optional[Dict[str, Any]] = None):
+    """
+    Listado para APIs/bots. Con `from`/`to`, `status` o `client_id` consulta solo las citas que aplican
+    (indices por periodo y cliente); sin filtros mantiene el listado completo, respetando `limit`.
+    """
+    params = params or {}
+    range_start = parse_datetime(params["from"]) if params.get("from") else None
+    range_end = parse_datetime(params["to"]) if params.get("to") else None
+    if range_start and range_end and range_end <= range_start:
+        raise ValueError("rango_invalido: to debe ser posterior a from")
+    statuses = _coerce_statuses(params.get("status"))
+    client_id = _coerce_client_id(params.get("client_id"))
+    limit = None
+    if params.get("limit") not in (None, ""):
+        try:
+            limit = int(params["limit"])
+        except (TypeError, ValueError):
+            raise ValueError("limit_invalido")
+    if range_start or range_end or statuses or client_id is not None:
+        return list_appointments_range(range_start, range_end, statuses, client_id, limit)
+    return list_appointments(limit)
+
+
+def _summary_timezone(explicit: Optional[str]) -> str:
+    name = (explicit or "").strip()
+    if not name:
+        try:
+            name = (request.headers.get("X-Timezone") or "").strip()
+        except RuntimeError:
+            name = ""
+    name = name or (config.APP_TIMEZONE or "UTC").strip() or "UTC"
+    try:
+        ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"timezone_invalida: {name}")
+    return name
+
+
+def api_summary(params: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Conteos por dia (o mes) y estado para la vista mensual, agrupando por la fecha local de `start_time`
+    en la zona pedida (`tz` > X-Timezone > APP_TIMEZONE). El filtro por `start_time` usa el indice
+    `appointments_start_end_idx`; las ocurrencias virtuales de series se suman sobre el mismo rango.
+    """
+    if not params.get("from") or not params.get("to"):
+        raise ValueError("from y to son requeridos")
+    range_start = parse_datetime(params["from"])
+    range_end = parse_datetime(params["to"])
+    if range_end <= range_start:
+        raise ValueError("rango_invalido: to debe ser posterior a from")
+    if range_end - range_start > SUMMARY_MAX_RANGE:
+        raise ValueError("rango_invalido: maximo 366 dias")
+    group = (params.get("group") or "day").strip().lower()
+    if group not in SUMMARY_GROUPS:
+        raise ValueError("group_invalido")
+    tz_name = _summary_timezone(params.get("tz") or params.get("timezone"))
+    statuses = _coerce_statuses(params.get("status"))
+
+    conditions = ["start_time >= %s", "start_time < %s"]
+    query_params: List[Any] = [range_start, range_end]
+    if statuses:
+        conditions.append("status::text = ANY(%s)")
+        query_params.append(list(statuses))
+    buckets: Dict[str, Dict[str, int]] = {}
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT date_trunc('{group}', start_time AT TIME ZONE %s)::date AS bucket, status::text AS status, count(*) AS total
+            FROM appointments
+            WHERE {' AND '.join(conditions)}
+            GROUP BY 1, 2
+            """,
+            tuple([tz_name] + query_params),
+        ).fetchall()
+        for r in rows:
+            buckets.setdefault(r["bucket"].isoformat(), {})[r["status"]] = int(r["total"])
+
+        # Import local: series depende de este modulo.
+        from .series import expand_occurrences
+
+        zone = ZoneInfo(tz_name)
+        for occurrence in expand_occurrences(conn, range_start, range_end, statuses, limit=LIST_MAX_LIMIT):
+            start = parse_datetime(occurrence["start_time"])
+            if not range_start <= start < range_end:
+                continue
+            local_day = start.astimezone(zone).date()
+            key = (local_day.replace(day=1) if group == "month" else local_day).isoformat()
+            by_status = buckets.setdefault(key, {})
+            by_status[occurrence["status"]] = by_status.get(occurrence["status"], 0) + 1
+
+    return {
+        "from": _iso_datetime(range_start),
+        "to": _iso_datetime(range_end),
+        "timezone": tz_name,
+        "group": group,
+        "buckets": [
+            {"date": key, "total": sum(by_status.values()), "by_status": by_status}
+            for key, by_status in sorted(buckets.items())
+        ],
+    }
+
+
+def _encode_cursor(updates: tuple, deletions: tuple, issued_at: datetime) -> str:
+    raw = json.dumps(
+        {"u": list(updates), "d": list(deletions), "t": issued_at.isoformat()},
+        separators=(",", ":"),
+    )
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+    except Exception:
+        raise ValueError("cursor_invalido")
+    if "t" not in data:
+        # Cursor por timestamp de versiones anteriores: no se puede traducir a xid, hay que resincronizar.
+        raise SyncCursorExpired("cursor_expirado")
+    try:
+        updates = (int(data["u"][0]), int(data["u"][1]))
+        deletions = (int(data["d"][0]), int(data["d"][1]))
+        issued_at = parse_datetime(data["t"])
+    except Exception:
+        raise ValueError("cursor_invalido")
+    return updates, deletions, issued_at
+
+
+def api_changes(since: Optional[str] = None, limit: Any = None) -> Dict[str, Any]:
+    """
+    Sincronizacion incremental: citas creadas/actualizadas despues del cursor, tombstones de citas
+    eliminadas y un cursor nuevo. Sin `since` devuelve el estado completo (paginado) y el cursor inicial.
+    El cursor es opaco; cuando `has_more` es true hay que volver a llamar con el cursor devuelto.
+    Avanza por orden de commit (`change_xid`) y nunca pasa de `pg_snapshot_xmin`: las filas de una
+    transaccion en curso, por larga que sea (COPY masivos), se entregan cuando hace commit.
+    """
+    try:
+        limit_value = int(limit) if limit not in (None, "") else CHANGES_DEFAULT_LIMIT
+    except (TypeError, ValueError):
+        raise ValueError("limit_invalido")
+    limit_value = max(1, min(limit_value, LIST_MAX_LIMIT))
+    since_updates, since_deletions, issued_at = _decode_cursor(since) if since else (None, None, None)
+
+    with get_db() as conn:
+        _ensure_timezone_column(conn)
+        _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
+        snapshot = conn.execute(
+            "SELECT NOW() AS now, pg_snapshot_xmin(pg_current_snapshot())::text AS xmin"
+        ).fetchone()
+        now = snapshot["now"]
+        upper = int(snapshot["xmin"])
+        if issued_at and issued_at < now - DELETIONS_RETENTION:
+            raise SyncCursorExpired("cursor_expirado")
+
+        update_filter = "(change_xid, id) > (%s::xid8, %s) AND " if since_updates else ""
+        update_params: List[Any] = [str(since_updates[0]), since_updates[1]] if since_updates else []
+        rows = conn.execute(
+            f"""
+            SELECT id, title, description, start_time, end_time, status, timezone, client_id, resource, created_at, updated_at,
+                   change_xid::text AS change_xid
+            FROM appointments
+            WHERE {update_filter}change_xid < %s::xid8
+            ORDER BY change_xid ASC, id ASC
+            LIMIT %s
+            """,
+            tuple(update_params + [str(upper), limit_value + 1]),
+        ).fetchall()
+
+        deleted_rows: List[Dict[str, Any]] = []
+        if since_deletions:
+            deleted_rows = conn.execute(
+                """
+                SELECT id, appointment_id, deleted_at, change_xid::text AS change_xid
+                FROM appointment_deletions
+                WHERE (change_xid, id) > (%s::xid8, %s) AND change_xid < %s::xid8
+                ORDER BY change_xid ASC, id ASC
+                LIMIT %s
+                """,
+                (str(since_deletions[0]), since_deletions[1], str(upper), limit_value + 1),
+            ).fetchall()
+
+    updates_more = len(rows) > limit_value
+    deletions_more = len(deleted_rows) > limit_value
+    rows = rows[:limit_value]
+    deleted_rows = deleted_rows[:limit_value]
+
+    # Sin mas paginas el cursor avanza hasta `upper`: todo xid menor ya termino y se entrego.
+    if updates_more:
+        next_updates = (int(rows[-1]["change_xid"]), rows[-1]["id"])
+    else:
+        next_updates = (upper, 0)
+    if deletions_more:
+        next_deletions = (int(deleted_rows[-1]["change_xid"]), deleted_rows[-1]["id"])
+    else:
+        next_deletions = (upper, 0)
+
+    return {
+        "changes": [row_to_appointment_api(r) for r in rows],
+        "deleted": [
+            {"id": r["appointment_id"], "deleted_at": r["deleted_at"].astimezone(dt_timezone.utc).isoformat()}
+            for r in deleted_rows
+        ],
+        "cursor": _encode_cursor(next_updates, next_deletions, now),
+        "has_more": updates_more or deletions_more,
+        "server_time": now.astimezone(dt_timezone.utc).isoformat(),
+    }
+
+
+def prune_appointment_deletions(schema: Optional[str] = None) -> int:
+    """Borra los tombstones fuera de la retencion (tarea periodica, no en cada GET de /changes)."""
+    with get_db(schema=schema) as conn:
+        return conn.execute(
+            "DELETE FROM appointment_deletions WHERE deleted_at < NOW() - %s", (DELETIONS_RETENTION,)
+        ).rowcount
 
 
 def api_get(appointment_id: int):
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
         try:
             row = conn.execute(
                 """
-                SELECT id, title, description, start_time, end_time, status, timezone, client_id, created_at, updated_at
+                SELECT id, title, description, start_time, end_time, status, timezone, client_id, resource, created_at, updated_at
                 FROM appointments WHERE id=%s
                 """,
                 (appointment_id,),
@@ -176,6 +724,11 @@ def _coerce_client_id(raw: Any):
         raise ValueError("client_id_invalido")
 
 
+def _coerce_resource(raw: Any) -> Optional[str]:
+    value = (str(raw) if raw is not None else "").strip()
+    return value or None
+
+
 def api_create(payload: Dict[str, Any]):
     title = payload.get("title")
     start_raw = payload.get("start_time")
@@ -188,19 +741,24 @@ def api_create(payload: Dict[str, Any]):
     status = normalize_status(payload.get("status"))
     timezone = payload.get("timezone")
     client_id = _coerce_client_id(payload.get("client_id"))
+    resource = _coerce_resource(payload.get("resource"))
 
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
+        check_series_overlap(conn, start_dt, end_dt, status, resource)
         try:
             row = conn.execute(
                 """
-                INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, created_at, updated_at
+                INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id, resource)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, resource, created_at, updated_at
                 """,
-                (title, payload.get("description"), start_dt, end_dt, status, timezone, client_id),
+                (title, payload.get("description"), start_dt, end_dt, status, timezone, client_id, resource),
             ).fetchone()
+        except errors.ExclusionViolation:
+            raise overlap_conflict(conn, start_dt, end_dt, resource)
         except errors.UndefinedColumn:
             row = conn.execute(
                 """
@@ -239,6 +797,9 @@ def api_update(appointment_id: int, payload: Dict[str, Any]):
     if "client_id" in payload:
         values.append(_coerce_client_id(payload.get("client_id")))
         fields.append("client_id=%s")
+    if "resource" in payload:
+        values.append(_coerce_resource(payload.get("resource")))
+        fields.append("resource=%s")
 
     if not fields:
         logger.warning("Update calendario sin cambios id=%s payload=%s", appointment_id, payload)
@@ -248,21 +809,44 @@ def api_update(appointment_id: int, payload: Dict[str, Any]):
     with get_db() as conn:
         _ensure_timezone_column(conn)
         _ensure_client_id_column(conn)
+        _ensure_resource_column(conn)
+        if {"start_time", "end_time", "status", "resource"} & payload.keys() and _overlap_settings(conn)["enabled"]:
+            # Update parcial: se completan los valores faltantes con los actuales para validar contra series.
+            current = conn.execute(
+                "SELECT start_time, end_time, status::text AS status, resource FROM appointments WHERE id=%s",
+                (appointment_id,),
+            ).fetchone()
+            if current:
+                check_series_overlap(
+                    conn,
+                    parse_datetime(payload["start_time"]) if "start_time" in payload else current["start_time"],
+                    parse_datetime(payload["end_time"]) if "end_time" in payload else current["end_time"],
+                    normalize_status(payload["status"]) if "status" in payload else current["status"],
+                    _coerce_resource(payload.get("resource")) if "resource" in payload else current["resource"],
+                )
         try:
             row = conn.execute(
                 f"""
                 UPDATE appointments
                 SET {', '.join(fields)}, updated_at=NOW()
                 WHERE id=%s
-                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, created_at, updated_at
+                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, resource, created_at, updated_at
                 """,
                 tuple(values),
             ).fetchone()
+        except errors.ExclusionViolation:
+            raise overlap_conflict(
+                conn,
+                parse_datetime(payload["start_time"]) if "start_time" in payload else None,
+                parse_datetime(payload["end_time"]) if "end_time" in payload else None,
+                _coerce_resource(payload.get("resource")) if "resource" in payload else _UNSET,
+                appointment_id=appointment_id,
+            )
         except errors.UndefinedColumn:
-            fields_no_extra = [f for f in fields if f not in ("timezone=%s", "client_id=%s")]
+            fields_no_extra = [f for f in fields if f not in ("timezone=%s", "client_id=%s", "resource=%s")]
             values_no_extra: List[Any] = []
             for idx, field in enumerate(fields):
-                if field in ("timezone=%s", "client_id=%s"):
+                if field in ("timezone=%s", "client_id=%s", "resource=%s"):
                     continue
                 values_no_extra.append(values[idx])
             values_no_extra.append(appointment_id)
@@ -288,3 +872,147 @@ def api_delete(appointment_id: int):
         raise LookupError("not_found")
     logger.info("Cita eliminada id=%s", appointment_id)
     return {"deleted": appointment_id}
+
+
+BULK_MAX_ROWS = 50000
+BULK_MODES = ("atomic", "best_effort")
+_BULK_COLUMNS = (
+    "row_index", "title", "description", "start_time", "end_time", "status", "timezone", "client_id", "resource", "ical_uid"
+)
+
+
+def _bulk_row(item: Any) -> tuple:
+    if not isinstance(item, dict):
+        raise ValueError("se esperaba un objeto JSON")
+    title = (str(item.get("title") or "")).strip()
+    if not title or not item.get("start_time") or not item.get("end_time"):
+        raise ValueError("title, start_time y end_time son requeridos")
+    start_dt = parse_datetime(str(item["start_time"]))
+    end_dt = parse_datetime(str(item["end_time"]))
+    if end_dt < start_dt:
+        raise ValueError("end_time anterior a start_time")
+    return (
+        title,
+        item.get("description"),
+        start_dt,
+        end_dt,
+        normalize_status(item.get("status")),
+        (str(item.get("timezone") or "")).strip() or None,
+        _coerce_client_id(item.get("client_id")),
+        _coerce_resource(item.get("resource")),
+        (str(item.get("ical_uid") or "")).strip() or None,
+    )
+
+
+def api_bulk_create(records, mode: str = "atomic") -> Dict[str, Any]:
+    """
+    Alta masiva de citas. `records` es un iterable de (indice, objeto) (o (indice, excepcion) si el
+    registro no se pudo parsear; se reporta como error de esa fila). Las filas validas se cargan con COPY a una tabla temporal y se insertan con un
+    solo INSERT ... SELECT en una transaccion. Filas con `ical_uid` ya existente (o repetido en el lote) se omiten
+    y se cuentan en `duplicates`.
+    - atomic: cualquier error (validacion, cliente inexistente, solape) revierte todo.
+    - best_effort: se insertan las filas validas y se reportan las demas por indice.
+    """
+    if mode not in BULK_MODES:
+        raise ValueError(f"mode_invalido: {list(BULK_MODES)}")
+    atomic = mode == "atomic"
+    row_errors: List[Dict[str, Any]] = []
+    received = 0
+    created = 0
+    duplicates = 0
+
+    # Sin los _ensure_*_column: el COPY consume el body del request (o el .ics) en esta transaccion y un
+    # ALTER TABLE dejaria appointments con ACCESS EXCLUSIVE durante toda la subida. Las columnas las
+    # provisiona ensure_workspace_schema.
+    with get_db() as conn:
+        status_type = conn.execute(
+            "SELECT atttypid::regtype::text AS type FROM pg_attribute WHERE attrelid = 'appointments'::regclass AND attname = 'status'"
+        ).fetchone()["type"]
+        conn.execute(
+            """
+            CREATE TEMP TABLE appointment_import (
+                row_index INTEGER, title TEXT, description TEXT, start_time TIMESTAMPTZ, end_time TIMESTAMPTZ,
+                status TEXT, timezone TEXT, client_id INTEGER, resource TEXT, ical_uid TEXT
+            ) ON COMMIT DROP
+            """
+        )
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY appointment_import ({', '.join(_BULK_COLUMNS)}) FROM STDIN") as copy:
+                for index, item in records:
+                    received += 1
+                    if received > BULK_MAX_ROWS:
+                        raise ValueError(f"demasiadas_filas: maximo {BULK_MAX_ROWS}")
+                    try:
+                        if isinstance(item, Exception):
+                            raise ValueError(str(item))
+                        copy.write_row((index,) + _bulk_row(item))
+                    except ValueError as ex:
+                        row_errors.append({"index": index, "error": str(ex)})
+
+        missing_clients = conn.execute(
+            """
+            SELECT i.row_index, i.client_id
+            FROM appointment_import i
+            LEFT JOIN clients c ON c.id = i.client_id
+            WHERE i.client_id IS NOT NULL AND c.id IS NULL
+            """
+        ).fetchall()
+        if missing_clients:
+            row_errors.extend({"index": r["row_index"], "error": f"cliente_no_existe: {r['client_id']}"} for r in missing_clients)
+            conn.execute(
+                "DELETE FROM appointment_import WHERE row_index = ANY(%s)", ([r["row_index"] for r in missing_clients],)
+            )
+
+        if atomic and row_errors:
+            conn.rollback()
+            return _bulk_result(mode, received, 0, row_errors)
+
+        staged_count = received - len(row_errors)
+        insert_sql = f"""
+            INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id, resource, ical_uid)
+            SELECT title, description, start_time, end_time, status::{status_type}, timezone, client_id, resource, ical_uid
+            FROM appointment_import
+        """
+        on_conflict = " ON CONFLICT (ical_uid) WHERE ical_uid IS NOT NULL DO NOTHING"
+        try:
+            with conn.transaction():
+                created = conn.execute(insert_sql + " ORDER BY row_index" + on_conflict).rowcount
+            duplicates = staged_count - created
+        except (errors.ExclusionViolation, errors.IntegrityError):
+            # Solape u otra restriccion: se reintenta fila a fila (savepoints) para identificar las culpables.
+            # Con indice sobre row_index cada reintento es una busqueda puntual, no un barrido de la tabla temporal.
+            created = 0
+            conn.execute("CREATE INDEX ON appointment_import (row_index)")
+            conn.execute("ANALYZE appointment_import")
+            staged = conn.execute("SELECT row_index FROM appointment_import ORDER BY row_index").fetchall()
+            for staged_row in staged:
+                try:
+                    with conn.transaction():
+                        inserted = conn.execute(insert_sql + " WHERE row_index = %s" + on_conflict, (staged_row["row_index"],)).rowcount
+                    created += inserted
+                    duplicates += 1 - inserted
+                except errors.ExclusionViolation:
+                    row_errors.append({"index": staged_row["row_index"], "error": "cita_solapada"})
+                except errors.IntegrityError as ex:
+                    row_errors.append({"index": staged_row["row_index"], "error": f"restriccion: {ex.diag.constraint_name or ex}"})
+            if atomic and row_errors:
+                conn.rollback()
+                return _bulk_result(mode, received, 0, row_errors)
+
+    logger.info(
+        "Alta masiva de citas mode=%s recibidas=%s creadas=%s duplicadas=%s errores=%s",
+        mode, received, created, duplicates, len(row_errors),
+    )
+    return _bulk_result(mode, received, created, row_errors, duplicates)
+
+
+def _bulk_result(mode: str, received: int, created: int, row_errors: List[Dict[str, Any]], duplicates: int = 0) -> Dict[str, Any]:
+    row_errors.sort(key=lambda e: e["index"])
+    return {
+        "mode": mode,
+        "received": received,
+        "created": created,
+        "duplicates": duplicates,
+        "failed": len(row_errors),
+        "errors": row_errors,
+    }
@@ -1,14 +1,68 @@
+import base64
+import csv
+import io
+import json
 import logging
+import threading
 import unicodedata
-from typing import Any, Dict, List, Optional
+from datetime import datetime
+from typing import Any, Dict, Iterator, List, Optional
 
 from psycopg import errors
 
-from ..db import get_db
-from ..utils import parse_datetime
+from ..cache import LRUCache, SingleFlight
+from ..config import config
+from ..db import _resolve_schema, get_db
+from ..http_cache import collection_versions
+from ..serializers import _iso_datetime
+from ..utils import normalize_phone_e164, parse_datetime
+from .calendar import check_series_overlap, overlap_conflict
 
 logger = logging.getLogger(__name__)
 
+CLIENT_COLUMNS = "id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at"
+CLIENT_FIELDS = tuple(column.strip() for column in CLIENT_COLUMNS.split(","))
+LIST_DEFAULT_LIMIT = 200
+LIST_MAX_LIMIT = 500
+# Columnas de `client_activity` (mantenida por triggers de appointments y client_notes).
+ACTIVITY_SQL = {
+    "last_appointment_at": "ca.last_appointment_at",
+    "next_appointment_at": "ca.next_appointment_at",
+    "appointment_count": "coalesce(ca.appointment_count, 0)",
+    "no_show_count": "coalesce(ca.no_show_count, 0)",
+    "note_count": "coalesce(ca.note_count, 0)",
+}
+ACTIVITY_FIELDS = tuple(ACTIVITY_SQL)
+ACTIVITY_REFRESH_BATCH = 1000
+DETAIL_PAGE_DEFAULT = 20
+DETAIL_PAGE_MAX = 100
+DETAIL_APPOINTMENT_COLUMNS = "id, title, description, start_time, end_time, status, resource"
+# sort -> (expresion, desempate, direccion) del keyset, en el orden de su indice.
+LIST_SORTS = {
+    "updated": ("c.updated_at", "c.id", "DESC"),
+    "next_appointment": ("ca.next_appointment_at", "ca.client_id", "ASC"),
+    "last_appointment": ("ca.last_appointment_at", "ca.client_id", "DESC"),
+}
+LIST_SORT_FIELDS = {"updated": "updated_at", "next_appointment": "next_appointment_at", "last_appointment": "last_appointment_at"}
+SEARCH_MAX_QUERY_LENGTH = 100
+SEARCH_STATEMENT_TIMEOUT_MS = 2000
+# Umbral de `<%` (word_similarity); el 0.6 por defecto de pg_trgm descarta errores de tipeo comunes.
+SEARCH_SIMILARITY_THRESHOLD = 0.4
+_TRGM_AVAILABLE: Optional[bool] = None
+TYPEAHEAD_COLUMNS = "id, full_name, id_number, phone"
+TYPEAHEAD_DEFAULT_LIMIT = 8
+TYPEAHEAD_MAX_LIMIT = 25
+TYPEAHEAD_CACHE_SIZE = 256
+# Prefijos recientes por workspace; la clave incluye la version de `clients`, asi que una escritura invalida sola.
+_TYPEAHEAD_CACHES: Dict[str, LRUCache] = {}
+_TYPEAHEAD_CACHES_LOCK = threading.Lock()
+_TYPEAHEAD_FLIGHTS = SingleFlight()
+PHONE_LOOKUP_COLUMNS = "id, full_name, id_type, id_number, phone, phone_e164, email, blacklisted, updated_at"
+# Telefonos sin cliente (cada mensaje entrante de WhatsApp consulta el suyo); se limpia al crear/editar.
+_PHONE_MISSES = LRUCache(maxsize=4096, ttl=60)
+_PHONE_BACKFILLED: set = set()
+_PHONE_BACKFILL_LOCK = threading.Lock()
+
 
 class DuplicateClientError(ValueError):
     def __init__(self, existing_client_id: int):
@@ -55,6 +109,7 @@ def _ensure_clients_tables(conn) -> None:
     conn.execute("ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS id_type TEXT")
     conn.execute("ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS id_number TEXT")
     conn.execute("ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS blacklisted BOOLEAN DEFAULT FALSE")
+    conn.execute("ALTER TABLE IF EXISTS clients ADD COLUMN IF NOT EXISTS phone_e164 TEXT")
     conn.execute(
         """
         DO $$
@@ -94,6 +149,125 @@ def _find_existing_client_id(conn, id_type: str, id_number: str, exclude_client_
     return row["id"] if row else None
 
 
+def _has_identification_index(conn) -> bool:
+    row = conn.execute(
+        "SELECT 1 FROM pg_index WHERE indexrelid = to_regclass('clients_identification_key') AND indisvalid"
+    ).fetchone()
+    return bool(row)
+
+
+def identification_duplicates(limit: int = 200) -> Dict[str, Any]:
+    """
+    Reporte de migracion: grupos de clientes con la misma identificacion (tipo + documento sin
+    mayusculas) que impiden crear el indice unico `clients_identification_key`.
+    """
+    limit_value = max(1, min(int(limit or 200), 1000))
+    with get_db() as conn:
+        _ensure_clients_tables(conn)
+        rows = conn.execute(
+            """
+            SELECT id_type, lower(id_number) AS id_number, count(*) AS total,
+                   array_agg(id ORDER BY updated_at DESC NULLS LAST, id) AS client_ids
+            FROM clients
+            GROUP BY id_type, lower(id_number)
+            HAVING count(*) > 1
+            ORDER BY count(*) DESC, id_type, lower(id_number)
+            LIMIT %s
+            """,
+            (limit_value,),
+        ).fetchall()
+        indexed = _has_identification_index(conn)
+    return {
+        "unique_index": indexed,
+        "duplicates": [
+            {"id_type": r["id_type"], "id_number": r["id_number"], "total": r["total"], "client_ids": r["client_ids"]}
+            for r in rows
+        ],
+    }
+
+
+def ensure_identification_index() -> Dict[str, Any]:
+    """Crea el indice unico tras limpiar duplicados; si aun hay, devuelve el reporte sin crearlo."""
+    with get_db() as conn:
+        _ensure_clients_tables(conn)
+        try:
+            with conn.transaction():
+                conn.execute(
+                    "CREATE UNIQUE INDEX IF NOT EXISTS clients_identification_key ON clients (id_type, lower(id_number))"
+                )
+        except errors.UniqueViolation:
+            pass
+        else:
+            logger.info("Indice unico de identificacion de clientes listo")
+            return {"unique_index": True, "duplicates": []}
+    return identification_duplicates()
+
+
+def _phone_e164(phone: Optional[str]) -> Optional[str]:
+    return normalize_phone_e164(phone, config.DEFAULT_PHONE_COUNTRY_CODE)
+
+
+def _forget_phone_miss(phone_e164: Optional[str]) -> None:
+    if phone_e164:
+        _PHONE_MISSES.pop((_resolve_schema(), phone_e164))
+
+
+def _backfill_phone_e164(conn, schema: str) -> None:
+    """Completa `phone_e164` de clientes anteriores a la columna (una vez por proceso y schema)."""
+    if schema in _PHONE_BACKFILLED:
+        return
+    with _PHONE_BACKFILL_LOCK:
+        if schema in _PHONE_BACKFILLED:
+            return
+        rows = conn.execute(
+            "SELECT id, phone FROM clients WHERE phone IS NOT NULL AND phone_e164 IS NULL"
+        ).fetchall()
+        updates = []
+        for r in rows:
+            phone_e164 = _phone_e164(r["phone"])
+            if phone_e164:
+                updates.append((phone_e164, r["id"]))
+        if updates:
+            with conn.cursor() as cur:
+                cur.executemany("UPDATE clients SET phone_e164 = %s WHERE id = %s AND phone_e164 IS NULL", updates)
+            logger.info("phone_e164 completado para %s clientes schema=%s", len(updates), schema)
+        _PHONE_BACKFILLED.add(schema)
+
+
+def find_client_by_phone(number: str) -> Dict[str, Any]:
+    """
+    Cliente por telefono (p. ej. remitente de WhatsApp). El numero se normaliza a E.164 y se busca por
+    igualdad sobre `clients_phone_e164_idx`; los numeros sin cliente quedan en una cache negativa corta.
+    Si varios clientes comparten el telefono se devuelve el editado mas recientemente.
+    """
+    phone_e164 = _phone_e164(number)
+    if not phone_e164:
+        raise ValueError("telefono_invalido")
+    schema = _resolve_schema()
+    miss_key = (schema, phone_e164)
+    if _PHONE_MISSES.get(miss_key):
+        raise LookupError("not_found")
+    # Camino caliente (cada mensaje entrante): sin DDL; phone_e164 y su indice vienen de ensure_workspace_schema.
+    with get_db() as conn:
+        _backfill_phone_e164(conn, schema)
+        rows = conn.execute(
+            f"""
+            SELECT {PHONE_LOOKUP_COLUMNS}
+            FROM clients
+            WHERE phone_e164 = %s
+            ORDER BY updated_at DESC NULLS LAST, id DESC
+            LIMIT 5
+            """,
+            (phone_e164,),
+        ).fetchall()
+    if not rows:
+        _PHONE_MISSES.set(miss_key, True)
+        raise LookupError("not_found")
+    client = dict(rows[0])
+    client["other_client_ids"] = [r["id"] for r in rows[1:]]
+    return client
+
+
 def _parse_blacklisted(raw: Any) -> bool:
     if raw is None:
         return False
@@ -103,16 +277,130 @@ def _parse_blacklisted(raw: Any) -> bool:
     return value in ("1", "true", "yes", "on", "si")
 
 
-def list_clients(query: Optional[str] = None, limit: int = 200) -> List[Dict[str, Any]]:
+def _like_escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def _trgm_available(conn) -> bool:
+    global _TRGM_AVAILABLE
+    if _TRGM_AVAILABLE is None:
+        _TRGM_AVAILABLE = bool(conn.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'").fetchone())
+    return _TRGM_AVAILABLE
+
+
+def search_clients(conn, query: str, limit: int, columns: str = CLIENT_COLUMNS) -> List[Dict[str, Any]]:
+    """
+    Busqueda sobre `search_text` (nombre, documento, telefono y email sin acentos ni mayusculas).
+    Con pg_trgm y 3+ caracteres usa el indice GIN de trigramas (`LIKE` + `<%`) y ordena por prefijo y
+    `word_similarity`; terminos cortos solo buscan por inicio de palabra. Cada consulta tiene un
+    `statement_timeout` para acotar el trabajo.
+    """
+    conn.execute(f"SET LOCAL statement_timeout = {SEARCH_STATEMENT_TIMEOUT_MS}")
+    term = conn.execute(
+        f"SELECT lower({config.CORE_SCHEMA}.immutable_unaccent(%s)) AS term", (query[:SEARCH_MAX_QUERY_LENGTH],)
+    ).fetchone()["term"].strip()
+    if not term:
+        return []
+    like = _like_escape(term)
+    try:
+        if len(term) >= 3 and _trgm_available(conn):
+            conn.execute(f"SET LOCAL pg_trgm.word_similarity_threshold = {SEARCH_SIMILARITY_THRESHOLD}")
+            rows = conn.execute(
+                f"""
+                SELECT {columns}
+                FROM clients
+                WHERE search_text LIKE %s OR %s OPERATOR(public.<%%) search_text
+                ORDER BY search_text LIKE %s DESC, public.word_similarity(%s, search_text) DESC, updated_at DESC
+                LIMIT %s
+                """,
+                (f"%{like}%", term, f"{like}%", term, limit),
+            ).fetchall()
+        else:
+            rows = conn.execute(
+                f"""
+                SELECT {columns}
+                FROM clients
+                WHERE search_text LIKE %s OR search_text LIKE %s
+                ORDER BY search_text LIKE %s DESC, updated_at DESC
+                LIMIT %s
+                """,
+                (f"{like}%", f"% {like}%", f"{like}%", limit),
+            ).fetchall()
+    except errors.QueryCanceled:
+        raise ValueError("busqueda_demasiado_amplia: agrega mas caracteres")
+    return [dict(r) for r in rows]
+
+
+def _typeahead_cache(schema: str) -> LRUCache:
+    cache = _TYPEAHEAD_CACHES.get(schema)
+    if cache is None:
+        with _TYPEAHEAD_CACHES_LOCK:
+            cache = _TYPEAHEAD_CACHES.setdefault(schema, LRUCache(maxsize=TYPEAHEAD_CACHE_SIZE, ttl=300))
+    return cache
+
+
+def _typeahead_term(query: str) -> str:
+    value = unicodedata.normalize("NFD", query).encode("ascii", "ignore").decode("ascii")
+    return " ".join(value.lower().split())[:SEARCH_MAX_QUERY_LENGTH]
+
+
+def typeahead_clients(query: Optional[str], limit: Any = None) -> List[Dict[str, Any]]:
+    """
+    Sugerencias para busqueda mientras se escribe: solo id, nombre, documento y telefono.
+    Consultas identicas en vuelo se resuelven con una sola consulta (single-flight) y los prefijos
+    recientes se sirven desde una LRU por workspace mientras `clients` no cambie.
+    """
+    term = _typeahead_term(query or "")
+    if not term:
+        return []
+    try:
+        limit_value = max(1, min(int(limit or TYPEAHEAD_DEFAULT_LIMIT), TYPEAHEAD_MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError("limit_invalido")
+    schema = _resolve_schema()
+    versions = collection_versions(["clients"])
+    version = versions["clients"][0] if versions else None
+
+    def _load() -> List[Dict[str, Any]]:
+        with get_db(schema=schema) as conn:
+            try:
+                with conn.transaction():
+                    return search_clients(conn, term, limit_value, columns=TYPEAHEAD_COLUMNS)
+            except errors.UndefinedColumn:
+                pass
+        return [
+            {key: row[key] for key in ("id", "full_name", "id_number", "phone")}
+            for row in list_clients(term, limit_value)
+        ]
+
+    if version is None:
+        return _TYPEAHEAD_FLIGHTS.do((schema, term, limit_value), _load)
+    cache = _typeahead_cache(schema)
+    key = (version, term, limit_value)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+    items = _TYPEAHEAD_FLIGHTS.do((schema,) + key, _load)
+    cache.set(key, items)
+    return items
+
+
+def list_clients(query: Optional[str] = None, limit: int = 200, columns: str = CLIENT_COLUMNS) -> List[Dict[str, Any]]:
     q = (query or "").strip()
-    limit = max(1, min(int(limit or 200), 500))
+    limit = max(1, min(int(limit or LIST_DEFAULT_LIMIT), LIST_MAX_LIMIT))
     with get_db() as conn:
         _ensure_clients_tables(conn)
         if q:
+            try:
+                with conn.transaction():
+                    return search_clients(conn, q, limit, columns=columns)
+            except errors.UndefinedColumn:
+                # Schema sin `search_text` (aun no provisionado): busqueda sin indice.
+                pass
             like = f"%{q.lower()}%"
             rows = conn.execute(
-                """
-                SELECT id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at
+                f"""
+                SELECT {columns}
                 FROM clients
                 WHERE lower(full_name) LIKE %s
                    OR lower(coalesce(phone, '')) LIKE %s
@@ -125,8 +413,8 @@ def list_clients(query: Optional[str] = None, limit: int = 200) -> List[Dict[str
             ).fetchall()
         else:
             rows = conn.execute(
-                """
-                SELECT id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at
+                f"""
+                SELECT {columns}
                 FROM clients
                 ORDER BY updated_at DESC, created_at DESC
                 LIMIT %s
@@ -136,12 +424,266 @@ def list_clients(query: Optional[str] = None, limit: int = 200) -> List[Dict[str
     return [dict(r) for r in rows]
 
 
+def _parse_fields(raw: Optional[str]) -> List[str]:
+    """`fields=full_name,phone` -> columnas pedidas (siempre incluye `id`); vacio = todas."""
+    if not raw:
+        return list(CLIENT_FIELDS + ACTIVITY_FIELDS)
+    requested = [f.strip() for f in str(raw).split(",") if f.strip()]
+    unknown = [f for f in requested if f not in CLIENT_FIELDS and f not in ACTIVITY_FIELDS]
+    if unknown:
+        raise ValueError(f"fields_invalido: {', '.join(unknown)}")
+    return ["id"] + [f for f in dict.fromkeys(requested) if f != "id"]
+
+
+def _select_sql(fields: List[str]) -> str:
+    return ", ".join(
+        (f"{ACTIVITY_SQL[f]} AS {f}" if f in ACTIVITY_SQL else f"c.{f}") for f in dict.fromkeys(fields)
+    )
+
+
+def _encode_list_cursor(sort: str, value: Optional[datetime], client_id: int) -> str:
+    raw = json.dumps({"s": sort, "v": value.isoformat() if value else None, "i": client_id}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_list_cursor(cursor: str, sort: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        data = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        if data["s"] != sort:
+            raise ValueError(data["s"])
+        return (parse_datetime(data["v"]) if data["v"] else None), int(data["i"])
+    except Exception:
+        raise ValueError("cursor_invalido")
+
+
+def _estimated_client_count(conn) -> Optional[int]:
+    """Total aproximado segun las estadisticas del planner (`pg_class.reltuples`), sin `COUNT(*)`."""
+    row = conn.execute("SELECT reltuples::bigint AS estimate FROM pg_class WHERE oid = 'clients'::regclass").fetchone()
+    if not row or row["estimate"] is None or row["estimate"] < 0:
+        # Tabla nunca analizada (reltuples = -1): sin estimacion.
+        return None
+    return int(row["estimate"])
+
+
+def refresh_stale_activity(schema: Optional[str] = None) -> int:
+    """
+    `next_appointment_at` envejece sin escrituras (la cita pasa a ser la ultima): se recalculan las filas
+    cuya proxima cita ya empezo, encontradas por `client_activity_next_idx`, en lotes de
+    ACTIVITY_REFRESH_BATCH (una transaccion por lote). Tarea periodica, no en el camino de lectura; cada
+    lote sube la version de `client_activity`, asi que el ETag del listado cambia solo.
+    """
+    refreshed = 0
+    while True:
+        with get_db(schema=schema) as conn:
+            ids = [
+                r["client_id"]
+                for r in conn.execute(
+                    "SELECT client_id FROM client_activity WHERE next_appointment_at <= NOW() LIMIT %s",
+                    (ACTIVITY_REFRESH_BATCH,),
+                ).fetchall()
+            ]
+            if ids:
+                conn.execute(
+                    f"SELECT {config.CORE_SCHEMA}.refresh_client_activity(%s, %s)", (schema or _resolve_schema(), ids)
+                )
+        refreshed += len(ids)
+        if len(ids) < ACTIVITY_REFRESH_BATCH:
+            return refreshed
+
+
+def _attach_activity(conn, rows: List[Dict[str, Any]], fields: List[str]) -> List[Dict[str, Any]]:
+    wanted = [f for f in fields if f in ACTIVITY_FIELDS]
+    if not wanted or not rows:
+        return rows
+    activity = {
+        r["client_id"]: r
+        for r in conn.execute(
+            f"SELECT ca.client_id, {_select_sql(wanted)} FROM client_activity ca WHERE ca.client_id = ANY(%s)",
+            ([r["id"] for r in rows],),
+        ).fetchall()
+    }
+    for row in rows:
+        found = activity.get(row["id"])
+        for field in wanted:
+            row[field] = found[field] if found else (0 if field.endswith("_count") else None)
+    return rows
+
+
+def _keyset_rows(conn, sort: str, columns: str, after: Optional[tuple], limit: int) -> List[Dict[str, Any]]:
+    """
+    Una pagina en orden `sort`. Para los ordenes por actividad primero se recorren los clientes con valor
+    (indice parcial de client_activity) y luego los que no tienen cita, por id; el cursor indica la fase.
+    """
+    sort_sql, tiebreak_sql, direction = LIST_SORTS[sort]
+    op = "<" if direction == "DESC" else ">"
+    rows: List[Dict[str, Any]] = []
+    if after is None or after[0] is not None:
+        where = f"WHERE {sort_sql} IS NOT NULL"
+        params: List[Any] = []
+        if after:
+            where += f" AND ({sort_sql}, {tiebreak_sql}) {op} (%s, %s)"
+            params.extend(after)
+        rows = conn.execute(
+            f"""
+            SELECT {columns}
+            FROM clients c
+            LEFT JOIN client_activity ca ON ca.client_id = c.id
+            {where}
+            ORDER BY {sort_sql} {direction}, {tiebreak_sql} {direction}
+            LIMIT %s
+            """,
+            (*params, limit),
+        ).fetchall()
+    if sort == "updated" or len(rows) >= limit:
+        return rows
+    where = f"WHERE {sort_sql} IS NULL"
+    params = []
+    if after and after[0] is None:
+        where += f" AND c.id {op} %s"
+        params.append(after[1])
+    rows.extend(
+        conn.execute(
+            f"""
+            SELECT {columns}
+            FROM clients c
+            LEFT JOIN client_activity ca ON ca.client_id = c.id
+            {where}
+            ORDER BY c.id {direction}
+            LIMIT %s
+            """,
+            (*params, limit - len(rows)),
+        ).fetchall()
+    )
+    return rows
+
+
+def list_clients_page(
+    query: Optional[str] = None,
+    limit: Any = None,
+    cursor: Optional[str] = None,
+    fields: Optional[str] = None,
+    sort: Optional[str] = None,
+) -> Dict[str, Any]:
+    """
+    Listado paginado por keyset (sin OFFSET): `sort=updated` (por defecto) recorre `(updated_at, id)`
+    sobre `clients_updated_id_idx`; `next_appointment` / `last_appointment` recorren los indices de
+    `client_activity`. `next_cursor` apunta a la ultima fila devuelta. `fields` limita las columnas (las
+    de actividad salen de `client_activity`, mantenida por triggers). `total_estimate` sale de las
+    estadisticas del planner. Las busquedas (`q`) se ordenan por relevancia y no se paginan.
+    """
+    selected = _parse_fields(fields)
+    sort_value = (sort or "updated").strip().lower()
+    if sort_value not in LIST_SORTS:
+        raise ValueError(f"sort_invalido: {list(LIST_SORTS)}")
+    try:
+        limit_value = max(1, min(int(limit) if limit not in (None, "") else LIST_DEFAULT_LIMIT, LIST_MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError("limit_invalido")
+    uses_activity = sort_value != "updated" or any(f in ACTIVITY_FIELDS for f in selected)
+    q = (query or "").strip()
+    if q:
+        if cursor:
+            raise ValueError("cursor_invalido: las busquedas no se paginan")
+        rows = list_clients(q, limit_value, columns=", ".join(f for f in selected if f in CLIENT_FIELDS))
+        if uses_activity:
+            with get_db() as conn:
+                rows = _attach_activity(conn, rows, selected)
+        return {"clients": rows, "next_cursor": None, "total_estimate": None}
+
+    after = _decode_list_cursor(cursor, sort_value) if cursor else None
+    # La columna de orden se lee siempre para armar el cursor; se quita si no fue pedida.
+    sort_field = LIST_SORT_FIELDS[sort_value]
+    columns = _select_sql(selected + [sort_field])
+    with get_db() as conn:
+        _ensure_clients_tables(conn)
+        rows = _keyset_rows(conn, sort_value, columns, after, limit_value + 1)
+        total_estimate = _estimated_client_count(conn)
+    page = [dict(r) for r in rows[:limit_value]]
+    next_cursor = None
+    if len(rows) > limit_value:
+        next_cursor = _encode_list_cursor(sort_value, page[-1][sort_field], page[-1]["id"])
+    if sort_field not in selected:
+        for row in page:
+            row.pop(sort_field, None)
+    return {
+        "clients": page,
+        "next_cursor": next_cursor,
+        "total_estimate": total_estimate,
+    }
+
+
+def _detail_limit(limit: Any) -> int:
+    try:
+        value = int(limit) if limit not in (None, "") else DETAIL_PAGE_DEFAULT
+    except (TypeError, ValueError):
+        raise ValueError("limit_invalido")
+    return max(1, min(value, DETAIL_PAGE_MAX))
+
+
+def _notes_page(conn, client_id: int, after: Optional[tuple], limit: int) -> tuple:
+    """Notas mas recientes primero, por keyset `(created_at, id)` sobre `client_notes_client_created_idx`."""
+    where = "client_id = %s"
+    params: List[Any] = [client_id]
+    if after:
+        where += " AND (created_at, id) < (%s, %s)"
+        params.extend(after)
+    rows = conn.execute(
+        f"""
+        SELECT id, client_id, body, created_at
+        FROM client_notes
+        WHERE {where}
+        ORDER BY created_at DESC, id DESC
+        LIMIT %s
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+    page = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_list_cursor("notes", page[-1]["created_at"], page[-1]["id"])
+    return page, next_cursor
+
+
+def _appointments_page(conn, client_id: int, after: Optional[tuple], limit: int) -> tuple:
+    """Citas del cliente por `start_time` descendente (indice `appointments_client_start_idx` recorrido al reves)."""
+    where = "client_id = %s"
+    params: List[Any] = [client_id]
+    if after:
+        where += " AND (start_time, id) < (%s, %s)"
+        params.extend(after)
+    rows = conn.execute(
+        f"""
+        SELECT {DETAIL_APPOINTMENT_COLUMNS}
+        FROM appointments
+        WHERE {where}
+        ORDER BY start_time DESC, id DESC
+        LIMIT %s
+        """,
+        (*params, limit + 1),
+    ).fetchall()
+    page = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        next_cursor = _encode_list_cursor("appointments", page[-1]["start_time"], page[-1]["id"])
+    return page, next_cursor
+
+
+def _require_client(conn, client_id: int) -> None:
+    if not conn.execute("SELECT 1 FROM clients WHERE id=%s", (client_id,)).fetchone():
+        raise LookupError("not_found")
+
+
 def get_client(client_id: int) -> Dict[str, Any]:
+    """
+    Cliente con la primera pagina de notas y de citas (DETAIL_PAGE_DEFAULT de cada una); el resto se
+    pide con `notes_next_cursor` / `appointments_next_cursor` a list_client_notes / list_client_appointments.
+    """
     with get_db() as conn:
         _ensure_clients_tables(conn)
         row = conn.execute(
-            """
-            SELECT id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at
+            f"""
+            SELECT {CLIENT_COLUMNS}
             FROM clients
             WHERE id=%s
             """,
@@ -150,39 +692,43 @@ def get_client(client_id: int) -> Dict[str, Any]:
         if not row:
             raise LookupError("not_found")
 
-        notes_rows = conn.execute(
-            """
-            SELECT id, client_id, body, created_at
-            FROM client_notes
-            WHERE client_id=%s
-            ORDER BY created_at DESC
-            LIMIT 200
-            """,
-            (client_id,),
-        ).fetchall()
-
-        appointments = []
+        notes, notes_next_cursor = _notes_page(conn, client_id, None, DETAIL_PAGE_DEFAULT)
+        appointments, appointments_next_cursor = [], None
         try:
-            appointments = conn.execute(
-                """
-                SELECT id, title, description, start_time, end_time, status, timezone, client_id, created_at, updated_at
-                FROM appointments
-                WHERE client_id=%s
-                ORDER BY start_time DESC
-                LIMIT 200
-                """,
-                (client_id,),
-            ).fetchall()
+            with conn.transaction():
+                appointments, appointments_next_cursor = _appointments_page(conn, client_id, None, DETAIL_PAGE_DEFAULT)
         except errors.UndefinedColumn:
-            appointments = []
+            pass
 
     return {
         "client": dict(row),
-        "notes": [dict(r) for r in notes_rows],
-        "appointments": [dict(r) for r in appointments],
+        "notes": notes,
+        "notes_next_cursor": notes_next_cursor,
+        "appointments": appointments,
+        "appointments_next_cursor": appointments_next_cursor,
     }
 
 
+def list_client_notes(client_id: int, cursor: Optional[str] = None, limit: Any = None) -> Dict[str, Any]:
+    limit_value = _detail_limit(limit)
+    after = _decode_list_cursor(cursor, "notes") if cursor else None
+    with get_db() as conn:
+        _ensure_clients_tables(conn)
+        _require_client(conn, client_id)
+        notes, next_cursor = _notes_page(conn, client_id, after, limit_value)
+    return {"notes": notes, "next_cursor": next_cursor}
+
+
+def list_client_appointments(client_id: int, cursor: Optional[str] = None, limit: Any = None) -> Dict[str, Any]:
+    limit_value = _detail_limit(limit)
+    after = _decode_list_cursor(cursor, "appointments") if cursor else None
+    with get_db() as conn:
+        _ensure_clients_tables(conn)
+        _require_client(conn, client_id)
+        appointments, next_cursor = _appointments_page(conn, client_id, after, limit_value)
+    return {"appointments": appointments, "next_cursor": next_cursor}
+
+
 def create_client(payload: Dict[str, Any]) -> Dict[str, Any]:
     full_name = (payload.get("full_name") or "").strip()
     if not full_name:
@@ -194,19 +740,38 @@ def create_client(payload: Dict[str, Any]) -> Dict[str, Any]:
     address = (payload.get("address") or "").strip() or None
     notes = (payload.get("notes") or "").strip() or None
     blacklisted = _parse_blacklisted(payload.get("blacklisted"))
+    phone_e164 = _phone_e164(phone)
+    values = (full_name, id_type, id_number, phone, phone_e164, email, address, notes, blacklisted)
     with get_db() as conn:
         _ensure_clients_tables(conn)
-        existing_id = _find_existing_client_id(conn, id_type, id_number)
-        if existing_id:
-            raise DuplicateClientError(existing_id)
-        row = conn.execute(
-            """
-            INSERT INTO clients (full_name, id_type, id_number, phone, email, address, notes, blacklisted)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            RETURNING id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at
-            """,
-            (full_name, id_type, id_number, phone, email, address, notes, blacklisted),
-        ).fetchone()
+        try:
+            # Una sola sentencia: el indice unico resuelve carreras entre altas concurrentes (bots).
+            with conn.transaction():
+                row = conn.execute(
+                    f"""
+                    INSERT INTO clients (full_name, id_type, id_number, phone, phone_e164, email, address, notes, blacklisted)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (id_type, lower(id_number)) DO NOTHING
+                    RETURNING {CLIENT_COLUMNS}
+                    """,
+                    values,
+                ).fetchone()
+        except errors.InvalidColumnReference:
+            # Indice unico pendiente (duplicados previos): verificacion previa como antes.
+            existing_id = _find_existing_client_id(conn, id_type, id_number)
+            if existing_id:
+                raise DuplicateClientError(existing_id)
+            row = conn.execute(
+                f"""
+                INSERT INTO clients (full_name, id_type, id_number, phone, phone_e164, email, address, notes, blacklisted)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING {CLIENT_COLUMNS}
+                """,
+                values,
+            ).fetchone()
+        if not row:
+            raise DuplicateClientError(_find_existing_client_id(conn, id_type, id_number))
+    _forget_phone_miss(phone_e164)
     return dict(row)
 
 
@@ -237,7 +802,7 @@ def update_client(client_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
         if not effective_id_number or not str(effective_id_number).strip():
             raise ValueError("id_number_requerido")
 
-        if "id_type" in payload or "id_number" in payload:
+        if ("id_type" in payload or "id_number" in payload) and not _has_identification_index(conn):
             existing_id = _find_existing_client_id(
                 conn,
                 str(effective_id_type),
@@ -260,6 +825,9 @@ def update_client(client_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
                 value = (payload.get(key) or "").strip() or None
             fields.append(f"{key}=%s")
             values.append(value)
+            if key == "phone":
+                fields.append("phone_e164=%s")
+                values.append(_phone_e164(value))
 
         if "id_type" in payload:
             fields.append("id_type=%s")
@@ -275,17 +843,26 @@ def update_client(client_id: int, payload: Dict[str, Any]) -> Dict[str, Any]:
             raise ValueError("sin_cambios")
 
         values.append(client_id)
-        row = conn.execute(
-            f"""
-            UPDATE clients
-            SET {', '.join(fields)}, updated_at=NOW()
-            WHERE id=%s
-            RETURNING id, full_name, id_type, id_number, phone, email, address, notes, blacklisted, created_at, updated_at
-            """,
-            tuple(values),
-        ).fetchone()
+        try:
+            with conn.transaction():
+                row = conn.execute(
+                    f"""
+                    UPDATE clients
+                    SET {', '.join(fields)}, updated_at=NOW()
+                    WHERE id=%s
+                    RETURNING {CLIENT_COLUMNS}
+                    """,
+                    tuple(values),
+                ).fetchone()
+        except errors.UniqueViolation:
+            existing_id = _find_existing_client_id(
+                conn, str(effective_id_type), str(effective_id_number), exclude_client_id=client_id
+            )
+            raise DuplicateClientError(existing_id)
         if not row:
             raise LookupError("not_found")
+    if "phone" in payload:
+        _forget_phone_miss(_phone_e164((payload.get("phone") or "").strip() or None))
     return dict(row)
 
 
@@ -334,6 +911,7 @@ def create_appointment_for_client(client_id: int, payload: Dict[str, Any]) -> Di
     status = (payload.get("status") or "").strip() or "programada"
     timezone = (payload.get("timezone") or "").strip() or None
     description = (payload.get("description") or "").strip() or None
+    resource = (payload.get("resource") or "").strip() or None
     start_dt = parse_datetime(start_raw)
     end_dt = parse_datetime(end_raw)
 
@@ -343,15 +921,18 @@ def create_appointment_for_client(client_id: int, payload: Dict[str, Any]) -> Di
         if not exists:
             raise LookupError("not_found")
 
+        check_series_overlap(conn, start_dt, end_dt, status, resource)
         try:
             row = conn.execute(
                 """
-                INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id)
-                VALUES (%s, %s, %s, %s, %s, %s, %s)
-                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, created_at, updated_at
+                INSERT INTO appointments (title, description, start_time, end_time, status, timezone, client_id, resource)
+                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+                RETURNING id, title, description, start_time, end_time, status, timezone, client_id, resource, created_at, updated_at
                 """,
-                (title, description, start_dt, end_dt, status, timezone, client_id),
+                (title, description, start_dt, end_dt, status, timezone, client_id, resource),
             ).fetchone()
+        except errors.ExclusionViolation:
+            raise overlap_conflict(conn, start_dt, end_dt, resource)
         except errors.UndefinedColumn:
             row = conn.execute(
                 """
@@ -365,3 +946,293 @@ def create_appointment_for_client(client_id: int, payload: Dict[str, Any]) -> Di
         conn.execute("UPDATE clients SET updated_at=NOW() WHERE id=%s", (client_id,))
 
     return dict(row)
+
+
+IMPORT_MAX_ROWS = 50000
+IMPORT_MODES = ("atomic", "best_effort")
+IMPORT_ON_CONFLICT = ("update", "skip")
+_IMPORT_COLUMNS = (
+    "row_index", "full_name", "id_type", "id_number", "phone", "phone_e164", "email", "address", "notes", "blacklisted",
+)
+
+
+def _import_text(item: Dict[str, Any], key: str) -> Optional[str]:
+    value = item.get(key)
+    return (str(value).strip() or None) if value is not None else None
+
+
+def _import_row(item: Any) -> tuple:
+    if not isinstance(item, dict):
+        raise ValueError("se esperaba un objeto")
+    full_name = _import_text(item, "full_name")
+    if not full_name:
+        raise ValueError("full_name_requerido")
+    phone = _import_text(item, "phone")
+    blacklisted = item.get("blacklisted")
+    return (
+        full_name,
+        _normalize_id_type(item.get("id_type")),
+        _normalize_id_number(item.get("id_number")),
+        phone,
+        _phone_e164(phone),
+        _import_text(item, "email"),
+        _import_text(item, "address"),
+        _import_text(item, "notes"),
+        None if blacklisted in (None, "") else _parse_blacklisted(blacklisted),
+    )
+
+
+def import_clients(records, mode: str = "best_effort", on_conflict: str = "update") -> Dict[str, Any]:
+    """
+    Importacion masiva de clientes. `records` es un iterable de (indice, objeto) (o (indice, excepcion)),
+    consumido en streaming: las filas validas van por COPY a una tabla temporal y se fusionan con un
+    solo INSERT ... ON CONFLICT sobre `clients_identification_key`.
+    - on_conflict=update: los existentes (misma identificacion) se actualizan con los campos no vacios del
+      archivo; `blacklisted` solo se toma para clientes nuevos.
+    - on_conflict=skip: los existentes no se tocan y se reportan en `duplicates`.
+    Filas repetidas dentro del archivo: gana la primera, las demas se reportan como error.
+    """
+    if mode not in IMPORT_MODES:
+        raise ValueError(f"mode_invalido: {list(IMPORT_MODES)}")
+    if on_conflict not in IMPORT_ON_CONFLICT:
+        raise ValueError(f"on_conflict_invalido: {list(IMPORT_ON_CONFLICT)}")
+    atomic = mode == "atomic"
+    row_errors: List[Dict[str, Any]] = []
+    received = 0
+    summary = {"created": 0, "updated": 0}
+
+    # Sin _ensure_clients_tables: el COPY consume el body del request en esta transaccion y un ALTER
+    # retendria ACCESS EXCLUSIVE sobre clients/appointments mientras dure la subida.
+    with get_db() as conn:
+        conn.execute(
+            """
+            CREATE TEMP TABLE client_import (
+                row_index INTEGER, full_name TEXT, id_type TEXT, id_number TEXT, phone TEXT, phone_e164 TEXT,
+                email TEXT, address TEXT, notes TEXT, blacklisted BOOLEAN
+            ) ON COMMIT DROP
+            """
+        )
+        with conn.cursor() as cur:
+            with cur.copy(f"COPY client_import ({', '.join(_IMPORT_COLUMNS)}) FROM STDIN") as copy:
+                for index, item in records:
+                    received += 1
+                    if received > IMPORT_MAX_ROWS:
+                        raise ValueError(f"demasiadas_filas: maximo {IMPORT_MAX_ROWS}")
+                    try:
+                        if isinstance(item, Exception):
+                            raise ValueError(str(item))
+                        copy.write_row((index,) + _import_row(item))
+                    except ValueError as ex:
+                        row_errors.append({"index": index, "error": str(ex)})
+
+        repeated = conn.execute(
+            """
+            SELECT row_index, first_index
+            FROM (
+                SELECT row_index,
+                       first_value(row_index) OVER w AS first_index,
+                       row_number() OVER w AS position
+                FROM client_import
+                WINDOW w AS (PARTITION BY id_type, lower(id_number) ORDER BY row_index)
+            ) ranked
+            WHERE position > 1
+            """
+        ).fetchall()
+        if repeated:
+            row_errors.extend(
+                {"index": r["row_index"], "error": f"duplicado_en_archivo: fila {r['first_index']}"} for r in repeated
+            )
+            conn.execute("DELETE FROM client_import WHERE row_index = ANY(%s)", ([r["row_index"] for r in repeated],))
+
+        if atomic and row_errors:
+            conn.rollback()
+            return _import_result(mode, on_conflict, received, summary, [], row_errors)
+
+        staged = conn.execute("SELECT count(*) AS total FROM client_import").fetchone()["total"]
+        # Coincidencias con clientes existentes (por el indice unico), antes de fusionar.
+        existing = conn.execute(
+            """
+            SELECT i.row_index AS index, c.id AS existing_client_id
+            FROM client_import i
+            JOIN clients c ON c.id_type = i.id_type AND lower(c.id_number) = lower(i.id_number)
+            ORDER BY i.row_index
+            """
+        ).fetchall()
+        if on_conflict == "update":
+            conflict_sql = """
+                DO UPDATE SET
+                    full_name = EXCLUDED.full_name,
+                    phone = coalesce(EXCLUDED.phone, clients.phone),
+                    phone_e164 = CASE WHEN EXCLUDED.phone IS NULL THEN clients.phone_e164 ELSE EXCLUDED.phone_e164 END,
+                    email = coalesce(EXCLUDED.email, clients.email),
+                    address = coalesce(EXCLUDED.address, clients.address),
+                    notes = coalesce(EXCLUDED.notes, clients.notes),
+                    updated_at = NOW()
+                WHERE (clients.full_name, clients.phone, clients.email, clients.address, clients.notes)
+                      IS DISTINCT FROM (EXCLUDED.full_name, coalesce(EXCLUDED.phone, clients.phone),
+                                        coalesce(EXCLUDED.email, clients.email), coalesce(EXCLUDED.address, clients.address),
+                                        coalesce(EXCLUDED.notes, clients.notes))
+            """
+        else:
+            conflict_sql = "DO NOTHING"
+        try:
+            with conn.transaction():
+                merged = conn.execute(
+                    f"""
+                    WITH merged AS (
+                        INSERT INTO clients (full_name, id_type, id_number, phone, phone_e164, email, address, notes, blacklisted)
+                        SELECT full_name, id_type, id_number, phone, phone_e164, email, address, notes, coalesce(blacklisted, FALSE)
+                        FROM client_import
+                        ORDER BY row_index
+                        ON CONFLICT (id_type, lower(id_number)) {conflict_sql}
+                        RETURNING (xmax = 0) AS inserted
+                    )
+                    SELECT count(*) FILTER (WHERE inserted) AS created, count(*) FILTER (WHERE NOT inserted) AS updated
+                    FROM merged
+                    """
+                ).fetchone()
+        except errors.InvalidColumnReference:
+            # Sin indice unico (duplicados previos) no hay fusion por conjunto posible.
+            raise ValueError("indice_identificacion_pendiente: ver /api/clientes/duplicates/identification")
+        summary = {"created": merged["created"], "updated": merged["updated"]}
+        summary["unchanged"] = staged - merged["created"] - merged["updated"] if on_conflict == "update" else 0
+
+    _PHONE_MISSES.clear()
+    logger.info(
+        "Importacion de clientes mode=%s on_conflict=%s recibidas=%s creadas=%s actualizadas=%s errores=%s",
+        mode, on_conflict, received, summary["created"], summary["updated"], len(row_errors),
+    )
+    return _import_result(mode, on_conflict, received, summary, [dict(r) for r in existing], row_errors)
+
+
+def _import_result(
+    mode: str,
+    on_conflict: str,
+    received: int,
+    summary: Dict[str, int],
+    existing: List[Dict[str, Any]],
+    row_errors: List[Dict[str, Any]],
+) -> Dict[str, Any]:
+    row_errors.sort(key=lambda e: e["index"])
+    return {
+        "mode": mode,
+        "on_conflict": on_conflict,
+        "received": received,
+        "created": summary.get("created", 0),
+        "updated": summary.get("updated", 0),
+        "unchanged": summary.get("unchanged", 0),
+        "duplicates": existing,
+        "failed": len(row_errors),
+        "errors": row_errors,
+    }
+
+
+EXPORT_FORMATS = ("csv", "ndjson")
+EXPORT_INCLUDES = ("notes", "appointments")
+EXPORT_CURSOR_ITERSIZE = 1000
+# Se acumulan filas hasta ~64 KB antes de emitir un chunk de la respuesta.
+EXPORT_FLUSH_BYTES = 64 * 1024
+_EXPORT_APPOINTMENT_COLUMNS = ("appointments_total", "appointments_upcoming", "last_appointment_at", "next_appointment_at")
+
+
+def export_options(fmt: Optional[str], include: Optional[str]) -> tuple:
+    """Valida `format` y `include` antes de empezar a emitir la respuesta."""
+    fmt_value = (fmt or "csv").strip().lower()
+    if fmt_value not in EXPORT_FORMATS:
+        raise ValueError(f"format_invalido: {list(EXPORT_FORMATS)}")
+    includes = tuple(dict.fromkeys(p.strip().lower() for p in (include or "").split(",") if p.strip()))
+    unknown = [p for p in includes if p not in EXPORT_INCLUDES]
+    if unknown:
+        raise ValueError(f"include_invalido: {', '.join(unknown)}")
+    return fmt_value, includes
+
+
+def _export_sql(includes: tuple) -> tuple:
+    columns = [f"c.{column}" for column in CLIENT_FIELDS]
+    joins = []
+    if "notes" in includes:
+        columns.append("n.notes AS client_notes")
+        joins.append(
+            """
+            LEFT JOIN LATERAL (
+                SELECT coalesce(
+                    json_agg(json_build_object('id', cn.id, 'body', cn.body, 'created_at', cn.created_at) ORDER BY cn.created_at DESC, cn.id DESC),
+                    '[]'::json
+                ) AS notes
+                FROM client_notes cn
+                WHERE cn.client_id = c.id
+            ) n ON TRUE
+            """
+        )
+    if "appointments" in includes:
+        columns.extend(f"a.{column}" for column in _EXPORT_APPOINTMENT_COLUMNS)
+        joins.append(
+            """
+            LEFT JOIN LATERAL (
+                SELECT count(*) AS appointments_total,
+                       count(*) FILTER (WHERE ap.start_time > NOW()) AS appointments_upcoming,
+                       max(ap.start_time) FILTER (WHERE ap.start_time <= NOW()) AS last_appointment_at,
+                       min(ap.start_time) FILTER (WHERE ap.start_time > NOW()) AS next_appointment_at
+                FROM appointments ap
+                WHERE ap.client_id = c.id
+            ) a ON TRUE
+            """
+        )
+    sql = f"SELECT {', '.join(columns)} FROM clients c {' '.join(joins)} ORDER BY c.id"
+    header = [column.split(" AS ")[-1].split(".")[-1] for column in columns]
+    return sql, header
+
+
+def _export_value(value: Any) -> Any:
+    if isinstance(value, datetime):
+        return _iso_datetime(value)
+    return value
+
+
+def _csv_value(value: Any) -> Any:
+    if value is None:
+        return ""
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return _export_value(value)
+
+
+def iter_clients_export(fmt: str, includes: tuple = ()) -> Iterator[bytes]:
+    """
+    Exporta clientes (y opcionalmente sus notas y conteos de citas via LATERAL, que usan los indices por
+    `client_id`) en streaming: un cursor del lado del servidor entrega lotes de EXPORT_CURSOR_ITERSIZE
+    filas y la respuesta se emite en chunks, asi que la memoria no crece con el tamano de la clinica.
+    """
+    sql, header = _export_sql(includes)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if fmt == "csv" else None
+    if writer:
+        writer.writerow(header)
+
+    def _flush() -> bytes:
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    exported = 0
+    # Sin DDL aqui: el cursor vive lo que dure la descarga y un ALTER dejaria clients/appointments bloqueadas
+    # (ACCESS EXCLUSIVE) hasta el final. El schema ya lo provisiona ensure_workspace_schema.
+    with get_db() as conn:
+        with conn.cursor(name="clients_export") as cur:
+            cur.itersize = EXPORT_CURSOR_ITERSIZE
+            cur.execute(sql)
+            for row in cur:
+                if writer:
+                    writer.writerow([_csv_value(row[key]) for key in header])
+                else:
+                    buffer.write(json.dumps({key: _export_value(row[key]) for key in header}, ensure_ascii=False, default=str))
+                    buffer.write("\n")
+                exported += 1
+                if buffer.tell() >= EXPORT_FLUSH_BYTES:
+                    yield _flush()
+    if buffer.tell():
+        yield _flush()
+    logger.info("Exportacion de clientes format=%s include=%s filas=%s", fmt, ",".join(includes) or "-", exported)
@@ -0,0 +1,355 @@
+import logging
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+from psycopg import errors
+
+from ..config import config
+from ..db import _resolve_schema, get_db
+from .clientes import CLIENT_FIELDS, _trgm_available
+from .reminders import _workspace_schemas
+
+logger = logging.getLogger(__name__)
+
+# Par candidato si los nombres se parecen lo suficiente, o si comparten telefono/email/identificacion (o la
+# identificacion difiere en un solo digito de un extremo) y el nombre se parece algo.
+NAME_SIMILARITY_THRESHOLD = 0.6
+CONTACT_NAME_SIMILARITY_THRESHOLD = 0.3
+CONTACT_MATCH_BONUS = 0.25
+# Identificaciones mas cortas no generan clave de bloqueo (demasiadas colisiones).
+ID_BLOCK_MIN_LENGTH = 5
+# Bloques mas grandes (p. ej. un telefono compartido por toda una familia extendida) no se comparan.
+MAX_BLOCK_SIZE = 200
+SCAN_STATEMENT_TIMEOUT_MS = 120000
+REVIEW_STATUSES = ("pendiente", "descartado")
+REVIEW_MAX_LIMIT = 200
+_REVIEW_CLIENT_FIELDS = ("id", "full_name", "id_type", "id_number", "phone", "email")
+
+_scheduler_thread: Optional[threading.Thread] = None
+_scheduler_lock = threading.Lock()
+
+
+class DuplicateScanInProgress(Exception):
+    """Otro proceso ya esta escaneando duplicados en este workspace."""
+
+
+def _scan_sql() -> str:
+    core = config.CORE_SCHEMA
+    return f"""
+        WITH base AS (
+            SELECT id, lower({core}.immutable_unaccent(full_name)) AS name, phone_e164, lower(email) AS email,
+                   nullif(regexp_replace(lower(id_number), '[^a-z0-9]', '', 'g'), '') AS id_key
+            FROM clients
+        ),
+        name_tokens AS (
+            SELECT DISTINCT b.id, left(token, 3) AS token
+            FROM base b, regexp_split_to_table(b.name, '[^a-z0-9]+') AS token
+            WHERE length(token) >= 2
+        ),
+        keys AS (
+            -- Claves de bloqueo: pares de prefijos de palabras del nombre (en cualquier orden), telefono, email e
+            -- identificacion sin su ultimo / primer caracter (digito de verificacion o error de tipeo en un extremo;
+            -- sin id_type: una TI que pasa a CC conserva el numero)
+            SELECT t1.id, 'n:' || t1.token || '|' || t2.token AS block
+            FROM name_tokens t1 JOIN name_tokens t2 ON t2.id = t1.id AND t2.token > t1.token
+            UNION
+            SELECT id, 'p:' || phone_e164 FROM base WHERE phone_e164 IS NOT NULL
+            UNION
+            SELECT id, 'e:' || email FROM base WHERE email IS NOT NULL AND email <> ''
+            UNION
+            SELECT id, 'd:' || left(id_key, -1) FROM base WHERE length(id_key) >= %s
+            UNION
+            SELECT id, 'D:' || right(id_key, -1) FROM base WHERE length(id_key) >= %s
+        ),
+        blocks AS (
+            SELECT block FROM keys GROUP BY block HAVING count(*) BETWEEN 2 AND %s
+        ),
+        pairs AS (
+            SELECT DISTINCT k1.id AS a, k2.id AS b
+            FROM blocks
+            JOIN keys k1 USING (block)
+            JOIN keys k2 ON k2.block = k1.block AND k2.id > k1.id
+        ),
+        scored AS (
+            SELECT p.a, p.b,
+                   public.similarity(x.name, y.name) AS name_similarity,
+                   coalesce(x.phone_e164 = y.phone_e164, FALSE) AS same_phone,
+                   coalesce(x.email = y.email AND x.email <> '', FALSE) AS same_email,
+                   coalesce(
+                       length(x.id_key) = length(y.id_key)
+                       AND (left(x.id_key, -1) = left(y.id_key, -1) OR right(x.id_key, -1) = right(y.id_key, -1)),
+                       FALSE
+                   ) AS similar_id
+            FROM pairs p
+            JOIN base x ON x.id = p.a
+            JOIN base y ON y.id = p.b
+        ),
+        merged AS (
+            INSERT INTO client_duplicate_candidates (client_a, client_b, score, reasons, detected_at)
+            SELECT a, b,
+                   least(1.0, name_similarity
+                              + CASE WHEN same_phone THEN %s ELSE 0 END
+                              + CASE WHEN same_email THEN %s ELSE 0 END
+                              + CASE WHEN similar_id THEN %s ELSE 0 END),
+                   array_remove(ARRAY[
+                       CASE WHEN name_similarity >= %s THEN 'nombre' END,
+                       CASE WHEN same_phone THEN 'telefono' END,
+                       CASE WHEN same_email THEN 'email' END,
+                       CASE WHEN similar_id THEN 'identificacion' END
+                   ], NULL),
+                   NOW()
+            FROM scored
+            WHERE name_similarity >= %s OR ((same_phone OR same_email OR similar_id) AND name_similarity >= %s)
+            ON CONFLICT (client_a, client_b) DO UPDATE
+                SET score = EXCLUDED.score, reasons = EXCLUDED.reasons, detected_at = EXCLUDED.detected_at
+                WHERE client_duplicate_candidates.status = 'pendiente'
+            RETURNING (xmax = 0) AS inserted
+        )
+        SELECT count(*) AS detected, count(*) FILTER (WHERE inserted) AS new FROM merged
+    """
+
+
+def scan_duplicates(schema: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Detecta pares de clientes probablemente duplicados y los deja en `client_duplicate_candidates`
+    (cola de revision). En vez de comparar todos contra todos, solo se comparan clientes que comparten
+    una clave de bloqueo (par de prefijos de palabras del nombre, telefono E.164, email o identificacion
+    sin un caracter de un extremo); dentro de
+    cada bloque se puntua con `similarity` de pg_trgm. Todo es una sola sentencia. Los pares pendientes
+    que ya no califican se eliminan; los descartados se conservan para no volver a proponerlos.
+    """
+    schema = schema or _resolve_schema()
+    started = time.monotonic()
+    # Sin DDL: el escaneo puede durar hasta SCAN_STATEMENT_TIMEOUT_MS y un ALTER dejaria clients/appointments
+    # con ACCESS EXCLUSIVE todo ese tiempo. Las tablas las provisiona ensure_workspace_schema.
+    with get_db(schema=schema) as conn:
+        if not _trgm_available(conn):
+            raise ValueError("pg_trgm_requerido: instala la extension para detectar duplicados")
+        locked = conn.execute(
+            "SELECT pg_try_advisory_xact_lock(hashtext(%s)) AS locked", (f"client_duplicates:{schema}",)
+        ).fetchone()["locked"]
+        if not locked:
+            raise DuplicateScanInProgress(schema)
+        conn.execute(f"SET LOCAL statement_timeout = {SCAN_STATEMENT_TIMEOUT_MS}")
+        try:
+            stats = conn.execute(
+                _scan_sql(),
+                (
+                    ID_BLOCK_MIN_LENGTH,
+                    ID_BLOCK_MIN_LENGTH,
+                    MAX_BLOCK_SIZE,
+                    CONTACT_MATCH_BONUS,
+                    CONTACT_MATCH_BONUS,
+                    CONTACT_MATCH_BONUS,
+                    NAME_SIMILARITY_THRESHOLD,
+                    NAME_SIMILARITY_THRESHOLD,
+                    CONTACT_NAME_SIMILARITY_THRESHOLD,
+                ),
+            ).fetchone()
+        except errors.QueryCanceled:
+            raise ValueError("escaneo_demasiado_lento: revisa MAX_BLOCK_SIZE")
+        stale = conn.execute(
+            "DELETE FROM client_duplicate_candidates WHERE status = 'pendiente' AND detected_at < NOW()"
+        ).rowcount
+        pending = conn.execute(
+            "SELECT count(*) AS total FROM client_duplicate_candidates WHERE status = 'pendiente'"
+        ).fetchone()["total"]
+    result = {
+        "detected": stats["detected"],
+        "new": stats["new"],
+        "removed": stale,
+        "pending": pending,
+        "elapsed_ms": int((time.monotonic() - started) * 1000),
+    }
+    logger.info("Escaneo de duplicados schema=%s %s", schema, result)
+    return result
+
+
+def _schema_provisioned(schema: str) -> bool:
+    with get_db(schema=config.CORE_SCHEMA) as conn:
+        row = conn.execute(
+            "SELECT to_regclass(format('%%I.client_duplicate_candidates', %s::text)) IS NOT NULL AS ready", (schema,)
+        ).fetchone()
+    return bool(row and row["ready"])
+
+
+def scan_all_workspaces() -> Dict[str, Any]:
+    """
+    Una pasada sobre todos los workspaces; un error en uno no detiene los demas. Los schemas aun sin
+    provisionar (sin `client_duplicate_candidates`) se omiten: el escaneo no ejecuta DDL.
+    """
+    results: Dict[str, Any] = {}
+    for schema in _workspace_schemas():
+        try:
+            if not _schema_provisioned(schema):
+                results[schema] = {"skipped": "schema_no_provisionado"}
+                continue
+            results[schema] = scan_duplicates(schema)
+        except DuplicateScanInProgress:
+            results[schema] = {"skipped": "escaneo_en_curso"}
+        except Exception as ex:
+            logger.warning("No se pudo escanear duplicados schema=%s: %s", schema, ex)
+            results[schema] = {"error": str(ex)}
+    return results
+
+
+def _scheduler_loop(interval: int) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            scan_all_workspaces()
+        except Exception:
+            logger.exception("Error en el escaneo periodico de duplicados")
+
+
+def start_scheduler() -> None:
+    """Arranca (una vez por proceso) el hilo que escanea duplicados cada DUPLICATE_SCAN_INTERVAL_HOURS."""
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is not None:
+            return
+        interval = max(1, int(config.DUPLICATE_SCAN_INTERVAL_HOURS)) * 3600
+        _scheduler_thread = threading.Thread(
+            target=_scheduler_loop, args=(interval,), name="duplicate-scan", daemon=True
+        )
+        _scheduler_thread.start()
+    logger.info("Escaneo periodico de duplicados activo (cada %sh)", interval // 3600)
+
+
+def _review_client(row: Dict[str, Any], prefix: str) -> Dict[str, Any]:
+    client = {field: row[f"{prefix}_{field}"] for field in _REVIEW_CLIENT_FIELDS}
+    client["appointment_count"] = row[f"{prefix}_appointment_count"]
+    return client
+
+
+def list_candidates(status: Optional[str] = None, limit: Any = None) -> List[Dict[str, Any]]:
+    """Cola de revision: pares con ambos clientes (y sus citas, para elegir cual conservar), mayor puntaje primero."""
+    status_value = (status or "pendiente").strip().lower()
+    if status_value not in REVIEW_STATUSES:
+        raise ValueError(f"status_invalido: {list(REVIEW_STATUSES)}")
+    try:
+        limit_value = max(1, min(int(limit) if limit not in (None, "") else 50, REVIEW_MAX_LIMIT))
+    except (TypeError, ValueError):
+        raise ValueError("limit_invalido")
+    client_columns = ", ".join(
+        f"{alias}.{field} AS {alias}_{field}" for alias in ("a", "b") for field in _REVIEW_CLIENT_FIELDS
+    )
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT d.id, d.score, d.reasons, d.status, d.detected_at, d.reviewed_at, {client_columns},
+                   coalesce(aa.appointment_count, 0) AS a_appointment_count,
+                   coalesce(ab.appointment_count, 0) AS b_appointment_count
+            FROM client_duplicate_candidates d
+            JOIN clients a ON a.id = d.client_a
+            JOIN clients b ON b.id = d.client_b
+            LEFT JOIN client_activity aa ON aa.client_id = d.client_a
+            LEFT JOIN client_activity ab ON ab.client_id = d.client_b
+            WHERE d.status = %s
+            ORDER BY d.score DESC, d.id
+            LIMIT %s
+            """,
+            (status_value, limit_value),
+        ).fetchall()
+    return [
+        {
+            "id": r["id"],
+            "score": round(float(r["score"]), 3),
+            "reasons": list(r["reasons"] or []),
+            "status": r["status"],
+            "detected_at": r["detected_at"],
+            "reviewed_at": r["reviewed_at"],
+            "clients": [_review_client(r, "a"), _review_client(r, "b")],
+        }
+        for r in rows
+    ]
+
+
+def dismiss_candidate(candidate_id: int) -> Dict[str, Any]:
+    """Marca el par como no duplicado; los escaneos siguientes no lo vuelven a proponer."""
+    with get_db() as conn:
+        row = conn.execute(
+            """
+            UPDATE client_duplicate_candidates
+            SET status = 'descartado', reviewed_at = NOW()
+            WHERE id = %s
+            RETURNING id, client_a, client_b, status, reviewed_at
+            """,
+            (candidate_id,),
+        ).fetchone()
+    if not row:
+        raise LookupError("not_found")
+    return dict(row)
+
+
+def merge_clients(target_id: Any, source_id: Any) -> Dict[str, Any]:
+    """
+    Fusiona `source_id` en `target_id` en una sola transaccion: citas, series y notas pasan al cliente
+    conservado, sus datos vacios se completan con los del duplicado, queda una nota de auditoria y el
+    duplicado se elimina (con sus pares en la cola de revision).
+    """
+    try:
+        target, source = int(target_id), int(source_id)
+    except (TypeError, ValueError):
+        raise ValueError("target_id_y_source_id_requeridos")
+    if target == source:
+        raise ValueError("merge_invalido: target_id y source_id son el mismo cliente")
+
+    returning = ", ".join(f"t.{field}" for field in CLIENT_FIELDS)
+    with get_db() as conn:
+        # Bloqueo en orden de id para que dos fusiones cruzadas no se bloqueen mutuamente.
+        locked = conn.execute(
+            "SELECT id, full_name, id_type, id_number FROM clients WHERE id = ANY(%s) ORDER BY id FOR UPDATE",
+            ([target, source],),
+        ).fetchall()
+        if len(locked) < 2:
+            raise LookupError("not_found")
+        source_row = next(r for r in locked if r["id"] == source)
+
+        appointments_moved = conn.execute(
+            "UPDATE appointments SET client_id = %s WHERE client_id = %s", (target, source)
+        ).rowcount
+        series_moved = conn.execute(
+            "UPDATE appointment_series SET client_id = %s WHERE client_id = %s", (target, source)
+        ).rowcount
+        notes_moved = conn.execute(
+            "UPDATE client_notes SET client_id = %s WHERE client_id = %s", (target, source)
+        ).rowcount
+        client = conn.execute(
+            f"""
+            UPDATE clients t
+            SET phone = coalesce(t.phone, s.phone),
+                phone_e164 = CASE WHEN t.phone IS NULL THEN s.phone_e164 ELSE t.phone_e164 END,
+                email = coalesce(t.email, s.email),
+                address = coalesce(t.address, s.address),
+                notes = coalesce(t.notes, s.notes),
+                blacklisted = coalesce(t.blacklisted, FALSE) OR coalesce(s.blacklisted, FALSE),
+                updated_at = NOW()
+            FROM clients s
+            WHERE t.id = %s AND s.id = %s
+            RETURNING {returning}
+            """,
+            (target, source),
+        ).fetchone()
+        conn.execute(
+            "INSERT INTO client_notes (client_id, body) VALUES (%s, %s)",
+            (
+                target,
+                f"Fusionado con cliente #{source} ({source_row['full_name']}, "
+                f"{source_row['id_type']} {source_row['id_number']})",
+            ),
+        )
+        conn.execute("DELETE FROM clients WHERE id = %s", (source,))
+
+    logger.info(
+        "Clientes fusionados schema=%s conservado=%s eliminado=%s citas=%s series=%s notas=%s",
+        _resolve_schema(), target, source, appointments_moved, series_moved, notes_moved,
+    )
+    return {
+        "client": dict(client),
+        "merged_client_id": source,
+        "appointments_moved": appointments_moved,
+        "series_moved": series_moved,
+        "notes_moved": notes_moved,
+    }
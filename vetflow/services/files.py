@@ -1,6 +1,14 @@
+import hashlib
+import json
 import logging
+import queue
+import threading
 import uuid
-from typing import Any, Dict, List, Optional, Tuple
+import zipfile
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Iterator, List, Optional, Tuple
 
 import requests
 from flask import g
@@ -9,11 +17,36 @@ from werkzeug.utils import secure_filename
 from ..config import config
 from ..db import get_db
 from ..serializers import row_to_file
-from ..storage import generate_sas_url, upload_blob
-from ..utils import parse_datetime
+from ..storage import (
+    generate_sas_url,
+    get_blob_content_id,
+    iter_blob_chunks,
+    list_blob_content_ids,
+    upload_blob_with_content_id,
+)
+from ..utils import parse_datetime, sanitize_folder_path
 
 logger = logging.getLogger(__name__)
 REMOVED_STATUSES = ("expired", "expirada", "deleted", "eliminado", "eliminar")
+# Status que n8n reporta al terminar de indexar; promueven la huella pendiente a `ingest_fingerprint`.
+INGESTED_STATUSES = ("processed", "procesado", "done", "ready")
+FILE_COLUMNS = (
+    "id, filename, blob_path, blob_url, thumbnail_url, mime_type, size_bytes, tags, notes, status, "
+    "processed_at, created_at, updated_at"
+)
+SEARCH_DEFAULT_LIMIT = 25
+SEARCH_MAX_LIMIT = 100
+SEARCH_FACETS_LIMIT = 30
+# ZIP en streaming: blobs descargandose en paralelo y chunks en cola por blob.
+# Memoria maxima por request ~ ARCHIVE_READ_AHEAD * ARCHIVE_QUEUE_CHUNKS * STREAM_CHUNK_SIZE.
+ARCHIVE_READ_AHEAD = 4
+ARCHIVE_QUEUE_CHUNKS = 4
+_ARCHIVE_EOF = object()
+# Una ingesta enviada sin respuesta de n8n en este plazo deja de bloquear la re-ingesta del archivo.
+INGEST_PENDING_TTL = timedelta(hours=6)
+# Envios a n8n fuera del request: lotes de archivos repartidos en pocos hilos.
+INGEST_BATCH_SIZE = 25
+_INGEST_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ingest")
 
 
 def list_files(include_expired: bool = False):
@@ -29,6 +62,92 @@ def list_files(include_expired: bool = False):
     return [row_to_file(r) for r in rows]
 
 
+def search_files(
+    query: Optional[str] = None,
+    tags: Optional[List[str]] = None,
+    status: Optional[str] = None,
+    include_expired: bool = False,
+    limit: int = SEARCH_DEFAULT_LIMIT,
+    offset: int = 0,
+    include_facets: bool = True,
+) -> Dict[str, Any]:
+    """
+    Busqueda paginada en servidor sobre `files.search_tsv` (nombre + tags + notas, spanish + unaccent).
+    `tags` filtra por contencion exacta (`tags @> ...`, indice GIN) y `facets` devuelve conteos por tag
+    sobre el mismo filtro.
+    """
+    q = (query or "").strip()
+    limit = max(1, min(int(limit or SEARCH_DEFAULT_LIMIT), SEARCH_MAX_LIMIT))
+    offset = max(0, int(offset or 0))
+    tag_filter = [t.strip() for t in (tags or []) if t and t.strip()]
+
+    conditions: List[str] = []
+    params: List[Any] = []
+    if q:
+        conditions.append("search_tsv @@ websearch_to_tsquery('spanish', {}.immutable_unaccent(%s))".format(config.CORE_SCHEMA))
+        params.append(q)
+    if tag_filter:
+        conditions.append("tags @> %s::text[]")
+        params.append(tag_filter)
+    if status:
+        conditions.append("status = %s")
+        params.append(status)
+    elif not include_expired:
+        conditions.extend(["status IS DISTINCT FROM %s"] * len(REMOVED_STATUSES))
+        params.extend(REMOVED_STATUSES)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if q:
+        rank_expr = "ts_rank_cd(search_tsv, websearch_to_tsquery('spanish', {}.immutable_unaccent(%s)), 32)".format(
+            config.CORE_SCHEMA
+        )
+        rank_params: List[Any] = [q]
+        order_by = "rank DESC, created_at DESC, id DESC"
+    else:
+        rank_expr = "NULL::real"
+        rank_params = []
+        order_by = "created_at DESC, id DESC"
+
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT {FILE_COLUMNS}, {rank_expr} AS rank, count(*) OVER () AS total
+            FROM files
+            {where}
+            ORDER BY {order_by}
+            LIMIT %s OFFSET %s
+            """,
+            tuple(rank_params + params + [limit, offset]),
+        ).fetchall()
+        facets: List[Dict[str, Any]] = []
+        if include_facets:
+            facet_rows = conn.execute(
+                f"""
+                SELECT tag, count(*) AS total
+                FROM files CROSS JOIN LATERAL unnest(tags) AS tag
+                {where}
+                GROUP BY tag
+                ORDER BY total DESC, tag ASC
+                LIMIT %s
+                """,
+                tuple(params + [SEARCH_FACETS_LIMIT]),
+            ).fetchall()
+            facets = [{"tag": r["tag"], "count": r["total"]} for r in facet_rows]
+
+    items = []
+    for r in rows:
+        item = row_to_file(r)
+        item["rank"] = r.get("rank")
+        items.append(item)
+    total = rows[0]["total"] if rows else 0
+    if not rows and offset:
+        # La pagina pedida quedo fuera de rango; el total no viaja en filas vacias.
+        with get_db() as conn:
+            count_row = conn.execute(f"SELECT count(*) AS total FROM files {where}", tuple(params)).fetchone()
+        total = count_row["total"] if count_row else 0
+    return {"files": items, "total": total, "limit": limit, "offset": offset, "facets": facets}
+
+
 def create_file(
     uploaded,
     tags_list: Optional[List[str]],
@@ -39,7 +158,7 @@ def create_file(
     base_prefix = "file"
     blob_name = f"{base_prefix}/{uuid.uuid4().hex}-{filename}"
 
-    blob_url = upload_blob(blob_name, uploaded.stream, uploaded.mimetype)
+    blob_url, content_id = upload_blob_with_content_id(blob_name, uploaded.stream, uploaded.mimetype)
     thumbnail_url = blob_url if (uploaded.mimetype or "").startswith("image/") else None
 
     with get_db() as conn:
@@ -52,25 +171,44 @@ def create_file(
             (filename, blob_name, blob_url, thumbnail_url, uploaded.mimetype, size_bytes, tags_list, notes),
         ).fetchone()
     logger.info("Metadata guardada en files id=%s nombre=%s", row["id"], filename)
-    return row_to_file(row)
+    return row_to_file(row), content_id
+
+
+def _workspace_schema() -> str:
+    return getattr(g, "workspace_schema", None) or config.DB_SCHEMA
 
 
-def notify_ingest_webhook(file_info: Dict[str, Any]):
+def _send_upload_notification(schema: str, payload: Dict[str, Any]) -> None:
+    file_id = payload["file_id"]
+    try:
+        # Un 4xx/5xx de n8n cuenta como fallo de entrega (igual que un error de red): se libera la marca pendiente.
+        requests.post(config.N8N_WEBHOOK_URL, json=payload, timeout=5).raise_for_status()
+        logger.info("Webhook n8n enviado para file_id=%s", file_id)
+    except Exception as ex:
+        logger.warning("No se pudo notificar a n8n para file_id=%s: %s", file_id, ex)
+        _clear_ingest_pending(schema, file_id, payload.get("fingerprint"))
+
+
+def notify_ingest_webhook(file_info: Dict[str, Any], content_id: Optional[str] = None):
+    """
+    Avisa a n8n de un archivo nuevo en segundo plano; la huella usa el content id devuelto por la subida.
+    """
     if not config.N8N_WEBHOOK_URL:
         return
+    fingerprint = _ingest_fingerprint(file_info, content_id) if content_id else _fingerprint_for_row(file_info)
+    schema = _workspace_schema()
     payload = {
         "file_id": file_info["id"],
         "filename": file_info["filename"],
         "blob_path": file_info["blob_path"],
         "tags": file_info.get("tags") or [],
         "notes": file_info.get("notes"),
-        "schema": getattr(g, "workspace_schema", config.DB_SCHEMA),
+        "fingerprint": fingerprint,
+        "schema": schema,
     }
-    try:
-        requests.post(config.N8N_WEBHOOK_URL, json=payload, timeout=5)
-        logger.info("Webhook n8n enviado para file_id=%s", file_info["id"])
-    except Exception:
-        logger.warning("No se pudo notificar a n8n para file_id=%s", file_info["id"])
+    if fingerprint:
+        _mark_ingest_pending(schema, [(file_info["id"], fingerprint)])
+    _INGEST_POOL.submit(_send_upload_notification, schema, payload)
 
 
 def get_file(file_id: int):
@@ -184,14 +322,70 @@ def delete_file(file_id: int) -> Tuple[bool, Optional[str], Optional[str], Optio
     return True, None, blob_path, webhook_msg
 
 
-def send_to_n8n(file_id: int) -> Tuple[bool, str]:
-    if not config.N8N_WEBHOOK_URL:
-        return False, "Configura N8N_WEBHOOK_URL"
+def _ingest_fingerprint(row: Dict[str, Any], content_id: str) -> str:
+    """
+    Huella de lo que n8n indexa de un archivo: contenido del blob + metadatos que viajan en la ingesta.
+    Si no cambia, re-enviar el archivo solo repetiria el embedding.
+    """
+    material = {
+        "content": content_id,
+        "blob_path": row.get("blob_path"),
+        "filename": row.get("filename"),
+        "tags": sorted(row.get("tags") or []),
+        "notes": row.get("notes") or "",
+    }
+    encoded = json.dumps(material, sort_keys=True, ensure_ascii=False).encode("utf-8")
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def _fingerprint_for_row(row: Dict[str, Any]) -> Optional[str]:
+    try:
+        return _ingest_fingerprint(row, get_blob_content_id(row["blob_path"]))
+    except Exception as ex:
+        logger.warning("No se pudo calcular huella de ingesta file_id=%s: %s", row.get("id"), ex)
+        return None
 
-    row = get_file(file_id)
-    if not row:
-        return False, "Archivo no encontrado"
 
+def _mark_ingest_pending(schema: str, items: List[Tuple[int, str]]) -> None:
+    """Registra la huella enviada y desde cuando (expira a los INGEST_PENDING_TTL) en una sola sentencia."""
+    with get_db(schema=schema) as conn:
+        conn.execute(
+            """
+            UPDATE files f
+            SET ingest_pending_fingerprint = v.fingerprint, ingest_pending_at = NOW()
+            FROM unnest(%s::int[], %s::text[]) AS v(id, fingerprint)
+            WHERE f.id = v.id
+            """,
+            ([file_id for file_id, _ in items], [fingerprint for _, fingerprint in items]),
+        )
+
+
+def _clear_ingest_pending(schema: str, file_id: int, fingerprint: Optional[str]) -> None:
+    # El envio fallo: el archivo vuelve a ser candidato en la proxima re-ingesta.
+    with get_db(schema=schema) as conn:
+        conn.execute(
+            """
+            UPDATE files SET ingest_pending_fingerprint = NULL, ingest_pending_at = NULL
+            WHERE id = %s AND ingest_pending_fingerprint IS NOT DISTINCT FROM %s
+            """,
+            (file_id, fingerprint),
+        )
+
+
+def _dispatch_ingest_batch(schema: str, batch: List[Tuple[Dict[str, Any], str]]) -> None:
+    for row, fingerprint in batch:
+        try:
+            ok, message = _post_ingest(row, fingerprint, schema)
+            if not ok:
+                logger.warning("Re-ingesta fallida file_id=%s: %s", row["id"], message)
+                _clear_ingest_pending(schema, row["id"], fingerprint)
+        except Exception:
+            logger.exception("Error en re-ingesta en segundo plano file_id=%s", row["id"])
+
+
+def _post_ingest(row: Dict[str, Any], fingerprint: Optional[str], schema: Optional[str] = None) -> Tuple[bool, str]:
+    schema = schema or _workspace_schema()
+    file_id = row["id"]
     file_obj = row_to_file(row)
     payload = {
         "file_id": row["id"],
@@ -202,7 +396,8 @@ def send_to_n8n(file_id: int) -> Tuple[bool, str]:
         "tags": file_obj.get("tags") or [],
         "notes": file_obj.get("notes"),
         "status": file_obj.get("status"),
-        "schema": getattr(g, "workspace_schema", config.DB_SCHEMA),
+        "fingerprint": fingerprint,
+        "schema": schema,
     }
 
     try:
@@ -219,10 +414,13 @@ def send_to_n8n(file_id: int) -> Tuple[bool, str]:
                 logger.warning("Fallo intento con URL de produccion: %s", ex_alt)
 
         if 200 <= res.status_code < 300:
-            with get_db() as conn:
+            with get_db(schema=schema) as conn:
                 conn.execute(
-                    "UPDATE files SET status=%s, updated_at=NOW() WHERE id=%s",
-                    ("processing", file_id),
+                    """
+                    UPDATE files SET status=%s, ingest_pending_fingerprint=%s, ingest_pending_at=NOW(), updated_at=NOW()
+                    WHERE id=%s
+                    """,
+                    ("processing", fingerprint, file_id),
                 )
             logger.info(
                 "Webhook n8n OK file_id=%s status=%s code=%s url=%s",
@@ -249,6 +447,240 @@ def send_to_n8n(file_id: int) -> Tuple[bool, str]:
         return False, f"Error enviando a n8n: {ex}"
 
 
+def send_to_n8n(file_id: int) -> Tuple[bool, str]:
+    if not config.N8N_WEBHOOK_URL:
+        return False, "Configura N8N_WEBHOOK_URL"
+
+    row = get_file(file_id)
+    if not row:
+        return False, "Archivo no encontrado"
+
+    return _post_ingest(row, _fingerprint_for_row(row))
+
+
+def reindex_files(folder: Optional[str] = None, force: bool = False, dry_run: bool = False) -> Dict[str, Any]:
+    """
+    Re-ingesta incremental de una carpeta (o todo el workspace): solo envia a n8n los archivos cuya
+    huella (contenido del blob + metadatos de ingesta) cambio desde el ultimo procesamiento exitoso.
+    Los content ids de Blob se obtienen con un unico listado por prefijo, sin descargar contenido.
+    Los seleccionados se marcan pendientes en una sola sentencia y se envian en lotes en segundo plano;
+    una huella pendiente solo se omite durante INGEST_PENDING_TTL.
+    """
+    if not config.N8N_WEBHOOK_URL and not dry_run:
+        raise RuntimeError("Configura N8N_WEBHOOK_URL")
+
+    folder_path = sanitize_folder_path(folder)
+    prefix = f"{folder_path}/" if folder_path else ""
+    conditions = ["status IS DISTINCT FROM %s"] * (len(REMOVED_STATUSES) + 1)
+    params: List[Any] = list(REMOVED_STATUSES) + ["deleting"]
+    if prefix:
+        conditions.append("starts_with(blob_path, %s)")
+        params.append(prefix)
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, filename, blob_path, blob_url, thumbnail_url, mime_type, size_bytes, tags, notes, status,
+                   processed_at, created_at, updated_at, ingest_fingerprint, ingest_pending_fingerprint,
+                   ingest_pending_at > NOW() - %s AS ingest_pending_fresh
+            FROM files
+            WHERE {' AND '.join(conditions)}
+            ORDER BY id
+            """,
+            tuple([INGEST_PENDING_TTL] + params),
+        ).fetchall()
+
+    content_ids = list_blob_content_ids(prefix)
+    summary: Dict[str, Any] = {
+        "folder": folder_path,
+        "total": len(rows),
+        "queued": 0,
+        "skipped_unchanged": 0,
+        "skipped_pending": 0,
+        "missing_blob": 0,
+        "dry_run": dry_run,
+    }
+    to_send: List[Tuple[Dict[str, Any], str]] = []
+    for row in rows:
+        content_id = content_ids.get(row["blob_path"])
+        if not content_id:
+            summary["missing_blob"] += 1
+            continue
+        fingerprint = _ingest_fingerprint(row, content_id)
+        if not force and fingerprint == row.get("ingest_fingerprint"):
+            summary["skipped_unchanged"] += 1
+            continue
+        if not force and fingerprint == row.get("ingest_pending_fingerprint") and row.get("ingest_pending_fresh"):
+            summary["skipped_pending"] += 1
+            continue
+        to_send.append((row, fingerprint))
+    summary["queued"] = len(to_send)
+    summary["skipped"] = summary["skipped_unchanged"] + summary["skipped_pending"]
+
+    if to_send and not dry_run:
+        schema = _workspace_schema()
+        _mark_ingest_pending(schema, [(row["id"], fingerprint) for row, fingerprint in to_send])
+        for start in range(0, len(to_send), INGEST_BATCH_SIZE):
+            _INGEST_POOL.submit(_dispatch_ingest_batch, schema, to_send[start:start + INGEST_BATCH_SIZE])
+    logger.info(
+        "Reindex folder=%s total=%s encolados=%s omitidos=%s",
+        folder_path or "/",
+        summary["total"],
+        summary["queued"],
+        summary["skipped"],
+    )
+    return summary
+
+
+class _ZipSink:
+    """
+    Destino no-seekable para `zipfile`: acumula lo escrito para que el generador lo entregue al cliente.
+    `zipfile` detecta que no hay `seek` y usa data descriptors, asi que no hace falta archivo temporal.
+    """
+
+    def __init__(self) -> None:
+        self._parts: List[bytes] = []
+        self._offset = 0
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._offset
+
+    def flush(self) -> None:
+        pass
+
+    def drain(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+def _put_until_cancelled(out: "queue.Queue", item: Any, cancelled: threading.Event) -> bool:
+    while not cancelled.is_set():
+        try:
+            out.put(item, timeout=1)
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _prefetch_blob(blob_path: str, out: "queue.Queue", cancelled: threading.Event) -> None:
+    try:
+        if cancelled.is_set():
+            return
+        for chunk in iter_blob_chunks(blob_path):
+            if not _put_until_cancelled(out, chunk, cancelled):
+                return
+        _put_until_cancelled(out, _ARCHIVE_EOF, cancelled)
+    except Exception as ex:
+        logger.warning("No se pudo descargar blob para ZIP %s: %s", blob_path, ex)
+        _put_until_cancelled(out, ex, cancelled)
+
+
+def _archive_entries(rows, prefix: str) -> List[Tuple[Dict[str, Any], str]]:
+    entries = []
+    used = set()
+    for row in rows:
+        relative = row["blob_path"][len(prefix):] if prefix else row["blob_path"]
+        directory = "/".join(relative.split("/")[:-1])
+        name = f"{directory}/{row['filename']}" if directory else row["filename"]
+        candidate = name
+        suffix = 2
+        while candidate in used:
+            stem, dot, ext = name.rpartition(".")
+            candidate = f"{stem} ({suffix}).{ext}" if dot and stem else f"{name} ({suffix})"
+            suffix += 1
+        used.add(candidate)
+        entries.append((row, candidate))
+    return entries
+
+
+def build_folder_archive(folder: Optional[str]) -> Tuple[str, Iterator[bytes]]:
+    """
+    Prepara un ZIP en streaming con los archivos vigentes bajo `folder` (jerarquia de Blob).
+    Devuelve (nombre_zip, generador de bytes). La consulta a DB se hace aqui; el generador solo
+    descarga blobs, con `ARCHIVE_READ_AHEAD` descargas adelantadas y colas acotadas.
+    """
+    folder_path = sanitize_folder_path(folder)
+    prefix = f"{folder_path}/" if folder_path else ""
+    conditions = ["status IS DISTINCT FROM %s"] * (len(REMOVED_STATUSES) + 1)
+    params: List[Any] = list(REMOVED_STATUSES) + ["deleting"]
+    if prefix:
+        conditions.append("starts_with(blob_path, %s)")
+        params.append(prefix)
+    with get_db() as conn:
+        rows = conn.execute(
+            f"""
+            SELECT id, filename, blob_path, created_at
+            FROM files
+            WHERE {' AND '.join(conditions)}
+            ORDER BY blob_path
+            """,
+            tuple(params),
+        ).fetchall()
+    if not rows:
+        raise LookupError("carpeta_vacia")
+
+    entries = _archive_entries(rows, prefix)
+    archive_name = (folder_path.split("/")[-1] if folder_path else "archivos") + ".zip"
+    return archive_name, _stream_archive(entries)
+
+
+def _stream_archive(entries: List[Tuple[Dict[str, Any], str]]) -> Iterator[bytes]:
+    cancelled = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=ARCHIVE_READ_AHEAD, thread_name_prefix="zip-prefetch")
+    pending: deque = deque()
+    remaining = iter(entries)
+    failed: List[str] = []
+
+    def schedule_next() -> None:
+        entry = next(remaining, None)
+        if entry is None:
+            return
+        out: "queue.Queue" = queue.Queue(maxsize=ARCHIVE_QUEUE_CHUNKS)
+        pool.submit(_prefetch_blob, entry[0]["blob_path"], out, cancelled)
+        pending.append((entry, out))
+
+    sink = _ZipSink()
+    try:
+        for _ in range(ARCHIVE_READ_AHEAD):
+            schedule_next()
+        with zipfile.ZipFile(sink, mode="w", compression=zipfile.ZIP_DEFLATED, compresslevel=1) as archive:
+            while pending:
+                (row, name), out = pending.popleft()
+                schedule_next()
+                info = zipfile.ZipInfo(name)
+                created_at = row.get("created_at")
+                if created_at and created_at.year >= 1980:
+                    info.date_time = created_at.timetuple()[:6]
+                info.compress_type = zipfile.ZIP_DEFLATED
+                with archive.open(info, mode="w", force_zip64=True) as dest:
+                    while True:
+                        item = out.get()
+                        if item is _ARCHIVE_EOF:
+                            break
+                        if isinstance(item, Exception):
+                            failed.append(f"{name}: {item}")
+                            break
+                        dest.write(item)
+                        data = sink.drain()
+                        if data:
+                            yield data
+                data = sink.drain()
+                if data:
+                    yield data
+            if failed:
+                archive.writestr("ERRORES.txt", "No se pudieron descargar:\n" + "\n".join(failed) + "\n")
+        yield sink.drain()
+    finally:
+        cancelled.set()
+        pool.shutdown(wait=False, cancel_futures=True)
+
+
 def sas_for_file(file_id: int) -> str:
     row = get_file(file_id)
     if not row:
@@ -279,6 +711,12 @@ def update_file_metadata(file_id: int, payload: Dict[str, Any]):
     if not fields:
         raise ValueError("sin cambios")
 
+    # n8n termino de indexar: la huella enviada (o la pendiente) pasa a ser la version indexada.
+    if str(payload.get("status") or "").strip().lower() in INGESTED_STATUSES:
+        fields.append("ingest_fingerprint=coalesce(%s, ingest_pending_fingerprint)")
+        values.append(payload.get("fingerprint") or None)
+        fields.extend(["ingest_pending_fingerprint=NULL", "ingest_pending_at=NULL", "ingested_at=NOW()"])
+
     values.append(file_id)
     with get_db() as conn:
         row = conn.execute(
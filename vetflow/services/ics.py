@@ -0,0 +1,260 @@
+import hmac
+import json
+import logging
+import secrets
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import request
+
+from .. import ical
+from ..cache import LRUCache
+from ..config import config
+from ..db import _resolve_schema, get_db
+from .calendar import PERIOD_SQL, api_bulk_create
+
+logger = logging.getLogger(__name__)
+
+FEED_DEFAULT_PAST_DAYS = 90
+FEED_DEFAULT_FUTURE_DAYS = 365
+FEED_MAX_DAYS = 730
+FEED_CURSOR_ITERSIZE = 500
+# Se acumulan VEVENTs hasta ~64 KB antes de emitir un chunk de la respuesta.
+FEED_FLUSH_BYTES = 64 * 1024
+# Feeds > 5 MB no se cachean (se regeneran en streaming).
+FEED_CACHE_MAX_BYTES = 5 * 1024 * 1024
+# La clave es el ETag (schema + query + version de las colecciones + dia de la ventana): una escritura de
+# citas invalida sola y el cambio de dia UTC desplaza la ventana y la clave a la vez.
+_FEED_CACHE = LRUCache(maxsize=64, ttl=3600)
+_ICS_STATUS = {"cancelada": "CANCELLED", "programada": "TENTATIVE"}
+
+
+def _ensure_settings_table(conn) -> None:
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS calendar_settings (key TEXT PRIMARY KEY, value JSONB NOT NULL, updated_at TIMESTAMPTZ DEFAULT NOW())"
+    )
+
+
+def get_feed_token(rotate: bool = False) -> str:
+    """Token del feed .ics del workspace actual (se crea al primer uso; `rotate` invalida el anterior)."""
+    with get_db() as conn:
+        _ensure_settings_table(conn)
+        if not rotate:
+            row = conn.execute("SELECT value FROM calendar_settings WHERE key = 'ics_feed'").fetchone()
+            if row and row["value"].get("token"):
+                return row["value"]["token"]
+        token = secrets.token_urlsafe(24)
+        conn.execute(
+            """
+            INSERT INTO calendar_settings (key, value, updated_at)
+            VALUES ('ics_feed', %s::jsonb, NOW())
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+            """,
+            (json.dumps({"token": token}),),
+        )
+    if rotate:
+        logger.info("Token de feed .ics rotado schema=%s", _resolve_schema())
+    return token
+
+
+def verify_feed_token(token: Optional[str]) -> bool:
+    if not token:
+        return False
+    try:
+        with get_db() as conn:
+            row = conn.execute("SELECT value FROM calendar_settings WHERE key = 'ics_feed'").fetchone()
+    except Exception:
+        return False
+    expected = (row["value"] or {}).get("token") if row else None
+    return bool(expected) and hmac.compare_digest(str(expected), str(token))
+
+
+def _window_days(name: str, default: int) -> int:
+    raw = request.args.get(name)
+    try:
+        value = int(raw) if raw not in (None, "") else default
+    except ValueError:
+        raise ValueError(f"{name}_invalido")
+    return max(0, min(value, FEED_MAX_DAYS))
+
+
+def feed_window() -> tuple:
+    """
+    Ventana del feed alineada al dia UTC: no se mueve dentro del dia, asi que el ETag y la cache
+    (que incluyen `window_start`) sirven siempre el cuerpo de la ventana vigente.
+    """
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    return (
+        today - timedelta(days=_window_days("past_days", FEED_DEFAULT_PAST_DAYS)),
+        today + timedelta(days=_window_days("future_days", FEED_DEFAULT_FUTURE_DAYS) + 1),
+    )
+
+
+def _uid(kind: str, item_id: Any) -> str:
+    return f"{kind}-{item_id}@{_resolve_schema()}.vetflow"
+
+
+def _appointment_vevent(row: Dict[str, Any]) -> str:
+    stamp = row.get("updated_at") or row.get("created_at") or row["start_time"]
+    description = row.get("description") or ""
+    if row.get("resource"):
+        description = f"{description}\nRecurso: {row['resource']}".strip()
+    return ical.vevent(
+        [
+            ("UID", _uid("appointment", row["id"])),
+            ("DTSTAMP", ical.format_utc(stamp)),
+            ("LAST-MODIFIED", ical.format_utc(stamp)),
+            ("DTSTART", ical.format_utc(row["start_time"])),
+            ("DTEND", ical.format_utc(max(row["start_time"], row["end_time"]))),
+            ("SUMMARY", ical.escape_text(row.get("title"))),
+            ("DESCRIPTION", ical.escape_text(description)),
+            ("STATUS", _ICS_STATUS.get(str(row.get("status")), "CONFIRMED")),
+        ]
+    )
+
+
+def _series_vevent(row: Dict[str, Any], excluded: List[datetime]) -> str:
+    tz_name = row["timezone"]
+    tz = ZoneInfo(tz_name)
+    start = row["start_time"]
+    end = start + timedelta(minutes=row["duration_minutes"])
+    properties = [
+        ("UID", _uid("series", row["id"])),
+        ("DTSTAMP", ical.format_utc(row.get("updated_at") or start)),
+        (f"DTSTART;TZID={tz_name}", ical.format_local(start, tz)),
+        (f"DTEND;TZID={tz_name}", ical.format_local(end, tz)),
+        ("RRULE", row["rrule"]),
+        ("SUMMARY", ical.escape_text(row.get("title"))),
+        ("DESCRIPTION", ical.escape_text(row.get("description"))),
+        ("STATUS", _ICS_STATUS.get(str(row.get("status")), "CONFIRMED")),
+    ]
+    if excluded:
+        # Canceladas y materializadas: las materializadas salen como VEVENT propio.
+        properties.append((f"EXDATE;TZID={tz_name}", ",".join(ical.format_local(d, tz) for d in sorted(excluded))))
+    return ical.vevent(properties)
+
+
+def _series_vevents(conn, window_start: datetime, window_end: datetime) -> Iterator[str]:
+    try:
+        series_rows = conn.execute(
+            """
+            SELECT id, title, description, start_time, duration_minutes, rrule, timezone, status, updated_at
+            FROM appointment_series
+            WHERE tstzrange(start_time, until, '[)') && tstzrange(%s, %s, '[)')
+            ORDER BY id
+            """,
+            (window_start, window_end),
+        ).fetchall()
+    except Exception:
+        conn.rollback()
+        return
+    if not series_rows:
+        return
+    # Cada TZID usado lleva su VTIMEZONE (RFC 5545), desde el inicio de la serie mas antigua hasta el fin de la ventana.
+    zones: Dict[str, datetime] = {}
+    for row in series_rows:
+        zones[row["timezone"]] = min(zones.get(row["timezone"], window_start), row["start_time"])
+    for tz_name, zone_start in sorted(zones.items()):
+        try:
+            yield ical.vtimezone(tz_name, zone_start, window_end)
+        except (ZoneInfoNotFoundError, ValueError):
+            pass
+    excluded: Dict[int, List[datetime]] = {}
+    for r in conn.execute(
+        """
+        SELECT series_id, occurrence_start FROM appointment_series_exdates WHERE series_id = ANY(%s)
+        UNION ALL
+        SELECT series_id, occurrence_start FROM appointments WHERE series_id = ANY(%s)
+        """,
+        ([r["id"] for r in series_rows], [r["id"] for r in series_rows]),
+    ).fetchall():
+        excluded.setdefault(r["series_id"], []).append(r["occurrence_start"])
+    for row in series_rows:
+        try:
+            yield _series_vevent(row, excluded.get(row["id"], []))
+        except (ZoneInfoNotFoundError, ValueError):
+            logger.warning("Serie %s con timezone invalida omitida del feed", row["id"])
+
+
+def cached_feed(cache_key: Optional[str]) -> Optional[bytes]:
+    if not cache_key:
+        return None
+    return _FEED_CACHE.get(cache_key)
+
+
+def iter_feed(calendar_name: str, window_start: datetime, window_end: datetime, cache_key: Optional[str] = None) -> Iterator[bytes]:
+    """
+    Genera el .ics en streaming: las citas de la ventana se leen con un cursor del lado del servidor
+    (lotes de FEED_CURSOR_ITERSIZE), sin cargar la lista completa. Si termina y es chico, se cachea.
+    """
+    produced: Optional[List[bytes]] = [] if cache_key else None
+    produced_size = 0
+    buffer: List[str] = [ical.calendar_header(calendar_name)]
+    buffered = 0
+
+    def _flush():
+        nonlocal buffer, buffered, produced, produced_size
+        chunk = "".join(buffer).encode("utf-8")
+        buffer, buffered = [], 0
+        if produced is not None:
+            produced_size += len(chunk)
+            if produced_size > FEED_CACHE_MAX_BYTES:
+                produced = None
+            else:
+                produced.append(chunk)
+        return chunk
+
+    with get_db() as conn:
+        with conn.cursor(name="ics_feed") as cur:
+            cur.itersize = FEED_CURSOR_ITERSIZE
+            cur.execute(
+                f"""
+                SELECT id, title, description, start_time, end_time, status, resource, created_at, updated_at
+                FROM appointments
+                WHERE {PERIOD_SQL} && tstzrange(%s, %s, '[)')
+                ORDER BY start_time, id
+                """,
+                (window_start, window_end),
+            )
+            for row in cur:
+                event = _appointment_vevent(row)
+                buffer.append(event)
+                buffered += len(event)
+                if buffered >= FEED_FLUSH_BYTES:
+                    yield _flush()
+        for event in _series_vevents(conn, window_start, window_end):
+            buffer.append(event)
+    buffer.append(ical.calendar_footer())
+    yield _flush()
+    if produced is not None and cache_key:
+        _FEED_CACHE.set(cache_key, b"".join(produced))
+
+
+def _default_zone() -> ZoneInfo:
+    try:
+        header_tz = (request.headers.get("X-Timezone") or "").strip()
+    except RuntimeError:
+        header_tz = ""
+    name = header_tz or (config.APP_TIMEZONE or "UTC").strip() or "UTC"
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        raise ValueError(f"timezone_invalida: {name}")
+
+
+def import_ics(chunks: Iterable[bytes], mode: str = "best_effort") -> Dict[str, Any]:
+    """
+    Importa un .ics leido en streaming: cada VEVENT se convierte a cita y se inserta por el mismo camino
+    que el alta masiva (COPY + INSERT ... SELECT). Horas flotantes usan X-Timezone o APP_TIMEZONE.
+    """
+    default_tz = _default_zone()
+
+    def _records():
+        for index, properties in enumerate(ical.iter_vevents(chunks)):
+            try:
+                yield index, ical.vevent_to_appointment(properties, default_tz)
+            except ValueError as ex:
+                yield index, ex
+
+    return api_bulk_create(_records(), mode)
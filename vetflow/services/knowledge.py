@@ -0,0 +1,480 @@
+import heapq
+import logging
+import math
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+from flask import g
+from psycopg.types.json import Jsonb
+
+from ..config import config
+from ..db import get_db
+
+logger = logging.getLogger(__name__)
+
+SEARCH_DEFAULT_K = 8
+SEARCH_MAX_K = 100
+SEARCH_MAX_CANDIDATES = 200
+RRF_DEFAULT_K = 60
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+BACKEND_PGVECTOR = "pgvector"
+BACKEND_MEMORY = "memory"
+
+_BACKENDS: Dict[str, str] = {}
+_BACKENDS_LOCK = threading.Lock()
+_MEMORY_INDEXES: Dict[str, "_MemoryIndex"] = {}
+_MEMORY_LOCK = threading.Lock()
+# Ejecuta la rama lexica en paralelo a la vectorial en busquedas hibridas.
+_RETRIEVAL_POOL = ThreadPoolExecutor(max_workers=8, thread_name_prefix="knowledge")
+
+
+def _current_schema() -> str:
+    return getattr(g, "workspace_schema", None) or config.DB_SCHEMA
+
+
+def _embedding_column_type(conn) -> Optional[str]:
+    row = conn.execute(
+        """
+        SELECT format_type(a.atttypid, a.atttypmod) AS column_type
+        FROM pg_attribute a
+        WHERE a.attrelid = to_regclass('file_chunks') AND a.attname = 'embedding' AND NOT a.attisdropped
+        """
+    ).fetchone()
+    return row["column_type"] if row else None
+
+
+def _ensure_chunks_table(conn) -> str:
+    """
+    Devuelve el backend de busqueda de `file_chunks` (cacheado por proceso y schema). La tabla la crea
+    `ensure_workspace_schema`:
+    - pgvector: columna `vector(EMBEDDING_DIMENSIONS)` con indice HNSW (coseno).
+    - memory: sin pgvector, embeddings en REAL[] y busqueda por fuerza bruta en el proceso.
+    """
+    schema = _current_schema()
+    backend = _BACKENDS.get(schema)
+    if backend:
+        return backend
+    column_type = _embedding_column_type(conn)
+    if column_type is None:
+        raise RuntimeError(f"file_chunks no existe en {schema}; falta aplicar ensure_workspace_schema")
+    backend = BACKEND_PGVECTOR if column_type.startswith("vector") else BACKEND_MEMORY
+    with _BACKENDS_LOCK:
+        _BACKENDS[schema] = backend
+    return backend
+
+
+def _coerce_embedding(raw: Any) -> List[float]:
+    if not isinstance(raw, (list, tuple)) or not raw:
+        raise ValueError("embedding_requerido")
+    try:
+        values = [float(v) for v in raw]
+    except (TypeError, ValueError):
+        raise ValueError("embedding_invalido")
+    if len(values) != int(config.EMBEDDING_DIMENSIONS):
+        raise ValueError(f"embedding_dimension_invalida: se esperaban {config.EMBEDDING_DIMENSIONS}")
+    if any(math.isnan(v) or math.isinf(v) for v in values):
+        raise ValueError("embedding_invalido")
+    return values
+
+
+def _coerce_optional_int(raw: Any, field: str) -> Optional[int]:
+    if raw is None or raw == "":
+        return None
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field}_invalido")
+
+
+def _vector_literal(values: Sequence[float]) -> str:
+    return "[" + ",".join(repr(float(v)) for v in values) + "]"
+
+
+def _normalize_chunks(chunks: Any) -> List[Dict[str, Any]]:
+    if not isinstance(chunks, list) or not chunks:
+        raise ValueError("chunks_requeridos")
+    normalized = []
+    for position, chunk in enumerate(chunks):
+        if not isinstance(chunk, dict):
+            raise ValueError(f"chunk_invalido: {position}")
+        content = (chunk.get("content") or chunk.get("text") or "").strip()
+        if not content:
+            raise ValueError(f"chunk_sin_contenido: {position}")
+        try:
+            embedding = _coerce_embedding(chunk.get("embedding"))
+            start_offset = _coerce_optional_int(chunk.get("start_offset"), "start_offset")
+            end_offset = _coerce_optional_int(chunk.get("end_offset"), "end_offset")
+            chunk_index = _coerce_optional_int(chunk.get("chunk_index"), "chunk_index")
+        except ValueError as ex:
+            raise ValueError(f"{ex} (chunk {position})")
+        metadata = chunk.get("metadata")
+        normalized.append(
+            {
+                "chunk_index": position if chunk_index is None else chunk_index,
+                "content": content,
+                "start_offset": start_offset,
+                "end_offset": end_offset,
+                "embedding": embedding,
+                "metadata": metadata if isinstance(metadata, dict) else None,
+            }
+        )
+    return normalized
+
+
+def replace_file_chunks(file_id: int, chunks: Any, replace: bool = True) -> Dict[str, Any]:
+    """
+    Carga masiva (COPY) de los chunks que n8n genera para un archivo.
+    Con `replace=True` (por defecto) borra los chunks previos del archivo en la misma transaccion.
+    """
+    rows = _normalize_chunks(chunks)
+    with get_db() as conn:
+        backend = _ensure_chunks_table(conn)
+        exists = conn.execute("SELECT 1 FROM files WHERE id=%s", (file_id,)).fetchone()
+        if not exists:
+            raise LookupError("not_found")
+        deleted = 0
+        if replace:
+            deleted = conn.execute("DELETE FROM file_chunks WHERE file_id=%s", (file_id,)).rowcount
+        with conn.cursor() as cur:
+            with cur.copy(
+                "COPY file_chunks (file_id, chunk_index, content, start_offset, end_offset, embedding, metadata) FROM STDIN"
+            ) as copy:
+                for row in rows:
+                    embedding = _vector_literal(row["embedding"]) if backend == BACKEND_PGVECTOR else row["embedding"]
+                    copy.write_row(
+                        (
+                            file_id,
+                            row["chunk_index"],
+                            row["content"],
+                            row["start_offset"],
+                            row["end_offset"],
+                            embedding,
+                            Jsonb(row["metadata"]) if row["metadata"] is not None else None,
+                        )
+                    )
+    _invalidate_memory_index()
+    logger.info("Chunks cargados file_id=%s insertados=%s reemplazados=%s", file_id, len(rows), deleted)
+    return {"file_id": file_id, "inserted": len(rows), "deleted": deleted, "backend": backend}
+
+
+def delete_file_chunks(file_id: int) -> Dict[str, Any]:
+    with get_db() as conn:
+        _ensure_chunks_table(conn)
+        deleted = conn.execute("DELETE FROM file_chunks WHERE file_id=%s", (file_id,)).rowcount
+    _invalidate_memory_index()
+    return {"file_id": file_id, "deleted": deleted}
+
+
+def _file_filters(tags: Optional[List[str]], status: Optional[List[str]], file_ids: Optional[List[int]]):
+    conditions: List[str] = []
+    params: List[Any] = []
+    if tags:
+        conditions.append("f.tags && %s::text[]")
+        params.append(list(tags))
+    if status:
+        conditions.append("f.status = ANY(%s)")
+        params.append(list(status))
+    else:
+        conditions.append("NOT (coalesce(f.status, '') = ANY(%s))")
+        params.append(["deleting", "expired", "expirada", "deleted", "eliminado", "eliminar"])
+    if file_ids:
+        conditions.append("f.id = ANY(%s)")
+        params.append(list(file_ids))
+    return conditions, params
+
+
+def _row_to_result(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "chunk_id": row["id"],
+        "file_id": row["file_id"],
+        "chunk_index": row.get("chunk_index"),
+        "content": row.get("content"),
+        "start_offset": row.get("start_offset"),
+        "end_offset": row.get("end_offset"),
+        "metadata": row.get("metadata"),
+        "file": {
+            "id": row["file_id"],
+            "filename": row.get("filename"),
+            "tags": row.get("tags") or [],
+            "status": row.get("status"),
+        },
+    }
+
+
+class _MemoryIndex:
+    """
+    Cache en memoria (por schema) de los embeddings normalizados para instalaciones sin pgvector.
+    No es un indice: `top` recorre todos los chunks (fuerza bruta, O(N*d) por consulta), apto solo
+    para volumenes pequenos. Se recarga cuando cambia la version `file_chunks` de `collection_versions`.
+    """
+
+    def __init__(self, version: int, entries: List[Tuple[int, int, List[float]]]):
+        self.version = version
+        self.entries = entries
+
+    def top(self, query: List[float], k: int, allowed_files: Optional[set] = None) -> List[Tuple[float, int]]:
+        scored = (
+            (sum(a * b for a, b in zip(query, vector)), chunk_id)
+            for chunk_id, file_id, vector in self.entries
+            if allowed_files is None or file_id in allowed_files
+        )
+        return heapq.nlargest(k, scored)
+
+
+def _normalize_vector(values: Sequence[float]) -> List[float]:
+    norm = math.sqrt(sum(v * v for v in values)) or 1.0
+    return [v / norm for v in values]
+
+
+def _invalidate_memory_index() -> None:
+    with _MEMORY_LOCK:
+        _MEMORY_INDEXES.pop(_current_schema(), None)
+
+
+def _memory_index(conn, schema: str) -> _MemoryIndex:
+    version_row = conn.execute(
+        "SELECT version FROM collection_versions WHERE collection = 'file_chunks'"
+    ).fetchone()
+    version = version_row["version"] if version_row else 0
+    with _MEMORY_LOCK:
+        index = _MEMORY_INDEXES.get(schema)
+        if index and index.version == version:
+            return index
+    rows = conn.execute("SELECT id, file_id, embedding FROM file_chunks").fetchall()
+    index = _MemoryIndex(version, [(r["id"], r["file_id"], _normalize_vector(r["embedding"])) for r in rows])
+    with _MEMORY_LOCK:
+        _MEMORY_INDEXES[schema] = index
+    logger.info("Indice de chunks en memoria cargado schema=%s chunks=%s", schema, len(rows))
+    return index
+
+
+def _vector_candidates(
+    conn,
+    schema: str,
+    backend: str,
+    embedding: List[float],
+    k: int,
+    tags: Optional[List[str]],
+    status: Optional[List[str]],
+    file_ids: Optional[List[int]],
+) -> List[Dict[str, Any]]:
+    conditions, params = _file_filters(tags, status, file_ids)
+    if backend == BACKEND_PGVECTOR:
+        # SET LOCAL vale hasta el fin de la transaccion: se fija en la misma que corre el SELECT
+        conn.execute(f"SET LOCAL hnsw.ef_search = {max(40, k * 4)}")
+        literal = _vector_literal(embedding)
+        rows = conn.execute(
+            f"""
+            SELECT c.id, c.file_id, c.chunk_index, c.content, c.start_offset, c.end_offset, c.metadata,
+                   f.filename, f.tags, f.status,
+                   c.embedding OPERATOR(public.<=>) %s::public.vector AS distance
+            FROM file_chunks c
+            JOIN files f ON f.id = c.file_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.embedding OPERATOR(public.<=>) %s::public.vector
+            LIMIT %s
+            """,
+            tuple([literal] + params + [literal, k]),
+        ).fetchall()
+        return [dict(r) for r in rows]
+
+    allowed_files = None
+    if tags or status or file_ids:
+        allowed_rows = conn.execute(
+            f"SELECT f.id FROM files f WHERE {' AND '.join(conditions)}", tuple(params)
+        ).fetchall()
+        allowed_files = {r["id"] for r in allowed_rows}
+    top = _memory_index(conn, schema).top(_normalize_vector(embedding), k, allowed_files)
+    if not top:
+        return []
+    rows = conn.execute(
+        """
+        SELECT c.id, c.file_id, c.chunk_index, c.content, c.start_offset, c.end_offset, c.metadata,
+               f.filename, f.tags, f.status
+        FROM file_chunks c
+        JOIN files f ON f.id = c.file_id
+        WHERE c.id = ANY(%s)
+        """,
+        ([chunk_id for _, chunk_id in top],),
+    ).fetchall()
+    by_id = {r["id"]: dict(r) for r in rows}
+    results = []
+    for similarity, chunk_id in top:
+        row = by_id.get(chunk_id)
+        if row:
+            row["distance"] = 1.0 - similarity
+            results.append(row)
+    return results
+
+
+def _coerce_list(raw: Any) -> Optional[List[str]]:
+    if raw is None or raw == "":
+        return None
+    if isinstance(raw, str):
+        return [v.strip() for v in raw.split(",") if v.strip()] or None
+    if isinstance(raw, (list, tuple)):
+        return [str(v).strip() for v in raw if str(v).strip()] or None
+    raise ValueError("filtro_invalido")
+
+
+def _coerce_file_ids(raw: Any) -> Optional[List[int]]:
+    values = _coerce_list(raw)
+    if not values:
+        return None
+    try:
+        return [int(v) for v in values]
+    except ValueError:
+        raise ValueError("file_ids_invalido")
+
+
+def _lexical_candidates(
+    schema: str,
+    query: str,
+    k: int,
+    tags: Optional[List[str]],
+    status: Optional[List[str]],
+    file_ids: Optional[List[int]],
+) -> List[Dict[str, Any]]:
+    """
+    Rama lexica tipo BM25: terminos en OR (`plainto_tsquery` con `&` -> `|`) y `ts_rank_cd`
+    normalizado por longitud del chunk, sobre el indice GIN de `content_tsv`.
+    Abre su propia conexion para poder correr en paralelo a la rama vectorial.
+    """
+    conditions, params = _file_filters(tags, status, file_ids)
+    with get_db(schema=schema) as conn:
+        rows = conn.execute(
+            f"""
+            WITH q AS (
+                SELECT replace(
+                    plainto_tsquery('spanish', {config.CORE_SCHEMA}.immutable_unaccent(%s))::text, '&', '|'
+                )::tsquery AS query
+            )
+            SELECT c.id, c.file_id, c.chunk_index, c.content, c.start_offset, c.end_offset, c.metadata,
+                   f.filename, f.tags, f.status,
+                   ts_rank_cd(c.content_tsv, q.query, 1) AS lexical_score
+            FROM q
+            JOIN file_chunks c ON c.content_tsv @@ q.query
+            JOIN files f ON f.id = c.file_id
+            WHERE {' AND '.join(conditions)}
+            ORDER BY lexical_score DESC, c.id ASC
+            LIMIT %s
+            """,
+            tuple([query] + params + [k]),
+        ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def _coerce_weight(raw: Any, field: str) -> float:
+    if raw is None or raw == "":
+        return 1.0
+    try:
+        value = float(raw)
+    except (TypeError, ValueError):
+        raise ValueError(f"{field}_invalido")
+    if value < 0 or math.isnan(value) or math.isinf(value):
+        raise ValueError(f"{field}_invalido")
+    return value
+
+
+def _fuse_rrf(
+    vector_rows: List[Dict[str, Any]],
+    lexical_rows: List[Dict[str, Any]],
+    weights: Dict[str, float],
+    rrf_k: int,
+) -> List[Dict[str, Any]]:
+    """
+    Reciprocal Rank Fusion: score = sum(peso / (rrf_k + rank)) por cada lista donde aparece el chunk.
+    """
+    fused: Dict[int, Dict[str, Any]] = {}
+    for rank, row in enumerate(vector_rows, start=1):
+        item = fused.setdefault(row["id"], {"row": row, "vector": None, "lexical": None, "rrf": 0.0})
+        item["vector"] = {"rank": rank, "distance": float(row["distance"])}
+        item["rrf"] += weights["vector"] / (rrf_k + rank)
+    for rank, row in enumerate(lexical_rows, start=1):
+        item = fused.setdefault(row["id"], {"row": row, "vector": None, "lexical": None, "rrf": 0.0})
+        item["lexical"] = {"rank": rank, "score": float(row["lexical_score"])}
+        item["rrf"] += weights["lexical"] / (rrf_k + rank)
+    return sorted(fused.values(), key=lambda item: (-item["rrf"], item["row"]["id"]))
+
+
+def search_knowledge(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Recuperacion sobre los chunks del workspace.
+    - `mode=vector` (por defecto): vecinos aproximados por coseno sobre `embedding`.
+    - `mode=lexical`: ranking full-text sobre `query`.
+    - `mode=hybrid`: ambas ramas en paralelo fusionadas con RRF (`weights`, `rrf_k`),
+      con el desglose de ranks/scores por resultado.
+    Filtros opcionales por `tags` (cualquiera), `status` y `file_ids` del archivo origen.
+    """
+    mode = (payload.get("mode") or "vector").strip().lower()
+    if mode not in SEARCH_MODES:
+        raise ValueError("mode_invalido")
+    k = _coerce_optional_int(payload.get("k") or payload.get("limit"), "k") or SEARCH_DEFAULT_K
+    k = max(1, min(k, SEARCH_MAX_K))
+    tags = _coerce_list(payload.get("tags"))
+    status = _coerce_list(payload.get("status"))
+    file_ids = _coerce_file_ids(payload.get("file_ids"))
+
+    embedding = _coerce_embedding(payload.get("embedding")) if mode in ("vector", "hybrid") else None
+    query_text = (payload.get("query") or "").strip()
+    if mode in ("lexical", "hybrid") and not query_text:
+        raise ValueError("query_requerido")
+
+    schema = _current_schema()
+    if mode == "vector":
+        with get_db() as conn:
+            backend = _ensure_chunks_table(conn)
+            rows = _vector_candidates(conn, schema, backend, embedding, k, tags, status, file_ids)
+        results = []
+        for row in rows:
+            item = _row_to_result(row)
+            item["distance"] = float(row["distance"])
+            item["score"] = 1.0 - float(row["distance"])
+            results.append(item)
+        return {"results": results, "k": k, "mode": mode, "backend": backend}
+
+    if mode == "lexical":
+        with get_db() as conn:
+            backend = _ensure_chunks_table(conn)
+        rows = _lexical_candidates(schema, query_text, k, tags, status, file_ids)
+        results = []
+        for row in rows:
+            item = _row_to_result(row)
+            item["score"] = float(row["lexical_score"])
+            results.append(item)
+        return {"results": results, "k": k, "mode": mode, "backend": backend}
+
+    weights_raw = payload.get("weights") if isinstance(payload.get("weights"), dict) else {}
+    weights = {
+        "vector": _coerce_weight(weights_raw.get("vector"), "weights.vector"),
+        "lexical": _coerce_weight(weights_raw.get("lexical"), "weights.lexical"),
+    }
+    rrf_k = _coerce_optional_int(payload.get("rrf_k"), "rrf_k") or RRF_DEFAULT_K
+    rrf_k = max(1, rrf_k)
+    candidates = _coerce_optional_int(payload.get("candidates"), "candidates") or max(k * 4, 20)
+    candidates = max(k, min(candidates, SEARCH_MAX_CANDIDATES))
+
+    with get_db() as conn:
+        backend = _ensure_chunks_table(conn)
+        lexical_future = _RETRIEVAL_POOL.submit(
+            _lexical_candidates, schema, query_text, candidates, tags, status, file_ids
+        )
+        vector_rows = _vector_candidates(conn, schema, backend, embedding, candidates, tags, status, file_ids)
+    lexical_rows = lexical_future.result()
+
+    results = []
+    for fused in _fuse_rrf(vector_rows, lexical_rows, weights, rrf_k)[:k]:
+        item = _row_to_result(fused["row"])
+        item["score"] = fused["rrf"]
+        item["scores"] = {"rrf": fused["rrf"], "vector": fused["vector"], "lexical": fused["lexical"]}
+        results.append(item)
+    return {
+        "results": results,
+        "k": k,
+        "mode": mode,
+        "backend": backend,
+        "weights": weights,
+        "rrf_k": rrf_k,
+        "candidates": {"vector": len(vector_rows), "lexical": len(lexical_rows)},
+    }
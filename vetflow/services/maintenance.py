@@ -0,0 +1,57 @@
+import logging
+import threading
+import time
+from typing import Any, Dict
+
+from ..config import config
+from .calendar import prune_appointment_deletions
+from .clientes import refresh_stale_activity
+from .reminders import _workspace_schemas
+
+logger = logging.getLogger(__name__)
+
+_scheduler_thread = None
+_scheduler_lock = threading.Lock()
+
+
+def run_maintenance(schema: str) -> Dict[str, Any]:
+    """Tareas de mantenimiento de un workspace que no deben correr en el camino de lectura de la API."""
+    return {
+        "deletions_pruned": prune_appointment_deletions(schema),
+        "activity_refreshed": refresh_stale_activity(schema),
+    }
+
+
+def run_all_maintenance() -> Dict[str, Any]:
+    """Una pasada sobre todos los workspaces; un error en uno no detiene los demas."""
+    results: Dict[str, Any] = {}
+    for schema in _workspace_schemas():
+        try:
+            results[schema] = run_maintenance(schema)
+        except Exception as ex:
+            logger.warning("No se pudo ejecutar mantenimiento schema=%s: %s", schema, ex)
+            results[schema] = {"error": str(ex)}
+    return results
+
+
+def _scheduler_loop(interval: int) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            run_all_maintenance()
+        except Exception:
+            logger.exception("Error en el mantenimiento periodico")
+
+
+def start_scheduler() -> None:
+    """Arranca (una vez por proceso) el hilo de mantenimiento cada MAINTENANCE_INTERVAL_MINUTES."""
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is not None:
+            return
+        interval = max(1, int(config.MAINTENANCE_INTERVAL_MINUTES)) * 60
+        _scheduler_thread = threading.Thread(
+            target=_scheduler_loop, args=(interval,), name="maintenance", daemon=True
+        )
+        _scheduler_thread.start()
+    logger.info("Mantenimiento periodico activo (cada %smin)", interval // 60)
@@ -0,0 +1,338 @@
+import json
+import logging
+import threading
+import time
+from datetime import timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import requests
+from psycopg import errors
+
+from ..config import config
+from ..db import get_db
+from ..serializers import _iso_datetime
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OFFSETS_MINUTES = (1440, 120)
+MAX_OFFSET_MINUTES = 60 * 24 * 30
+DUE_BATCH_LIMIT = 50
+MAX_ATTEMPTS = 5
+RETRY_BACKOFF = timedelta(minutes=5)
+# Lease de un lote reclamado: si el proceso muere a mitad de la entrega, otro worker lo retoma al vencer.
+CLAIM_LEASE = timedelta(minutes=15)
+PENDING_MAX_LIMIT = 500
+
+DeliveryHook = Callable[[Dict[str, Any]], None]
+_delivery_hook: Optional[DeliveryHook] = None
+_scheduler_thread: Optional[threading.Thread] = None
+_scheduler_lock = threading.Lock()
+
+
+def log_delivery(reminder: Dict[str, Any]) -> None:
+    """Entrega local (sin REMINDER_WEBHOOK_URL): solo registra el recordatorio."""
+    logger.info(
+        "Recordatorio %s cita=%s inicio=%s (sin webhook configurado)",
+        reminder["idempotency_key"],
+        reminder["appointment"]["id"],
+        reminder["appointment"]["start_time"],
+    )
+
+
+def http_delivery(reminder: Dict[str, Any]) -> None:
+    """POST JSON a REMINDER_WEBHOOK_URL; el header Idempotency-Key permite al receptor descartar reenvios."""
+    res = requests.post(
+        config.REMINDER_WEBHOOK_URL,
+        json=reminder,
+        headers={"Idempotency-Key": reminder["idempotency_key"]},
+        timeout=10,
+    )
+    res.raise_for_status()
+
+
+def set_delivery_hook(hook: Optional[DeliveryHook]) -> None:
+    """Reemplaza la entrega (p. ej. envio directo por WhatsApp); None vuelve al webhook/log por defecto."""
+    global _delivery_hook
+    _delivery_hook = hook
+
+
+def _resolve_hook() -> DeliveryHook:
+    if _delivery_hook is not None:
+        return _delivery_hook
+    return http_delivery if config.REMINDER_WEBHOOK_URL else log_delivery
+
+
+def _reminder_payload(schema: str, row: Dict[str, Any]) -> Dict[str, Any]:
+    client = None
+    if row.get("client_id") is not None:
+        client = {
+            "id": row["client_id"],
+            "full_name": row.get("client_name"),
+            "phone": row.get("client_phone"),
+            "email": row.get("client_email"),
+        }
+    return {
+        "idempotency_key": f"{schema}:{row['id']}",
+        "workspace_schema": schema,
+        "offset_minutes": row["offset_minutes"],
+        "due_at": _iso_datetime(row["due_at"]),
+        "appointment": {
+            "id": row["appointment_id"],
+            "title": row["title"],
+            "description": row.get("description"),
+            "start_time": _iso_datetime(row["start_time"]),
+            "end_time": _iso_datetime(row["end_time"]),
+            "status": row["status"],
+            "timezone": row.get("timezone"),
+            "resource": row.get("resource"),
+        },
+        "client": client,
+    }
+
+
+def _claim_due_reminders(schema: str, limit: int) -> Tuple[List[Dict[str, Any]], int]:
+    """
+    Reclama un lote de recordatorios vencidos con un lease (`claimed_until`) y hace commit: los locks
+    (`FOR UPDATE SKIP LOCKED`) solo duran este UPDATE, no el envio. En la misma transaccion se cierran
+    los que ya no se deben enviar (cita iniciada o cancelada, o sin intentos restantes).
+    """
+    with get_db(schema=schema) as conn:
+        try:
+            conn.execute(
+                """
+                UPDATE appointment_reminders
+                SET sent_at = NOW(), claimed_until = NULL, last_error = 'agotado: ' || coalesce(last_error, '')
+                WHERE sent_at IS NULL AND due_at <= NOW() AND attempts >= %s
+                  AND (claimed_until IS NULL OR claimed_until < NOW())
+                """,
+                (MAX_ATTEMPTS,),
+            )
+            # La cita ya empezo (p. ej. scheduler detenido) o se cancelo: no tiene sentido avisar tarde.
+            expired = conn.execute(
+                """
+                UPDATE appointment_reminders r
+                SET sent_at = NOW(), claimed_until = NULL, last_error = 'expirado'
+                FROM appointments a
+                WHERE a.id = r.appointment_id AND r.sent_at IS NULL AND r.due_at <= NOW()
+                  AND (r.claimed_until IS NULL OR r.claimed_until < NOW())
+                  AND (a.start_time <= NOW() OR a.status::text = 'cancelada')
+                """
+            ).rowcount
+            rows = conn.execute(
+                """
+                WITH claimed AS (
+                    UPDATE appointment_reminders
+                    SET claimed_until = NOW() + %s
+                    WHERE id IN (
+                        SELECT id FROM appointment_reminders
+                        WHERE sent_at IS NULL AND due_at <= NOW()
+                          AND (claimed_until IS NULL OR claimed_until < NOW())
+                        ORDER BY due_at
+                        LIMIT %s
+                        FOR UPDATE SKIP LOCKED
+                    )
+                    RETURNING id, appointment_id, offset_minutes, due_at, attempts
+                )
+                SELECT r.id, r.appointment_id, r.offset_minutes, r.due_at, r.attempts,
+                       a.title, a.description, a.start_time, a.end_time, a.status::text AS status,
+                       a.timezone, a.client_id, a.resource,
+                       c.full_name AS client_name, c.phone AS client_phone, c.email AS client_email
+                FROM claimed r
+                JOIN appointments a ON a.id = r.appointment_id
+                LEFT JOIN clients c ON c.id = a.client_id
+                ORDER BY r.due_at
+                """,
+                (CLAIM_LEASE, limit),
+            ).fetchall()
+        except errors.UndefinedTable:
+            conn.rollback()
+            return [], 0
+    return rows, expired
+
+
+def deliver_due_reminders(schema: str, limit: int = DUE_BATCH_LIMIT) -> Dict[str, int]:
+    """
+    Entrega los recordatorios vencidos de un schema en tres pasos: reclamar el lote (lease + commit),
+    llamar al webhook sin transaccion abierta y registrar el resultado. El barrido usa el indice parcial
+    `appointment_reminders_due_idx` (solo pendientes) y el lease evita que dos procesos envien lo mismo.
+    Marcar como enviado es idempotente (`WHERE sent_at IS NULL`); los fallos se reintentan con espera
+    creciente y al llegar a MAX_ATTEMPTS quedan cerrados como `agotado`.
+    """
+    hook = _resolve_hook()
+    stats = {"sent": 0, "failed": 0, "expired": 0}
+    rows, stats["expired"] = _claim_due_reminders(schema, limit)
+
+    sent_ids: List[int] = []
+    failures: List[Tuple[int, str]] = []
+    for row in rows:
+        try:
+            hook(_reminder_payload(schema, row))
+        except Exception as ex:
+            logger.warning("Fallo entrega de recordatorio id=%s schema=%s: %s", row["id"], schema, ex)
+            failures.append((row["id"], str(ex)[:500]))
+            continue
+        sent_ids.append(row["id"])
+
+    if rows:
+        _record_deliveries(schema, sent_ids, failures)
+    stats["sent"] = len(sent_ids)
+    stats["failed"] = len(failures)
+    if any(stats.values()):
+        logger.info("Recordatorios schema=%s %s", schema, stats)
+    return stats
+
+
+def _record_deliveries(schema: str, sent_ids: List[int], failures: List[Tuple[int, str]]) -> None:
+    with get_db(schema=schema) as conn:
+        if sent_ids:
+            conn.execute(
+                """
+                UPDATE appointment_reminders
+                SET sent_at = NOW(), attempts = attempts + 1, last_error = NULL, claimed_until = NULL
+                WHERE id = ANY(%s) AND sent_at IS NULL
+                """,
+                (sent_ids,),
+            )
+        for reminder_id, error in failures:
+            conn.execute(
+                """
+                UPDATE appointment_reminders
+                SET attempts = attempts + 1,
+                    claimed_until = NULL,
+                    due_at = NOW() + %s * (attempts + 1),
+                    last_error = CASE WHEN attempts + 1 >= %s THEN 'agotado: ' || %s ELSE %s END,
+                    sent_at = CASE WHEN attempts + 1 >= %s THEN NOW() END
+                WHERE id = %s AND sent_at IS NULL
+                """,
+                (RETRY_BACKOFF, MAX_ATTEMPTS, error, error, MAX_ATTEMPTS, reminder_id),
+            )
+
+
+def _workspace_schemas() -> List[str]:
+    with get_db(schema=config.CORE_SCHEMA) as conn:
+        rows = conn.execute("SELECT schema_name FROM workspaces ORDER BY created_at").fetchall()
+    schemas = [r["schema_name"] for r in rows]
+    if config.DB_SCHEMA not in schemas:
+        schemas.append(config.DB_SCHEMA)
+    return schemas
+
+
+def deliver_all_due_reminders(limit: int = DUE_BATCH_LIMIT) -> Dict[str, int]:
+    """Una pasada sobre todos los workspaces (cada uno es una consulta indexada, no un barrido de citas)."""
+    totals = {"sent": 0, "failed": 0, "expired": 0}
+    for schema in _workspace_schemas():
+        try:
+            stats = deliver_due_reminders(schema, limit)
+        except Exception as ex:
+            logger.warning("No se pudieron procesar recordatorios schema=%s: %s", schema, ex)
+            continue
+        for key, value in stats.items():
+            totals[key] += value
+    return totals
+
+
+def _scheduler_loop(interval: int) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            deliver_all_due_reminders()
+        except Exception:
+            logger.exception("Error en el scheduler de recordatorios")
+
+
+def start_scheduler() -> None:
+    """Arranca (una vez por proceso) el hilo que entrega recordatorios cada REMINDER_POLL_SECONDS."""
+    global _scheduler_thread
+    with _scheduler_lock:
+        if _scheduler_thread is not None:
+            return
+        interval = max(5, int(config.REMINDER_POLL_SECONDS))
+        _scheduler_thread = threading.Thread(
+            target=_scheduler_loop, args=(interval,), name="reminder-scheduler", daemon=True
+        )
+        _scheduler_thread.start()
+    logger.info("Scheduler de recordatorios activo (cada %ss)", interval)
+
+
+def _offsets_setting(conn) -> List[int]:
+    row = conn.execute("SELECT value FROM calendar_settings WHERE key = 'reminders'").fetchone()
+    offsets = (row["value"] or {}).get("offsets_minutes") if row else None
+    return list(offsets) if offsets else list(DEFAULT_OFFSETS_MINUTES)
+
+
+def get_reminder_settings() -> Dict[str, Any]:
+    with get_db() as conn:
+        return {"offsets_minutes": _offsets_setting(conn)}
+
+
+def update_reminder_settings(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Cambia los offsets (minutos antes de `start_time`) y reprograma los recordatorios pendientes de las
+    citas futuras. Los ya enviados no se repiten.
+    """
+    raw = payload.get("offsets_minutes")
+    if not isinstance(raw, list):
+        raise ValueError("offsets_minutes debe ser una lista de minutos")
+    try:
+        offsets = sorted({int(v) for v in raw}, reverse=True)
+    except (TypeError, ValueError):
+        raise ValueError("offsets_minutes_invalido")
+    if any(not 0 < v <= MAX_OFFSET_MINUTES for v in offsets):
+        raise ValueError(f"offsets_minutes_invalido: 1..{MAX_OFFSET_MINUTES}")
+
+    with get_db() as conn:
+        conn.execute(
+            """
+            INSERT INTO calendar_settings (key, value, updated_at)
+            VALUES ('reminders', %s::jsonb, NOW())
+            ON CONFLICT (key) DO UPDATE SET value = EXCLUDED.value, updated_at = NOW()
+            """,
+            (json.dumps({"offsets_minutes": offsets}),),
+        )
+        conn.execute(
+            """
+            DELETE FROM appointment_reminders r
+            USING appointments a
+            WHERE a.id = r.appointment_id AND r.sent_at IS NULL AND a.start_time > NOW()
+            """
+        )
+        conn.execute(
+            """
+            INSERT INTO appointment_reminders (appointment_id, offset_minutes, due_at)
+            SELECT a.id, o, a.start_time - make_interval(mins => o)
+            FROM appointments a CROSS JOIN unnest(%s::int[]) AS o
+            WHERE a.start_time > NOW()
+              AND a.status::text <> 'cancelada'
+              AND a.start_time - make_interval(mins => o) > NOW()
+            ON CONFLICT (appointment_id, offset_minutes) DO NOTHING
+            """,
+            (offsets,),
+        )
+    logger.info("Offsets de recordatorios actualizados: %s", offsets)
+    return {"offsets_minutes": offsets}
+
+
+def list_pending_reminders(limit: int = 100) -> List[Dict[str, Any]]:
+    limit_value = max(1, min(int(limit or 100), PENDING_MAX_LIMIT))
+    with get_db() as conn:
+        rows = conn.execute(
+            """
+            SELECT id, appointment_id, offset_minutes, due_at, attempts, last_error
+            FROM appointment_reminders
+            WHERE sent_at IS NULL
+            ORDER BY due_at
+            LIMIT %s
+            """,
+            (limit_value,),
+        ).fetchall()
+    return [
+        {
+            "id": r["id"],
+            "appointment_id": r["appointment_id"],
+            "offset_minutes": r["offset_minutes"],
+            "due_at": _iso_datetime(r["due_at"]),
+            "attempts": r["attempts"],
+            "last_error": r["last_error"],
+        }
+        for r in rows
+    ]
@@ -0,0 +1,374 @@
+import logging
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from flask import request
+from psycopg import errors
+
+from ..config import config
+from ..db import get_db
+from ..recurrence import is_occurrence, iter_occurrences, parse_rrule, series_end
+from ..serializers import _iso_datetime, row_to_appointment_api
+from ..utils import parse_datetime
+from .calendar import (
+    NON_BLOCKING_STATUSES,
+    AppointmentConflictError,
+    _blocking_filter,
+    _coerce_client_id,
+    _coerce_resource,
+    _overlap_settings,
+    api_get,
+    api_update,
+    normalize_status,
+    overlap_conflict,
+)
+
+logger = logging.getLogger(__name__)
+
+SERIES_COLUMNS = (
+    "id, title, description, start_time, duration_minutes, rrule, timezone, until, status, client_id, resource, "
+    "created_at, updated_at"
+)
+# Ventana inicial de ocurrencias que se valida contra solapes al crear una serie.
+SERIES_CONFLICT_WINDOW = timedelta(days=365)
+_ANY_RESOURCE = object()
+
+
+def _zone(name: Optional[str]) -> ZoneInfo:
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, TypeError):
+        raise ValueError(f"timezone_invalida: {name}")
+
+
+def _default_timezone() -> str:
+    try:
+        header_tz = (request.headers.get("X-Timezone") or "").strip()
+    except RuntimeError:
+        header_tz = ""
+    return header_tz or (config.APP_TIMEZONE or "UTC").strip() or "UTC"
+
+
+def row_to_series(row: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "id": row["id"],
+        "title": row["title"],
+        "description": row.get("description"),
+        "start_time": _iso_datetime(row.get("start_time")),
+        "duration_minutes": row.get("duration_minutes"),
+        "rrule": row.get("rrule"),
+        "timezone": row.get("timezone"),
+        "until": _iso_datetime(row.get("until")),
+        "status": row.get("status"),
+        "client_id": row.get("client_id"),
+        "resource": row.get("resource"),
+        "created_at": _iso_datetime(row.get("created_at")),
+        "updated_at": _iso_datetime(row.get("updated_at")),
+    }
+
+
+def create_series(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Crea una serie recurrente: una sola fila con la regla (RRULE) y la primera ocurrencia.
+    Las ocurrencias no se guardan; se expanden al listar por rango.
+    """
+    title = (payload.get("title") or "").strip()
+    if not title or not payload.get("start_time") or not payload.get("rrule"):
+        raise ValueError("title, start_time y rrule son requeridos")
+    start_dt = parse_datetime(payload["start_time"])
+    if payload.get("end_time"):
+        duration = parse_datetime(payload["end_time"]) - start_dt
+    else:
+        try:
+            duration = timedelta(minutes=int(payload.get("duration_minutes") or 0))
+        except (TypeError, ValueError):
+            raise ValueError("duration_minutes_invalido")
+    if duration <= timedelta(0):
+        raise ValueError("end_time o duration_minutes requerido (duracion positiva)")
+    tz_name = (payload.get("timezone") or "").strip() or _default_timezone()
+    tz = _zone(tz_name)
+    rule = parse_rrule(payload["rrule"], tz)
+    until = series_end(rule, start_dt, tz, duration)
+    status = normalize_status(payload.get("status"))
+    client_id = _coerce_client_id(payload.get("client_id"))
+    resource = _coerce_resource(payload.get("resource"))
+
+    with get_db() as conn:
+        _check_series_conflicts(conn, rule, start_dt, tz, duration, until, status, resource)
+        row = conn.execute(
+            f"""
+            INSERT INTO appointment_series
+                (title, description, start_time, duration_minutes, rrule, timezone, until, status, client_id, resource)
+            VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+            RETURNING {SERIES_COLUMNS}
+            """,
+            (
+                title,
+                payload.get("description"),
+                start_dt,
+                int(duration.total_seconds() // 60),
+                rule.to_string(),
+                tz_name,
+                until,
+                status,
+                client_id,
+                resource,
+            ),
+        ).fetchone()
+    logger.info("Serie creada id=%s rrule=%s", row["id"], row["rrule"])
+    return row_to_series(row)
+
+
+def _check_series_conflicts(conn, rule, start_dt, tz, duration, until, status, resource) -> None:
+    """
+    Las series no pasan por la restriccion de exclusion de `appointments`: con la prevencion de solapes activa
+    se expande la primera ventana de ocurrencias y se valida contra las citas (indice GiST) y las demas series.
+    """
+    if status in NON_BLOCKING_STATUSES:
+        return
+    settings = _overlap_settings(conn)
+    if not settings["enabled"]:
+        return
+    window_end = start_dt + SERIES_CONFLICT_WINDOW
+    if until is not None:
+        window_end = min(window_end, until)
+    starts = list(iter_occurrences(rule, start_dt, tz, start_dt, window_end, duration))
+    if not starts:
+        return
+    by_resource = settings["scope"] == "resource"
+    conditions = [
+        "tstzrange(a.start_time, greatest(a.start_time, a.end_time), '[)') && tstzrange(o.start_time, o.end_time, '[)')",
+        _blocking_filter("a"),
+    ]
+    params: List[Any] = [starts, [start + duration for start in starts]]
+    if by_resource:
+        conditions.append("coalesce(a.resource, '') = coalesce(%s, '')")
+        params.append(resource)
+    rows = conn.execute(
+        f"""
+        SELECT DISTINCT a.id
+        FROM unnest(%s::timestamptz[], %s::timestamptz[]) AS o(start_time, end_time)
+        JOIN appointments a ON {' AND '.join(conditions)}
+        ORDER BY a.id
+        LIMIT 50
+        """,
+        tuple(params),
+    ).fetchall()
+    conflict_ids = [r["id"] for r in rows]
+
+    occurrences = expand_occurrences(
+        conn, start_dt, window_end, limit=None, resource=resource if by_resource else _ANY_RESOURCE
+    )
+    busy = sorted(
+        (datetime.fromisoformat(o["start_time"]), datetime.fromisoformat(o["end_time"]), o["series_id"])
+        for o in occurrences
+        if o["status"] not in NON_BLOCKING_STATUSES
+    )
+    conflict_series = set()
+    idx = 0
+    for start in starts:
+        end = start + duration
+        while idx < len(busy) and busy[idx][1] <= start:
+            idx += 1
+        probe = idx
+        while probe < len(busy) and busy[probe][0] < end:
+            if busy[probe][1] > start:
+                conflict_series.add(busy[probe][2])
+            probe += 1
+    if conflict_ids or conflict_series:
+        raise AppointmentConflictError(conflict_ids, sorted(conflict_series))
+
+
+def get_series(series_id: int) -> Dict[str, Any]:
+    with get_db() as conn:
+        row = conn.execute(f"SELECT {SERIES_COLUMNS} FROM appointment_series WHERE id=%s", (series_id,)).fetchone()
+    if not row:
+        raise LookupError("not_found")
+    return row_to_series(row)
+
+
+def delete_series(series_id: int) -> Dict[str, Any]:
+    # Las ocurrencias materializadas se borran en cascada (y quedan como tombstones para /changes).
+    with get_db() as conn:
+        deleted = conn.execute("DELETE FROM appointment_series WHERE id=%s RETURNING id", (series_id,)).fetchone()
+    if not deleted:
+        raise LookupError("not_found")
+    logger.info("Serie eliminada id=%s", series_id)
+    return {"deleted": series_id}
+
+
+def expand_occurrences(
+    conn,
+    range_start: datetime,
+    range_end: datetime,
+    statuses: Optional[List[str]] = None,
+    client_id: Optional[int] = None,
+    limit: Optional[int] = 5000,
+    resource: Any = _ANY_RESOURCE,
+) -> List[Dict[str, Any]]:
+    """
+    Ocurrencias virtuales de las series que tocan [range_start, range_end): solo se expande la ventana
+    pedida y se omiten las ocurrencias canceladas o ya materializadas (esas salen como citas normales).
+    `resource` (por defecto cualquiera) acota al recurso dado; `None` como recurso es "sin recurso".
+    """
+    conditions = ["tstzrange(start_time, until, '[)') && tstzrange(%s, %s, '[)')"]
+    params: List[Any] = [range_start, range_end]
+    if statuses:
+        conditions.append("status::text = ANY(%s)")
+        params.append(list(statuses))
+    if client_id is not None:
+        conditions.append("client_id = %s")
+        params.append(client_id)
+    if resource is not _ANY_RESOURCE:
+        conditions.append("coalesce(resource, '') = coalesce(%s, '')")
+        params.append(resource)
+    try:
+        series_rows = conn.execute(
+            f"SELECT {SERIES_COLUMNS} FROM appointment_series WHERE {' AND '.join(conditions)}",
+            tuple(params),
+        ).fetchall()
+    except errors.UndefinedTable:
+        conn.rollback()
+        return []
+    if not series_rows:
+        return []
+
+    ids = [r["id"] for r in series_rows]
+    lookback = range_start - timedelta(minutes=max(r["duration_minutes"] for r in series_rows))
+    skipped = {
+        (r["series_id"], r["occurrence_start"])
+        for r in conn.execute(
+            """
+            SELECT series_id, occurrence_start FROM appointment_series_exdates
+            WHERE series_id = ANY(%s) AND occurrence_start >= %s AND occurrence_start < %s
+            UNION ALL
+            SELECT series_id, occurrence_start FROM appointments
+            WHERE series_id = ANY(%s) AND occurrence_start >= %s AND occurrence_start < %s
+            """,
+            (ids, lookback, range_end, ids, lookback, range_end),
+        ).fetchall()
+    }
+
+    session_tz = conn.info.timezone
+    items: List[Dict[str, Any]] = []
+    for row in series_rows:
+        tz = _zone(row["timezone"])
+        rule = parse_rrule(row["rrule"], tz)
+        duration = timedelta(minutes=row["duration_minutes"])
+        for start in iter_occurrences(rule, row["start_time"], tz, range_start, range_end, duration):
+            if (row["id"], start) in skipped:
+                continue
+            local_start = start.astimezone(session_tz)
+            items.append(
+                {
+                    "id": None,
+                    "title": row["title"],
+                    "description": row.get("description"),
+                    "start_time": local_start.isoformat(),
+                    "end_time": (local_start + duration).isoformat(),
+                    "status": row.get("status"),
+                    "timezone": row["timezone"],
+                    "client_id": row.get("client_id"),
+                    "resource": row.get("resource"),
+                    "series_id": row["id"],
+                    "occurrence_start": start.isoformat(),
+                    "virtual": True,
+                    "created_at": _iso_datetime(row.get("created_at")),
+                    "updated_at": _iso_datetime(row.get("updated_at")),
+                }
+            )
+            if limit and len(items) >= limit:
+                return items
+    return items
+
+
+def _load_occurrence(conn, series_id: int, occurrence_raw: str):
+    row = conn.execute(f"SELECT {SERIES_COLUMNS} FROM appointment_series WHERE id=%s", (series_id,)).fetchone()
+    if not row:
+        raise LookupError("not_found")
+    tz = _zone(row["timezone"])
+    occurrence = parse_datetime(occurrence_raw)
+    if not is_occurrence(parse_rrule(row["rrule"], tz), row["start_time"], tz, occurrence):
+        raise ValueError("ocurrencia_invalida")
+    return row, occurrence
+
+
+def materialize_occurrence(series_id: int, occurrence_raw: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Convierte una ocurrencia en una cita real (excepcion) aplicando los cambios del payload.
+    Solo las ocurrencias editadas ocupan filas; si ya estaba materializada se actualiza esa cita.
+    """
+    with get_db() as conn:
+        series, occurrence = _load_occurrence(conn, series_id, occurrence_raw)
+        existing = conn.execute(
+            "SELECT id FROM appointments WHERE series_id=%s AND occurrence_start=%s", (series_id, occurrence)
+        ).fetchone()
+        cancelled = conn.execute(
+            "SELECT 1 FROM appointment_series_exdates WHERE series_id=%s AND occurrence_start=%s",
+            (series_id, occurrence),
+        ).fetchone()
+        if not existing and cancelled:
+            raise LookupError("not_found")
+        if not existing:
+            start_dt = parse_datetime(payload["start_time"]) if payload.get("start_time") else occurrence
+            end_dt = (
+                parse_datetime(payload["end_time"])
+                if payload.get("end_time")
+                else start_dt + timedelta(minutes=series["duration_minutes"])
+            )
+            resource = _coerce_resource(payload["resource"]) if "resource" in payload else series["resource"]
+            try:
+                row = conn.execute(
+                    """
+                    INSERT INTO appointments
+                        (title, description, start_time, end_time, status, timezone, client_id, resource, series_id, occurrence_start)
+                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+                    ON CONFLICT (series_id, occurrence_start) WHERE series_id IS NOT NULL DO NOTHING
+                    RETURNING *
+                    """,
+                    (
+                        payload.get("title") or series["title"],
+                        payload["description"] if "description" in payload else series["description"],
+                        start_dt,
+                        end_dt,
+                        normalize_status(payload["status"]) if payload.get("status") else series["status"],
+                        payload.get("timezone") or series["timezone"],
+                        _coerce_client_id(payload["client_id"]) if "client_id" in payload else series["client_id"],
+                        resource,
+                        series_id,
+                        occurrence,
+                    ),
+                ).fetchone()
+            except errors.ExclusionViolation:
+                raise overlap_conflict(conn, start_dt, end_dt, resource)
+            if row:
+                logger.info("Ocurrencia materializada serie=%s inicio=%s id=%s", series_id, occurrence, row["id"])
+                return row_to_appointment_api(row)
+            # Otra request la materializo en paralelo: se aplica el payload sobre esa cita.
+            existing = conn.execute(
+                "SELECT id FROM appointments WHERE series_id=%s AND occurrence_start=%s", (series_id, occurrence)
+            ).fetchone()
+            if not existing:
+                raise LookupError("not_found")
+    if not payload:
+        return api_get(existing["id"])
+    return api_update(existing["id"], payload)
+
+
+def cancel_occurrence(series_id: int, occurrence_raw: str) -> Dict[str, Any]:
+    """Elimina una sola ocurrencia (EXDATE) y su cita materializada si existia."""
+    with get_db() as conn:
+        _, occurrence = _load_occurrence(conn, series_id, occurrence_raw)
+        conn.execute(
+            """
+            INSERT INTO appointment_series_exdates (series_id, occurrence_start)
+            VALUES (%s, %s)
+            ON CONFLICT DO NOTHING
+            """,
+            (series_id, occurrence),
+        )
+        conn.execute(
+            "DELETE FROM appointments WHERE series_id=%s AND occurrence_start=%s", (series_id, occurrence)
+        )
+    return {"series_id": series_id, "deleted_occurrence": occurrence.isoformat()}
@@ -1,5 +1,6 @@
 import logging
 import secrets
+import threading
 from datetime import datetime, timedelta, timezone
 from typing import Dict, List, Optional
 
@@ -13,6 +14,13 @@ from ..utils import slugify
 
 logger = logging.getLogger(__name__)
 
+_PROVISIONED_SCHEMAS = set()
+_PROVISION_LOCK = threading.Lock()
+
+
+class WorkspaceProvisioningError(RuntimeError):
+    """`ensure_workspace_schema` fallo: el schema puede estar a medio migrar y no se debe usar."""
+
 
 def _json_safe(value):
     if isinstance(value, datetime):
@@ -70,6 +78,39 @@ def ensure_user(email: str, display_name: Optional[str] = None, clerk_id: Option
     return dict(row)
 
 
+def _apply_workspace_schema(conn, schema_name: str) -> None:
+    # Dimension de `file_chunks.embedding` al crear la tabla con pgvector (solo para esta transaccion)
+    conn.execute(
+        "SELECT set_config('vetflow.embedding_dimensions', %s, true)", (str(int(config.EMBEDDING_DIMENSIONS)),)
+    )
+    conn.execute(
+        sql.SQL("SELECT {}.ensure_workspace_schema(%s)").format(sql.Identifier(config.CORE_SCHEMA)),
+        (schema_name,),
+    )
+
+
+def ensure_workspace_schema_ready(schema_name: str) -> None:
+    """
+    Aplica `ensure_workspace_schema` (migraciones idempotentes: columnas, indices) una sola vez
+    por proceso y schema, para que los workspaces creados con versiones anteriores reciban
+    los indices nuevos sin repetir DDL en cada request. Si falla lanza WorkspaceProvisioningError
+    (la app responde 503) y el schema no se marca: el siguiente request reintenta.
+    """
+    if not schema_name or schema_name in _PROVISIONED_SCHEMAS:
+        return
+    with _PROVISION_LOCK:
+        if schema_name in _PROVISIONED_SCHEMAS:
+            return
+        try:
+            ensure_core_bootstrap()
+            with get_db(schema=config.CORE_SCHEMA) as conn:
+                _apply_workspace_schema(conn, schema_name)
+        except Exception as ex:
+            logger.exception("No se pudo aplicar ensure_workspace_schema a %s", schema_name)
+            raise WorkspaceProvisioningError(schema_name) from ex
+        _PROVISIONED_SCHEMAS.add(schema_name)
+
+
 def _workspace_stats(schema_name: str) -> Dict[str, int]:
     stats = {"files_count": 0, "appointments_count": 0}
     try:
@@ -410,7 +451,7 @@ def create_workspace(
             """,
             (workspace["id"], owner["id"]),
         )
-        conn.execute("SELECT vetflow_core.ensure_workspace_schema(%s)", (schema_name,))
+        _apply_workspace_schema(conn, schema_name)
 
     result = dict(workspace)
     result["owner_email"] = owner["email"]
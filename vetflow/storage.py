@@ -1,5 +1,6 @@
 import logging
 from datetime import datetime, timedelta, timezone
+from typing import Tuple
 
 from azure.storage.blob import (
     BlobSasPermissions,
@@ -12,6 +13,9 @@ from .config import config
 
 logger = logging.getLogger(__name__)
 
+# Tamano de cada rango descargado al hacer streaming de blobs (acota memoria por descarga).
+STREAM_CHUNK_SIZE = 1024 * 1024
+
 
 def _parse_blob_conn(conn_str: str):
     parts = {}
@@ -36,17 +40,71 @@ def get_blob_container():
     return container_client
 
 
-def upload_blob(blob_name: str, stream, mimetype: str) -> str:
+def upload_blob_with_content_id(blob_name: str, stream, mimetype: str) -> Tuple[str, str]:
+    """
+    Sube el blob y devuelve (url, content_id) tomando el content id de la respuesta de la subida,
+    sin pedir luego las propiedades del blob.
+    """
     container = get_blob_container()
-    container.upload_blob(
-        blob_name,
+    blob_client = container.get_blob_client(blob_name)
+    response = blob_client.upload_blob(
         stream,
         overwrite=False,
         content_settings=ContentSettings(content_type=mimetype),
     )
-    blob_client = container.get_blob_client(blob_name)
     logger.info("Archivo subido a Blob: %s", blob_name)
-    return blob_client.url
+    return blob_client.url, _content_id_from(response.get("content_md5"), response.get("etag"))
+
+
+def upload_blob(blob_name: str, stream, mimetype: str) -> str:
+    return upload_blob_with_content_id(blob_name, stream, mimetype)[0]
+
+
+def _content_id_from(md5, etag) -> str:
+    if md5:
+        return "md5:" + bytes(md5).hex()
+    return "etag:" + str(etag or "").strip('"')
+
+
+def _content_id(props) -> str:
+    """
+    Identificador del contenido de un blob: MD5 si Azure lo tiene (estable ante cambios de metadata),
+    si no el ETag. Una subida en un solo Put Blob devuelve y guarda el MD5; por bloques no hay MD5
+    del blob y ambos lados usan el ETag.
+    """
+    settings = getattr(props, "content_settings", None)
+    md5 = getattr(settings, "content_md5", None) if settings else None
+    return _content_id_from(md5, getattr(props, "etag", None))
+
+
+def get_blob_content_id(blob_path: str) -> str:
+    container = get_blob_container()
+    return _content_id(container.get_blob_client(blob_path).get_blob_properties())
+
+
+def list_blob_content_ids(prefix: str = "") -> dict:
+    """
+    Devuelve {blob_path: content_id} para todos los blobs bajo `prefix` en un solo listado paginado.
+    """
+    container = get_blob_container()
+    return {blob.name: _content_id(blob) for blob in container.list_blobs(name_starts_with=prefix or None)}
+
+
+def iter_blob_chunks(blob_path: str, chunk_size: int = STREAM_CHUNK_SIZE):
+    """
+    Descarga un blob por rangos de `chunk_size` bytes, sin cargarlo completo en memoria.
+    """
+    if not config.AZURE_BLOB_CONN_STR:
+        raise RuntimeError("Falta AZURE_BLOB_CONN_STR")
+    service = BlobServiceClient.from_connection_string(
+        config.AZURE_BLOB_CONN_STR,
+        max_single_get_size=chunk_size,
+        max_chunk_get_size=chunk_size,
+    )
+    blob_client = service.get_blob_client(container=config.AZURE_BLOB_CONTAINER, blob=blob_path)
+    downloader = blob_client.download_blob(max_concurrency=1)
+    for chunk in downloader.chunks():
+        yield chunk
 
 
 def delete_blob(blob_path: str):
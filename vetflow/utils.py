@@ -43,3 +43,29 @@ def slugify(value: Optional[str], fallback: str = "workspace") -> str:
         return fallback
     slug = _slug_regex.sub("-", value.lower()).strip("-")
     return slug or fallback
+
+
+_phone_digits_regex = re.compile(r"\D+")
+
+
+def normalize_phone_e164(raw: Optional[str], default_country_code: str = "") -> Optional[str]:
+    """
+    Normaliza un telefono libre a E.164 (`+<codigo pais><numero>`), o None si no es valido.
+    - `+57 300...` / `0057 300...`: internacional
+    - JID de WhatsApp (`573001234567@s.whatsapp.net`): solo la parte antes de `@`
+    - Numero nacional (<= 10 digitos o con 0 troncal): se antepone `default_country_code` (sin el 0 troncal)
+    """
+    if not raw:
+        return None
+    value = str(raw).split("@", 1)[0].strip()
+    digits = _phone_digits_regex.sub("", value)
+    if value.startswith("+") or digits.startswith("00"):
+        digits = digits[2:] if digits.startswith("00") else digits
+    elif len(digits) <= 10 or digits.startswith("0"):
+        country = _phone_digits_regex.sub("", default_country_code or "")
+        if not country:
+            return None
+        digits = country + digits.lstrip("0")
+    if not 8 <= len(digits) <= 15 or digits.startswith("0"):
+        return None
+    return f"+{digits}"